@@ -0,0 +1,242 @@
+import asyncio
+import sys
+import threading
+import time
+
+import main as core
+from http_pool import get_pool
+from profiles import classify, get_default_profile
+from retry_policy import BAD_CREDENTIALS, LOGIN_LIMIT, LoginFailure, start_jitter
+from state_cache import get_state, link_keys, local_ip
+from tracing import metrics, span, traced_sleep
+
+# Credentials are only sent once the SSID is a college network or a probe
+# got a captive reply. Whichever comes first waits this long for the other,
+# so a probe that finds us online in that time cancels the login
+SSID_GRACE = 0.3
+
+# Login failures that are the portal's final word on these credentials
+REJECTIONS = (BAD_CREDENTIALS, LOGIN_LIMIT)
+
+
+def _resolve(future, result=None, error=None):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def run_in_thread(func, *args):
+    """Run a blocking call on a daemon thread and return an awaitable future.
+
+    Daemon threads are used instead of the loop's executor so an abandoned
+    probe never keeps the process alive after the answer is known.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def worker():
+        try:
+            result, error = func(*args), None
+        except BaseException as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(_resolve, future, result, error)
+        except RuntimeError:
+            pass  # loop already closed, nobody is waiting any more
+
+    threading.Thread(target=worker, daemon=True).start()
+    return future
+
+
+class Authenticator:
+    """Races SSID lookup, connectivity probes and the portal login.
+
+    `await ensure_online()` returns True as soon as a probe sees the
+    internet or the portal confirms the login, and False on an explicit
+    rejection, a non-college network or when `timeout` runs out. The
+    reason is left in `outcome`, and a failed login's kind (see
+    retry_policy) in `failure`.
+
+    Probes climb main's probe ladder (PROBE_URL raced with PROBE_TARGETS,
+    cached verdicts first) and the login goes through main.authenticate(),
+    so the circuit breaker, login rate limit and failure classification
+    apply as in a one-shot run, after its start jitter and login lease.
+    """
+
+    def __init__(self, username, password, probe_timeout=3, timeout=12):
+        self.username = username
+        self.password = password
+        self.probe_timeout = probe_timeout
+        self.timeout = timeout
+        self.ssid = None
+        self.outcome = None
+        self.failure = None
+        self.elapsed = None
+        self._captive = None
+
+    async def _lookup_ssid(self):
+        self.ssid = await run_in_thread(core.get_connected_wifi)
+        return self.ssid
+
+    def _probe(self, timeout, max_age):
+        """True if online, False for a captive reply, None if nothing answered"""
+        profile = (classify(self.ssid) if self.ssid else None) or get_default_profile()
+        return core.check_internet_connection(timeout, profile.get_probe_urls()[0],
+                                              profile=profile, max_age=max_age)
+
+    async def _probe_until_online(self, deadline):
+        """Keep probing with short backoff until the internet is reachable"""
+        step = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # The first probe may reuse main's quick probe; later ones look again
+            online = await run_in_thread(self._probe, min(self.probe_timeout, remaining),
+                                         0 if step else core.PROBE_CACHE_TTL)
+            if online:
+                return True
+            if online is False:
+                self._captive.set()
+            delay = core.LOGIN_CONFIRM_INTERVALS[
+                min(step, len(core.LOGIN_CONFIRM_INTERVALS) - 1)]
+            step += 1
+            await asyncio.sleep(min(delay, max(0, deadline - time.monotonic())))
+
+    async def _speculative_login(self, ssid_task, deadline):
+        """Log in without waiting for the probes to settle.
+
+        The credentials leave once the SSID is a college network or a probe
+        got a captive reply, after SSID_GRACE for the other to catch up; an
+        unknown SSID needs the captive reply. The login can leave before the
+        probe that finds the portal, so it goes to the portal (and uses the
+        dialect) we knew about. If that does not get us on and a probe then
+        finds the portal somewhere else or of another kind, log in once more
+        there.
+        """
+        captive = asyncio.ensure_future(self._captive.wait())
+        try:
+            waiting = {ssid_task, captive}
+            await asyncio.wait(waiting, timeout=max(0, deadline - time.monotonic()),
+                               return_when=asyncio.FIRST_COMPLETED)
+            await asyncio.wait(waiting, timeout=SSID_GRACE)
+            ssid = self.ssid if ssid_task.done() else None
+            profile = classify(ssid) if ssid is not None else None
+            if ssid is not None and profile is None:
+                return 'not-college'
+            if profile is None:
+                await asyncio.wait({captive}, timeout=max(0, deadline - time.monotonic()))
+                if not captive.done():
+                    return 'not-captive'
+        finally:
+            captive.cancel()
+        portal = profile or get_default_profile()
+        tried = (portal.get_portal_url(), portal.get_driver())
+        outcome = await run_in_thread(self._login, portal, True)
+        while outcome == 'login-inconclusive' and time.monotonic() < deadline:
+            await asyncio.sleep(core.LOGIN_CONFIRM_INTERVALS[0])
+            found = (portal.get_portal_url(), portal.get_driver())
+            if found != tried:
+                tried = found
+                outcome = await run_in_thread(self._login, portal, False)
+        return outcome
+
+    def _login(self, profile, first):
+        """One login under the cross-process login lease, as main's one-shot
+        path takes it; returns the outcome"""
+        ip = local_ip(core.split_url(profile.get_portal_url())[0])
+        if first:
+            traced_sleep(start_jitter(profile.get_login_urls()), 'start-jitter')
+        if not core.claim_login(link_keys(ssid=self.ssid, ip=ip)):
+            return 'online'
+        try:
+            core.authenticate(self.username, self.password, profile)
+            return 'logged-in'
+        except LoginFailure as failure:
+            self.failure = failure.kind
+            metrics.incr('failure.' + failure.kind)
+            return 'login-rejected' if failure.kind in REJECTIONS else 'login-inconclusive'
+        finally:
+            get_state().release_login_lease()
+
+    async def ensure_online(self):
+        """Return True once the internet is reachable, logging in if needed"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        get_pool().prewarm(get_default_profile().get_portal_url())
+        self._captive = asyncio.Event()
+        ssid_task = asyncio.ensure_future(self._lookup_ssid())
+        probe_task = asyncio.ensure_future(self._probe_until_online(deadline))
+        login_task = asyncio.ensure_future(self._speculative_login(ssid_task, deadline))
+        pending = {probe_task, login_task, ssid_task}
+        self.outcome = 'timeout'
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(
+                    pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled() or task.exception() is not None:
+                        continue
+                    if task is probe_task and task.result():
+                        if self.outcome != 'logged-in':
+                            self.outcome = 'online'
+                        return True
+                    if task is login_task:
+                        # Keep the login result as the provisional outcome;
+                        # an inconclusive or foreign-network reply leaves
+                        # the decision to the probes
+                        self.outcome = task.result()
+                        if self.outcome in ('logged-in', 'online'):
+                            return True
+                        if self.outcome == 'login-rejected':
+                            return False
+                if probe_task not in pending:
+                    break
+            return False
+        finally:
+            self.elapsed = time.monotonic() - start
+            for task in pending:
+                task.cancel()
+
+    def run(self):
+        """Synchronous wrapper around ensure_online()"""
+        with span('engine') as s:
+            s['online'] = asyncio.run(self.ensure_online())
+            s['outcome'] = self.outcome
+            if self.failure:
+                s['failure'] = self.failure
+            return s['online']
+
+
+def run_engine():
+    """One-shot entry point used by main() when ASYNC_ENGINE is enabled"""
+    credentials = core.load_credentials() or core.setup_credentials()
+    if not credentials:
+        print("\n✗ Setup cancelled or failed")
+        return False
+
+    auth = Authenticator(credentials['username'], credentials['password'])
+    online = auth.run()
+    if online:
+        core.remember_online(auth.ssid)
+    wifi = auth.ssid or 'unknown network'
+    if online:
+        print(f"✓ Online via {wifi} ({auth.outcome}, {auth.elapsed:.2f}s)")
+    else:
+        reason = f"{auth.outcome}: {auth.failure}" if auth.failure else auth.outcome
+        print(f"✗ Could not get online via {wifi} ({reason}, {auth.elapsed:.2f}s)")
+    return online
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if run_engine() else 1)
+    except KeyboardInterrupt:
+        print("\n\nStopped by user")
+        sys.exit(0)
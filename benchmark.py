@@ -0,0 +1,323 @@
+"""Time-to-online benchmarks against the local portal emulator.
+
+Runs the real login paths (attempt_login, main()'s retry loop, monitor
+mode and the asyncio engine) against portal_emulator.PortalEmulator in a
+set of scenarios and reports p50/p95/p99 time-to-online and portal
+requests per run:
+
+    python benchmark.py
+    python benchmark.py --scenarios firewall-4s slow-portal --drivers attempt_login -n 20
+
+It exits non-zero when a run the portal let on is reported as failed, a
+scenario that should get online does not, or one that should not does.
+`--startup` instead measures the cold "already online, exit" path of a
+fresh interpreter and exits non-zero when it is over STARTUP_BUDGET_MS or
+loads any of the HEAVY_MODULES.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import auth_engine
+import main as core
+import state_cache
+import tracing
+from http_pool import get_pool
+from link_monitor import FakeLinkBackend
+from portal_emulator import PortalEmulator
+
+SSID = 'JIIT-AP-BENCH'
+WIFI = {'interface': 'Wi-Fi', 'ssid': SSID, 'bssid': '00:1a:2b:3c:4d:5e', 'signal': 90,
+        'channel': 36, 'state': 'connected', 'ip': '127.0.0.1'}
+USERNAME = 'bench'
+PASSWORD = 'secret'
+
+# Unused local port standing in for a gateway that is down
+DEAD_PORTAL_URL = 'http://127.0.0.1:9/httpclient.html'
+
+# name -> (emulator options, password the client sends, client starts online).
+# 'primary_down' makes PORTAL_URL a dead gateway with the emulator as fallback;
+# 'portal_moved' makes it a dead gateway with no fallback, so only the portal
+# the captive probe names gets the client online. A 'vendor' other than
+# Cyberoam also has to be recognised from the probe reply.
+SCENARIOS = {
+    'fast-portal': ({'latency': 0.02}, PASSWORD, False),
+    'slow-portal': ({'latency': 0.5}, PASSWORD, False),
+    'firewall-4s': ({'latency': 0.02, 'firewall_delay': 4}, PASSWORD, False),
+    'silent-reply': ({'latency': 0.02, 'firewall_delay': 0.5, 'reply_mode': 'silent'},
+                     PASSWORD, False),
+    'inline-probe': ({'latency': 0.02, 'probe_mode': '200'}, PASSWORD, False),
+    'already-online': ({'latency': 0.02}, PASSWORD, True),
+    'wrong-password': ({'latency': 0.02, 'password': PASSWORD}, 'wrong', False),
+    'login-limit': ({'latency': 0.02, 'reply_mode': 'login-limit'}, PASSWORD, False),
+    'overloaded': ({'latency': 0.02, 'reply_mode': 'overloaded'}, PASSWORD, False),
+    'primary-down': ({'latency': 0.02, 'primary_down': True}, PASSWORD, False),
+    'portal-moved': ({'latency': 0.02, 'portal_moved': True}, PASSWORD, False),
+    'portal-moved-inline': ({'latency': 0.02, 'probe_mode': '200', 'portal_moved': True},
+                            PASSWORD, False),
+    'sophos-xg': ({'latency': 0.02, 'vendor': 'sophos', 'probe_mode': '200',
+                   'portal_moved': True}, PASSWORD, False),
+    'fortigate': ({'latency': 0.02, 'vendor': 'fortigate', 'probe_mode': '200',
+                   'portal_moved': True}, PASSWORD, False),
+    'pfsense': ({'latency': 0.02, 'vendor': 'pfsense', 'portal_moved': True}, PASSWORD, False),
+}
+
+# Scenarios in which the portal never lets the client on; every other one
+# has to end up online
+EXPECTED_FAILURES = {'wrong-password', 'login-limit', 'overloaded'}
+
+
+# Cold-start budget for a triggered run that finds the internet already up,
+# in milliseconds of interpreter time: importing main, and main() itself
+STARTUP_BUDGET_MS = {'import': 10, 'run': 40}
+
+# Modules the "already online" path must not load
+HEAVY_MODULES = ['http.client', 'subprocess', 'json', 're', 'asyncio', 'ssl',
+                 'email', 'logging', 'pathlib', 'threading']
+
+STARTUP_SCRIPT = """
+import sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {path!r})
+import main
+t1 = time.perf_counter()
+main.PROBE_URL = {probe_url!r}
+sys.argv = ['main.py']
+main.main()
+t2 = time.perf_counter()
+heavy = [m for m in {heavy!r} if m in sys.modules]
+sys.stderr.write(repr(((t1 - t0) * 1000, (t2 - t1) * 1000, heavy)))
+"""
+
+
+@contextlib.contextmanager
+def patched(obj, **attrs):
+    """Temporarily replace attributes on a module or object"""
+    saved = {name: getattr(obj, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(obj, name, value)
+
+
+def drive_attempt_login(emulator, password):
+    return core.attempt_login(USERNAME, password, SSID)
+
+
+def drive_main(emulator, password):
+    credentials = {'username': USERNAME, 'password': password}
+    with patched(core, load_credentials=lambda: credentials, MONITOR_MODE=False,
+                 ASYNC_ENGINE=False, TRACE_ENABLED=False), patched(sys, argv=['main.py']):
+        try:
+            core.main()
+        except SystemExit as e:
+            return not e.code
+    return None
+
+
+def drive_monitor(emulator, password):
+    with patched(core, SESSION_KEEPALIVE=False, METRICS_PORT=None):
+        core.monitor_wifi_changes(USERNAME, password, FakeLinkBackend([SSID]))
+    return None
+
+
+def drive_engine(emulator, password):
+    auth = auth_engine.Authenticator(USERNAME, password)
+    return auth.run()
+
+
+# Each driver runs one login path to completion and returns what the client
+# believed (True/False), or None when the path does not report a verdict
+DRIVERS = {
+    'attempt_login': drive_attempt_login,
+    'main': drive_main,
+    'monitor': drive_monitor,
+    'engine': drive_engine,
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def run_scenario(name, driver, iterations, max_seconds):
+    options, password, start_online = SCENARIOS[name]
+    options = dict(options)
+    primary_down = options.pop('primary_down', False)
+    portal_moved = options.pop('portal_moved', False)
+    times, failure_times, false_failures, requests = [], [], 0, {}
+    started = time.monotonic()
+    state_file = os.path.join(tempfile.gettempdir(), f"jiit-bench-state-{os.getpid()}")
+    with PortalEmulator(**options) as emulator, \
+            patched(core, PORTAL_URL=(DEAD_PORTAL_URL if primary_down or portal_moved
+                                      else emulator.portal_url),
+                    PORTAL_FALLBACK_URLS=[emulator.portal_url] if primary_down else [],
+                    PROBE_URL=emulator.probe_url, PROBE_TARGETS=[],
+                    get_wifi_link=lambda: dict(WIFI)), \
+            patched(state_cache, _state=state_cache.StateCache(state_file)), \
+            patched(tracing, FLIGHT_DUMP_FILE=state_file + '.flight'):
+        runs = 0
+        while runs < iterations:
+            emulator.reset()
+            get_pool().close()
+            core.forget_probes()
+            # Every run starts cold: no cached link state from the last one
+            for path in (state_file, state_file + '.lock', state_file + '.flight'):
+                if os.path.exists(path):
+                    os.remove(path)
+            if start_online:
+                emulator.online_at = time.monotonic()
+            t0 = time.monotonic()
+            with contextlib.redirect_stdout(io.StringIO()):
+                verdict = DRIVERS[driver](emulator, password)
+            elapsed = time.monotonic() - t0
+            runs += 1
+            # Online means the portal opened the firewall; the client only
+            # "has" it once it has also stopped working on the login
+            if emulator.online_at is not None:
+                times.append(max(elapsed, emulator.online_at - t0))
+                if verdict is False:
+                    false_failures += 1
+            else:
+                failure_times.append(elapsed)
+            for key, count in emulator.counters.items():
+                requests[key] = requests.get(key, 0) + count
+            # Slow failure scenarios (e.g. main()'s retries) get fewer runs
+            if time.monotonic() - started > max_seconds:
+                break
+    return {
+        'scenario': name,
+        'driver': driver,
+        'runs': runs,
+        'failures': len(failure_times),
+        'false_failures': false_failures,
+        'p50': percentile(times, 50),
+        'p95': percentile(times, 95),
+        'p99': percentile(times, 99),
+        # How long a failing run takes to give up
+        'failure_p50': percentile(failure_times, 50),
+        'requests_per_run': {k: round(v / runs, 2) for k, v in sorted(requests.items())},
+    }
+
+
+def format_seconds(value):
+    return '-' if value is None else f"{value * 1000:.0f}ms"
+
+
+def problems(result):
+    """What is wrong with a run_scenario() result, as messages"""
+    found = []
+    label = f"{result['driver']} {result['scenario']}"
+    if result['false_failures']:
+        found.append(f"{label}: {result['false_failures']} runs reported failed while online")
+    if result['scenario'] in EXPECTED_FAILURES:
+        if result['failures'] < result['runs']:
+            found.append(f"{label}: {result['runs'] - result['failures']} runs got online")
+    elif result['failures']:
+        found.append(f"{label}: {result['failures']} of {result['runs']} runs never got online")
+    return found
+
+
+def check_startup(runs):
+    """Time the fast path in fresh interpreters; returns True within budget"""
+    # -S matches the frozen exe, which has no site-packages to scan. Bytecode
+    # is cached like the exe's, so compile time is not counted.
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    imports, totals, walls, heavy = [], [], [], set()
+    with PortalEmulator() as emulator, tempfile.TemporaryDirectory() as home:
+        # State, trace and flight files go to a scratch home, emptied before
+        # each run: a link status left by the last run would skip the probe
+        env['HOME'] = env['USERPROFILE'] = home
+        emulator.online_at = time.monotonic()
+        script = STARTUP_SCRIPT.format(path=os.path.dirname(os.path.abspath(__file__)),
+                                       probe_url=emulator.probe_url, heavy=HEAVY_MODULES)
+        for i in range(runs + 1):
+            for name in os.listdir(home):
+                os.remove(os.path.join(home, name))
+            t0 = time.monotonic()
+            result = subprocess.run([sys.executable, '-S', '-c', script], env=env,
+                                    capture_output=True, text=True)
+            wall = (time.monotonic() - t0) * 1000
+            if result.returncode != 0:
+                print(result.stderr)
+                return False
+            import_ms, run_ms, loaded = eval(result.stderr.strip().splitlines()[-1])
+            if i == 0:
+                continue  # warm-up run writes the bytecode cache
+            imports.append(import_ms)
+            totals.append(run_ms)
+            walls.append(wall)
+            heavy.update(loaded)
+        probes = emulator.counters.get('probe', 0)
+
+    import_ms, run_ms = statistics.median(imports), statistics.median(totals)
+    print(f"import main: {import_ms:.1f}ms (budget {STARTUP_BUDGET_MS['import']}ms)")
+    print(f"main() already online: {run_ms:.1f}ms (budget {STARTUP_BUDGET_MS['run']}ms)")
+    print(f"process wall time: {statistics.median(walls):.1f}ms")
+    ok = import_ms <= STARTUP_BUDGET_MS['import'] and run_ms <= STARTUP_BUDGET_MS['run']
+    if probes != runs + 1:
+        print(f"only {probes} of {runs + 1} runs probed: the fast path was not measured")
+        ok = False
+    if heavy:
+        print(f"heavy modules loaded: {', '.join(sorted(heavy))}")
+        ok = False
+    print("✓ Within startup budget" if ok else "✗ Startup budget exceeded")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-to-online benchmark")
+    parser.add_argument('-n', '--iterations', type=int, default=10)
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument('--drivers', nargs='+', choices=sorted(DRIVERS),
+                        default=['attempt_login', 'main', 'engine', 'monitor'])
+    parser.add_argument('--max-seconds', type=float, default=30,
+                        help="stop repeating a scenario after this much wall time")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    parser.add_argument('--startup', action='store_true',
+                        help="check the cold-start budget of the already-online path")
+    args = parser.parse_args()
+
+    if args.startup:
+        sys.exit(0 if check_startup(args.iterations) else 1)
+
+    results = []
+    for driver in args.drivers:
+        for name in args.scenarios:
+            result = run_scenario(name, driver, args.iterations, args.max_seconds)
+            results.append(result)
+            if not args.json:
+                requests = ', '.join(f"{k}={v}" for k, v in result['requests_per_run'].items())
+                print(f"{driver:<14} {name:<15} runs={result['runs']:<3} "
+                      f"fail={result['failures']:<3} false-fail={result['false_failures']:<3} "
+                      f"p50={format_seconds(result['p50']):>7} "
+                      f"p95={format_seconds(result['p95']):>7} "
+                      f"p99={format_seconds(result['p99']):>7}  {requests}")
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+    found = [message for result in results for message in problems(result)]
+    for message in found:
+        print(f"✗ {message}", file=sys.stderr if args.json else sys.stdout)
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
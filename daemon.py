@@ -0,0 +1,241 @@
+import json
+import socketserver
+import sys
+import threading
+import time
+
+import main as core
+from http_pool import get_pool
+from keepalive import SessionKeepalive
+from profiles import classify
+from state_cache import get_state, local_ip
+from tracing import dump_flight_recorder, event, install_dump_signals, metrics, serve_metrics, span
+
+
+class _TriggerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    # On Windows SO_REUSEADDR would let a second daemon bind the same port
+    allow_reuse_address = sys.platform != 'win32'
+
+
+class AuthDaemon:
+    """Long-lived authenticator fed by trigger clients.
+
+    A trigger only marks work as pending and returns. One worker thread does
+    the work, so a burst of association events collapses into a single
+    check, and an event that arrives mid-login schedules exactly one more.
+    Pooled portal connections, the profile index and the keepalive
+    schedule stay warm between events.
+    """
+
+    def __init__(self, username, password, port=None):
+        self.username = username
+        self.password = password
+        self.port = port or core.DAEMON_PORT
+        self.keepalive = SessionKeepalive(username, password)
+        self.last_wifi = None
+        self.last_segment = None
+        self.online_link = None     # (wifi, profile) we are signed in on
+        self.stats = {'triggers': 0, 'coalesced': 0, 'runs': 0, 'online': 0}
+        self._cond = threading.Condition()
+        self._pending = False
+        self._pending_ssid = None
+        self._stopping = False
+        self._server = None
+
+    def trigger(self, ssid=None):
+        """Queue a check; returns False if one was already pending"""
+        with self._cond:
+            self.stats['triggers'] += 1
+            coalesced = self._pending
+            if coalesced:
+                self.stats['coalesced'] += 1
+            self._pending = True
+            # The newest event knows best which network we are on
+            self._pending_ssid = ssid or None
+            self._cond.notify()
+        metrics.incr('daemon_trigger')
+        return not coalesced
+
+    def handle(self, ssid=None):
+        """Bring the current link online; returns True when it is"""
+        state = get_state()
+        with span('daemon_event') as s:
+            if ssid:
+                # The event can come before DHCP is done: the login reads the
+                # address when each attempt runs
+                wifi = {'ssid': ssid, 'bssid': None, 'ip': None}
+            else:
+                wifi = core.get_wifi_link()
+            current_wifi = wifi['ssid'] if wifi else None
+            segment = (current_wifi, wifi['ip'] or local_ip(core.split_url(core.PORTAL_URL)[0])
+                       ) if wifi else None
+            s['ssid'] = current_wifi
+            event('link_event', ssid=current_wifi, bssid=wifi and wifi.get('bssid'),
+                  signal=wifi and wifi.get('signal'))
+            if segment != self.last_segment:
+                metrics.incr('link_change')
+                # The session stays with the old link, which is out of reach now
+                self.online_link = None
+                # Sockets and portal session from the previous link are of no use now
+                get_pool().close()
+                core.forget_probes()
+                self.keepalive.on_disconnect()
+                self.last_segment = segment
+            elif current_wifi:
+                # Same SSID and client IP: an AP roam, the session carries over
+                metrics.incr('roam')
+            self.last_wifi = current_wifi
+            if not current_wifi:
+                print(f"[{time.strftime('%H:%M:%S')}] WiFi disconnected")
+                return False
+
+            detail = f" via {wifi['bssid']}" if wifi.get('bssid') else ''
+            print(f"\n[{time.strftime('%H:%M:%S')}] Link event on: {current_wifi}{detail}")
+            profile = classify(current_wifi, wifi.get('bssid'))
+            if profile is None:
+                print("→ Not a college WiFi, ignoring")
+                return False
+
+            state.record_attempt(current_wifi)
+            # Retried per failure kind, like a one-shot run: an event that
+            # beat DHCP fails its first attempt as transient
+            s['online'], kind, s['attempts'] = core.login_with_retries(
+                self.username, self.password, None, wifi)
+            if s['online']:
+                self.stats['online'] += 1
+                # The address the login ended up using
+                wifi = dict(wifi, ip=local_ip(core.split_url(core.PORTAL_URL)[0]) or wifi['ip'])
+                self.last_segment = (current_wifi, wifi['ip'])
+                self.online_link = (wifi, profile)
+                if self.keepalive.session_start is None:
+                    self.keepalive.on_login(profile)
+            else:
+                s['failed'] = kind
+                dump_flight_recorder(f"login failed on {current_wifi}")
+            return s['online']
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                ssid = self._pending_ssid
+                self._pending = False
+                self._pending_ssid = None
+            self.stats['runs'] += 1
+            try:
+                self.handle(ssid)
+            except Exception as e:
+                print(f"Error handling link event: {e}")
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            timeout = 2
+
+            def handle(self):
+                try:
+                    command, _, arg = self.rfile.readline(256).decode().strip().partition(' ')
+                except (OSError, UnicodeDecodeError):
+                    return
+                command = command.upper()
+                if command == 'TRIGGER':
+                    queued = daemon.trigger(arg.strip() or None)
+                    self.wfile.write(b'OK queued\n' if queued else b'OK coalesced\n')
+                elif command == 'STATUS':
+                    self.wfile.write(f"OK {json.dumps(daemon.status())}\n".encode())
+                elif command == 'STOP':
+                    self.wfile.write(b'OK stopping\n')
+                    threading.Thread(target=daemon.stop, daemon=True).start()
+                else:
+                    self.wfile.write(b'ERR unknown command\n')
+
+        return Handler
+
+    def sign_out(self, reason):
+        """Best-effort portal logout of the link we are signed in on"""
+        if self.online_link is None or not core.LOGOUT_ON_SHUTDOWN:
+            return False
+        wifi, profile = self.online_link
+        source_address = (wifi['ip'], 0) if wifi.get('ip') else None
+        if core.logout_from_portal(self.username, profile, source_address, reason=reason):
+            print(f"✓ Signed out of {wifi['ssid']}")
+            self.online_link = None
+            return True
+        return False
+
+    def status(self):
+        with self._cond:
+            return dict(self.stats, wifi=self.last_wifi, pending=self._pending)
+
+    def serve(self):
+        """Listen for triggers until stop(); False if the port is taken"""
+        try:
+            self._server = _TriggerServer(('127.0.0.1', self.port), self._handler())
+        except OSError as e:
+            print(f"✗ Cannot listen on 127.0.0.1:{self.port} ({e}). Is a daemon already running?")
+            return False
+
+        worker = threading.Thread(target=self._work, daemon=True)
+        worker.start()
+        if core.SESSION_KEEPALIVE:
+            self.keepalive.start()
+        # Settle whatever link we started on without waiting for an event
+        self.trigger()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self.keepalive.stop()
+            with self._cond:
+                self._stopping = True
+                self._cond.notify()
+        return True
+
+    def stop(self):
+        # Stopping the daemon frees the account's login slot, like a shutdown
+        self.sign_out('stop')
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def run_daemon():
+    """Entry point for `main.py --daemon`"""
+    credentials = core.load_credentials() or core.setup_credentials()
+    if not credentials:
+        print("\n✗ Setup cancelled or failed")
+        return False
+
+    print("\n" + "=" * 50)
+    print(f"DAEMON MODE - Listening on 127.0.0.1:{core.DAEMON_PORT}")
+    print("Press Ctrl+C to stop")
+    print("=" * 50 + "\n")
+
+    if core.METRICS_PORT:
+        try:
+            serve_metrics(core.METRICS_PORT)
+            print(f"Metrics: http://127.0.0.1:{core.METRICS_PORT}/metrics")
+        except OSError as e:
+            print(f"Metrics endpoint unavailable: {e}")
+
+    daemon = AuthDaemon(credentials['username'], credentials['password'])
+    install_dump_signals()
+    # Windows: logoff and shutdown, which never arrive as SIGTERM there
+    core.install_shutdown_handler(daemon.sign_out)
+    try:
+        return daemon.serve()
+    except KeyboardInterrupt:
+        print("\n\nDaemon stopped by user")
+        return True
+    except SystemExit:
+        # SIGTERM: the machine is shutting down
+        daemon.sign_out('shutdown')
+        raise
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_daemon() else 1)
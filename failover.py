@@ -0,0 +1,131 @@
+import queue
+import threading
+import time
+
+from retry_policy import breaker_wait, hold_until
+from state_cache import get_state
+from tracing import metrics
+
+# Portal endpoints are ranked by score = EWMA latency * (1 + FAILURE_PENALTY *
+# failure rate); endpoints never seen before count as UNKNOWN_LATENCY, so a
+# gateway known to be fast beats an untried one and a failing one does not
+UNKNOWN_LATENCY = 0.5
+FAILURE_PENALTY = 10
+
+# While other endpoints remain, one gets this many times its typical
+# latency (at least FAILOVER_MIN_TIMEOUT seconds) before we move on;
+# the last endpoint gets the caller's full timeout
+FAILOVER_LATENCY_FACTOR = 5
+FAILOVER_MIN_TIMEOUT = 2
+
+# Hedging: if the best endpoint has not answered within its HEDGE_PERCENTILE
+# latency, the same login is also sent to the next one and the first good
+# answer wins. Until HEDGE_MIN_SAMPLES latencies are known HEDGE_DEFAULT_DELAY
+# is used.
+HEDGE_PERCENTILE = 90
+HEDGE_MIN_SAMPLES = 5
+HEDGE_DEFAULT_DELAY = 1.0
+HEDGE_MIN_DELAY = 0.2
+
+
+def portal_score(health):
+    if not health:
+        return UNKNOWN_LATENCY
+    return health['latency'] * (1 + FAILURE_PENALTY * health.get('fail_rate', 0))
+
+
+def rank_endpoints(urls, first=None):
+    """Order endpoints best first: closed breakers, then `first` (the portal
+    the network itself pointed us to), then score, then config order"""
+    state = get_state()
+    ranked = []
+    for order, url in enumerate(urls):
+        ranked.append((breaker_wait(url) > 0, url != first,
+                       portal_score(state.portal_health(url)), order, url))
+    ranked.sort()
+    return [url for _, _, _, _, url in ranked]
+
+
+def endpoint_timeout(url, timeout):
+    health = get_state().portal_health(url)
+    if not health:
+        return min(timeout, FAILOVER_MIN_TIMEOUT)
+    return min(timeout, max(FAILOVER_MIN_TIMEOUT, FAILOVER_LATENCY_FACTOR * health['latency']))
+
+
+def hedge_delay(url):
+    samples = sorted((get_state().portal_health(url) or {}).get('samples', []))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    index = min(len(samples) - 1, len(samples) * HEDGE_PERCENTILE // 100)
+    return max(HEDGE_MIN_DELAY, samples[index])
+
+
+def _attempt(send, url, timeout):
+    """One request, recorded in the portal's health; returns (response, error)"""
+    start = time.monotonic()
+    try:
+        response = send(url, timeout)
+    except Exception as e:
+        get_state().record_portal(url, time.monotonic() - start, False)
+        return None, e
+    ok = response.status_code < 500
+    get_state().record_portal(url, time.monotonic() - start, ok, hold_until(response))
+    return response, None
+
+
+def send_with_failover(urls, send, timeout=10, hedge=False, first=None):
+    """Call `send(url, timeout)` on the best endpoint (`first`, if given and
+    its breaker is closed), failing over down the ranking.
+
+    A response with a status below 500 is returned as soon as one arrives.
+    If every endpoint fails, the last 5xx response is returned, or the last
+    error raised. With `hedge`, a slow best endpoint gets a parallel
+    request to the runner-up (note that both may then sign the user in).
+    """
+    ranked = rank_endpoints(urls, first)
+    results = queue.Queue()
+    last_response, last_error = None, None
+
+    def worker(url, t):
+        results.put(_attempt(send, url, t))
+
+    i = 0
+    while i < len(ranked):
+        url = ranked[i]
+        is_last = i == len(ranked) - 1
+        t = timeout if is_last else endpoint_timeout(url, timeout)
+        if hedge and not is_last:
+            threading.Thread(target=worker, args=(url, t), daemon=True).start()
+            try:
+                outcomes = [results.get(timeout=hedge_delay(url))]
+                i += 1
+            except queue.Empty:
+                # Race the runner-up against the request still in flight
+                metrics.incr('portal_hedge')
+                alternate = ranked[i + 1]
+                threading.Thread(target=worker, daemon=True, args=(
+                    alternate, timeout if i + 1 == len(ranked) - 1
+                    else endpoint_timeout(alternate, timeout))).start()
+                outcomes = []
+                for _ in range(2):
+                    outcome = results.get()
+                    if outcome[0] is not None and outcome[0].status_code < 500:
+                        outcomes = [outcome]
+                        break
+                    outcomes.append(outcome)
+                i += 2
+        else:
+            outcomes = [_attempt(send, url, t)]
+            i += 1
+
+        for response, error in outcomes:
+            if response is not None and response.status_code < 500:
+                return response
+            last_response, last_error = response or last_response, error or last_error
+        if i < len(ranked):
+            metrics.incr('portal_failover')
+
+    if last_response is not None:
+        return last_response
+    raise last_error
@@ -0,0 +1,238 @@
+"""Log in many machines/accounts at once.
+
+For rows of lab and kiosk machines behind one portal: after a power cut or
+a portal restart, one controller re-authenticates all of them with at most
+`--max-in-flight` logins running at a time, instead of every machine
+sleeping through main()'s retry loop on its own. Also usable as a bulk
+credential check.
+
+The fleet file is a JSON list, one entry per machine/account:
+
+    [
+      {"name": "lab1-pc01", "username": "21103001", "password": "...",
+       "source_address": "10.20.1.11", "profile": "jiit"},
+      {"name": "kiosk-2", "username": "kiosk2", "password": "...",
+       "portal_url": "http://172.16.68.6:8090/httpclient.html"}
+    ]
+
+`source_address` binds that entry's connections to a local address (for a
+controller with one address per machine); `profile` and `portal_url` pick
+the portal, defaulting to the built-in profile.
+
+    python fleet.py fleet.json --max-in-flight 20
+    python fleet.py --emulate 200 --max-in-flight 50     # against portal_emulator
+"""
+import argparse
+import http.client
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import main as core
+from http_pool import ConnectionPool, get_pool
+from profiles import DEFAULT_PROFILE, PortalProfile, get_profile_index
+from retry_policy import (BAD_CREDENTIALS, LOGIN_LIMIT, OVERLOADED, TRANSIENT, LoginFailure,
+                          classify_error, classify_reply, classify_status)
+from tracing import metrics
+
+# Logins running at once; the portal, not this machine, is the bottleneck
+DEFAULT_MAX_IN_FLIGHT = 20
+
+# Per-entry outcomes: the portal signed the account in, gave no verdict,
+# failed for one of retry_policy's reasons, or the entry itself is unusable
+# (e.g. an unknown profile), which no retry will fix
+CONFIG_ERROR = 'config-error'
+OUTCOMES = ['online', 'unconfirmed', BAD_CREDENTIALS, LOGIN_LIMIT, OVERLOADED, TRANSIENT,
+            CONFIG_ERROR]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def load_fleet(path):
+    """Read the fleet file; entries without a name are named after the user"""
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    for i, entry in enumerate(entries):
+        if not entry.get('username') or 'password' not in entry:
+            raise ValueError(f"entry {i} needs a username and a password")
+        entry.setdefault('name', entry['username'])
+    return entries
+
+
+class FleetLogin:
+    """Run one portal login per fleet entry with bounded parallelism.
+
+    Entries that share a source address share a connection pool, so the
+    portal sees a handful of kept-alive sockets rather than one per login.
+    """
+
+    def __init__(self, entries, max_in_flight=DEFAULT_MAX_IN_FLIGHT, timeout=10,
+                 portal_url=None):
+        self.entries = entries
+        self.max_in_flight = max(1, max_in_flight)
+        self.timeout = timeout
+        self.portal_url = portal_url
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _profile(self, entry):
+        profiles = get_profile_index().profiles
+        profile = profiles.get(entry.get('profile', DEFAULT_PROFILE))
+        if profile is None:
+            raise ValueError(f"unknown profile {entry['profile']!r}")
+        portal_url = entry.get('portal_url') or self.portal_url
+        if portal_url:
+            # An explicit portal is not overridden by one a captive probe discovered
+            profile = PortalProfile(profile.name, portal_url, profile.form, profile.probe_urls,
+                                    discover=False, driver=profile.get_driver().name)
+        return profile
+
+    def _pool(self, source_address):
+        if not source_address:
+            return get_pool()
+        with self._lock:
+            pool = self._pools.get(source_address)
+            if pool is None:
+                pool = self._pools[source_address] = ConnectionPool(
+                    source_address=(source_address, 0))
+            return pool
+
+    def login(self, entry):
+        """Log one entry in; returns its result dict"""
+        result = {'name': entry['name'], 'username': entry['username']}
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        start = time.monotonic()
+        try:
+            profile = self._profile(entry)
+            response = core.post_credentials(entry['username'], entry['password'],
+                                             timeout=self.timeout, profile=profile,
+                                             pool=self._pool(entry.get('source_address')))
+            verdict = profile.get_driver().parse_login(response)
+            result['outcome'] = classify_status(response.status_code) or {
+                True: 'online', None: 'unconfirmed'}.get(verdict) or classify_reply(response.text)
+        except LoginFailure as e:
+            result['outcome'] = e.kind if e.kind in OUTCOMES else TRANSIENT
+            result['error'] = f"{type(e).__name__}: {e}"
+        except (OSError, http.client.HTTPException) as e:
+            result['outcome'] = classify_error(e)
+            result['error'] = f"{type(e).__name__}: {e}"
+        except ValueError as e:
+            result['outcome'] = CONFIG_ERROR
+            result['error'] = f"{type(e).__name__}: {e}"
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        result['seconds'] = round(time.monotonic() - start, 4)
+        metrics.incr('fleet.' + result['outcome'])
+        return result
+
+    def run(self, report=None):
+        """Log in every entry; returns (results in fleet order, summary)"""
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            results = []
+            for result in executor.map(self.login, self.entries):
+                results.append(result)
+                if report:
+                    report(result)
+        elapsed = time.monotonic() - start
+        for pool in self._pools.values():
+            pool.close()
+        return results, self.summarize(results, elapsed)
+
+    def summarize(self, results, elapsed):
+        counts = dict.fromkeys(OUTCOMES, 0)
+        for result in results:
+            counts[result['outcome']] += 1
+        latencies = [r['seconds'] for r in results if 'error' not in r]
+        return {
+            'total': len(results),
+            'counts': counts,
+            'seconds': round(elapsed, 3),
+            'logins_per_second': round(len(results) / elapsed, 1) if elapsed else None,
+            'max_in_flight': self.max_in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+        }
+
+
+def print_result(result):
+    mark = '✓' if result['outcome'] == 'online' else '✗'
+    detail = f" ({result['error']})" if 'error' in result else ''
+    print(f"{mark} {result['name']:<20} {result['username']:<16} "
+          f"{result['outcome']:<12} {result['seconds'] * 1000:.0f}ms{detail}")
+
+
+def print_summary(summary):
+    counts = ', '.join(f"{k}={v}" for k, v in summary['counts'].items())
+    print("=" * 50)
+    print(f"{summary['total']} logins in {summary['seconds']:.2f}s "
+          f"({summary['logins_per_second']}/s), {counts}")
+    print(f"In flight: peak {summary['peak_in_flight']} of {summary['max_in_flight']} allowed")
+    if summary['p50'] is not None:
+        print(f"Login latency: p50 {summary['p50'] * 1000:.0f}ms, "
+              f"p95 {summary['p95'] * 1000:.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent portal login for many machines")
+    parser.add_argument('fleet', nargs='?', help="JSON fleet file (see fleet.py)")
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument('--timeout', type=float, default=10, help="seconds per login")
+    parser.add_argument('--portal-url', help="portal for entries without their own")
+    parser.add_argument('--emulate', type=int, metavar='N',
+                        help="log N generated accounts into a local portal emulator")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="emulator reply latency with --emulate")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    if not args.fleet and not args.emulate:
+        parser.error("a fleet file or --emulate N is required")
+
+    emulator = None
+    if args.emulate:
+        from portal_emulator import PortalEmulator
+
+        entries = [{'name': f"host-{i:03d}", 'username': f"user{i:03d}", 'password': 'secret'}
+                   for i in range(1, args.emulate + 1)]
+        emulator = PortalEmulator(latency=args.latency, accounts={
+            e['username']: e['password'] for e in entries}).start()
+        args.portal_url = emulator.portal_url
+    else:
+        entries = load_fleet(args.fleet)
+
+    fleet = FleetLogin(entries, args.max_in_flight, args.timeout, args.portal_url)
+    try:
+        results, summary = fleet.run(None if args.json else print_result)
+        if emulator is not None:
+            summary['portal_peak_in_flight'] = emulator.peak_in_flight
+    finally:
+        if emulator is not None:
+            emulator.stop()
+
+    if args.json:
+        print(json.dumps({'results': results, 'summary': summary}, indent=2))
+    else:
+        print_summary(summary)
+        if emulator is not None:
+            print(f"Portal emulator peak concurrency: {summary['portal_peak_in_flight']}")
+    return summary['counts']['online'] == summary['total']
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
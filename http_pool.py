@@ -0,0 +1,211 @@
+import http.client
+import select
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+USER_AGENT = 'JIIT-AutoAuth'
+
+# Idle sockets older than this are closed instead of reused; Cyberoam
+# drops idle keep-alive connections well before a minute
+MAX_IDLE = 30
+
+# Errors that mean a kept-alive socket was closed under us; the request
+# is retried once on a fresh connection
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+
+class Response:
+    """Fully-read HTTP response plus how the connection was obtained
+    (`peer` is the server address it came from, if known)"""
+
+    def __init__(self, status, headers, body, reused, elapsed, url, peer=None):
+        self.status_code = status
+        self.headers = headers
+        self.content = body
+        self.reused = reused
+        self.elapsed = elapsed
+        self.url = url
+        self.peer = peer
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+
+def _split(url):
+    parts = urlsplit(url)
+    scheme = parts.scheme or 'http'
+    port = parts.port or (443 if scheme == 'https' else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return (scheme, parts.hostname, port), path
+
+
+def _is_dead(conn):
+    """A kept-alive socket that is readable while idle has been closed by the peer"""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections shared by probes, login and verification.
+
+    One pool lives for the whole process (see get_pool()), so monitor mode
+    reuses the same portal socket across iterations. `prewarm()` opens a
+    socket in the background so the TCP handshake overlaps other work.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE, source_address=None):
+        self.max_idle = max_idle
+        self.source_address = source_address
+        self._idle = {}
+        self._warming = {}
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'reused': 0, 'new': 0, 'retried': 0}
+
+    def _new_connection(self, key, timeout):
+        (scheme, host, port), source_address = key
+        cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return cls(host, port, timeout=timeout, source_address=source_address)
+
+    def _checkout(self, key):
+        """Take an idle, still-open connection for `key`, or None"""
+        with self._lock:
+            stack = self._idle.get(key, [])
+            while stack:
+                conn, since = stack.pop()
+                if time.monotonic() - since <= self.max_idle and not _is_dead(conn):
+                    return conn
+                conn.close()
+        return None
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            self._idle.setdefault(key, []).append((conn, time.monotonic()))
+
+    def _key(self, url, source_address):
+        """Idle connections are kept per origin and local address"""
+        origin, path = _split(url)
+        return (origin, source_address or self.source_address), path
+
+    def prewarm(self, url, timeout=3, source_address=None):
+        """Open a connection to `url`'s host in the background"""
+        key, _ = self._key(url, source_address)
+        with self._lock:
+            if self._idle.get(key) or key in self._warming:
+                return
+            ready = self._warming[key] = threading.Event()
+
+        def connect():
+            conn = self._new_connection(key, timeout)
+            try:
+                conn.connect()
+                self._checkin(key, conn)
+            except OSError:
+                conn.close()
+            finally:
+                with self._lock:
+                    self._warming.pop(key, None)
+                ready.set()
+
+        threading.Thread(target=connect, daemon=True).start()
+
+    def request(self, method, url, data=None, headers=None, timeout=5, source_address=None):
+        """Send one request and return a Response with `reused` set.
+
+        `source_address` (ip, port) binds the connection to one local
+        address, i.e. one interface; connections are only reused for
+        requests bound the same way.
+        """
+        key, path = self._key(url, source_address)
+        body = urlencode(data) if isinstance(data, dict) else data
+        if isinstance(body, str):
+            # Bytes let http.client send headers and body in one segment,
+            # avoiding a Nagle/delayed-ACK stall on every POST
+            body = body.encode()
+        send_headers = {'User-Agent': USER_AGENT, 'Accept': '*/*'}
+        if isinstance(data, dict):
+            send_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        send_headers.update(headers or {})
+
+        start = time.monotonic()
+        conn = self._checkout(key)
+        if conn is None:
+            # A prewarm in flight is cheaper to wait for than a second handshake
+            with self._lock:
+                ready = self._warming.get(key)
+            if ready is not None and ready.wait(timeout):
+                conn = self._checkout(key)
+
+        for attempt in range(2):
+            reused = conn is not None
+            if conn is None:
+                conn = self._new_connection(key, timeout)
+            elif conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request(method, path, body=body, headers=send_headers)
+                resp = conn.getresponse()
+                content = resp.read()
+            except STALE_ERRORS:
+                conn.close()
+                conn = None
+                if not reused or attempt:
+                    raise
+                with self._lock:
+                    self.stats['retried'] += 1
+                continue
+            except BaseException:
+                conn.close()
+                raise
+
+            with self._lock:
+                self.stats['requests'] += 1
+                self.stats['reused' if reused else 'new'] += 1
+            try:
+                peer = conn.sock.getpeername()[0]
+            except (AttributeError, OSError):
+                peer = None
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+            return Response(resp.status, resp_headers, content, reused,
+                            time.monotonic() - start, url, peer)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def close(self, source_ip=None):
+        """Close every idle connection, or only those bound to `source_ip`"""
+        with self._lock:
+            for key in list(self._idle):
+                source_address = key[1]
+                if source_ip is None or (source_address and source_address[0] == source_ip):
+                    for conn, _ in self._idle.pop(key):
+                        conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process-wide shared pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
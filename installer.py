@@ -1,5 +1,6 @@
 import os
 import sys
+import shlex
 import subprocess
 from pathlib import Path
 import shutil
@@ -41,24 +42,57 @@ def get_exe_path():
         return exe_path
 
 
-def create_task_scheduler_task(exe_path):
-    """Create the Task Scheduler task using XML"""
-    
-    task_name = "JIIT-AutoAuth"
-    
-    # XML for the task
-    task_xml = f'''<?xml version="1.0" encoding="UTF-16"?>
+def get_linux_command():
+    """Command line that runs the main program on Linux"""
+    if getattr(sys, 'frozen', False):
+        return [str(Path(sys.executable).parent / "JIIT-AutoAuth")]
+    return [sys.executable, str(Path(__file__).resolve().parent / "main.py")]
+
+
+TASK_NAME = "JIIT-AutoAuth"
+# Daemon mode only: the resident program, started at logon
+DAEMON_TASK_NAME = "JIIT-AutoAuth-Daemon"
+
+WLAN_EVENT_TRIGGER = """    <EventTrigger>
+      <Enabled>true</Enabled>
+      <Subscription>&lt;QueryList&gt;&lt;Query Id="0" Path="Microsoft-Windows-WLAN-AutoConfig/Operational"&gt;&lt;Select Path="Microsoft-Windows-WLAN-AutoConfig/Operational"&gt;*[System[Provider[@Name='Microsoft-Windows-WLAN-AutoConfig'] and EventID=8001]]&lt;/Select&gt;&lt;/Query&gt;&lt;/QueryList&gt;</Subscription>{delay}
+      <ValueQueries>
+        <Value name="ssid">Event/EventData/Data[@Name='SSID']</Value>
+        <Value name="adapter">Event/EventData/Data[@Name='InterfaceDescription']</Value>
+      </ValueQueries>
+    </EventTrigger>"""
+
+# Event 8001 already names the network and adapter; passing them on saves
+# every triggered run a `netsh wlan show interfaces`. The event only has the
+# adapter's description (netsh's "Description"), not its interface name,
+# so it goes in --adapter rather than --interface
+EVENT_ARGUMENTS = '--ssid "$(ssid)" --adapter "$(adapter)"'
+
+# The daemon's control port (main.DAEMON_PORT). Its STOP command signs the
+# portal session out before exiting; `schtasks /End` kills it outright, so
+# STOP goes first. Nothing authenticates STOP: any local process can send it.
+DAEMON_PORT = 47611
+# Seconds to wait for it to exit (the logout takes up to LOGOUT_TIMEOUT)
+DAEMON_STOP_WAIT = 4
+
+LOGON_TRIGGER = """    <LogonTrigger>
+      <Enabled>true</Enabled>
+    </LogonTrigger>"""
+
+
+def build_task_xml(task_name, description, trigger, exe_path, arguments='',
+                   instances='IgnoreNew', time_limit='PT1H', needs_network=True):
+    """Task Scheduler XML for one task running the main executable"""
+    if arguments:
+        arguments = f"\n      <Arguments>{arguments}</Arguments>"
+    return f'''<?xml version="1.0" encoding="UTF-16"?>
 <Task version="1.2" xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task">
   <RegistrationInfo>
-    <Description>Automatically logs into JIIT college WiFi when connected</Description>
+    <Description>{description}</Description>
     <URI>\\{task_name}</URI>
   </RegistrationInfo>
   <Triggers>
-    <EventTrigger>
-      <Enabled>true</Enabled>
-      <Subscription>&lt;QueryList&gt;&lt;Query Id="0" Path="Microsoft-Windows-WLAN-AutoConfig/Operational"&gt;&lt;Select Path="Microsoft-Windows-WLAN-AutoConfig/Operational"&gt;*[System[Provider[@Name='Microsoft-Windows-WLAN-AutoConfig'] and EventID=8001]]&lt;/Select&gt;&lt;/Query&gt;&lt;/QueryList&gt;</Subscription>
-      <Delay>PT5S</Delay>
-    </EventTrigger>
+{trigger}
   </Triggers>
   <Principals>
     <Principal id="Author">
@@ -67,12 +101,12 @@ def create_task_scheduler_task(exe_path):
     </Principal>
   </Principals>
   <Settings>
-    <MultipleInstancesPolicy>IgnoreNew</MultipleInstancesPolicy>
+    <MultipleInstancesPolicy>{instances}</MultipleInstancesPolicy>
     <DisallowStartIfOnBatteries>false</DisallowStartIfOnBatteries>
     <StopIfGoingOnBatteries>false</StopIfGoingOnBatteries>
     <AllowHardTerminate>true</AllowHardTerminate>
     <StartWhenAvailable>true</StartWhenAvailable>
-    <RunOnlyIfNetworkAvailable>true</RunOnlyIfNetworkAvailable>
+    <RunOnlyIfNetworkAvailable>{str(needs_network).lower()}</RunOnlyIfNetworkAvailable>
     <IdleSettings>
       <StopOnIdleEnd>false</StopOnIdleEnd>
       <RestartOnIdle>false</RestartOnIdle>
@@ -82,18 +116,21 @@ def create_task_scheduler_task(exe_path):
     <Hidden>false</Hidden>
     <RunOnlyIfIdle>false</RunOnlyIfIdle>
     <WakeToRun>false</WakeToRun>
-    <ExecutionTimeLimit>PT1H</ExecutionTimeLimit>
+    <ExecutionTimeLimit>{time_limit}</ExecutionTimeLimit>
     <Priority>7</Priority>
   </Settings>
   <Actions Context="Author">
     <Exec>
-      <Command>{exe_path}</Command>
+      <Command>{exe_path}</Command>{arguments}
     </Exec>
   </Actions>
 </Task>'''
-    
+
+
+def register_task(task_name, task_xml):
+    """Replace the Task Scheduler task `task_name` with `task_xml`"""
     # Save XML to temp file
-    temp_xml = Path.home() / "temp_task.xml"
+    temp_xml = Path.home() / f"temp_{task_name}.xml"
     with open(temp_xml, 'w', encoding='utf-16') as f:
         f.write(task_xml)
     
@@ -106,28 +143,167 @@ def create_task_scheduler_task(exe_path):
         )
         
         # Create the task
-        result = subprocess.run(
+        subprocess.run(
             ['schtasks', '/Create', '/XML', str(temp_xml), '/TN', task_name],
             capture_output=True,
             text=True,
             check=True
         )
-        
-        # Clean up temp file
-        temp_xml.unlink()
-        
-        return True, "Task created successfully!"
+        return True, f"Task {task_name} created successfully!"
     
     except subprocess.CalledProcessError as e:
-        return False, f"Error creating task: {e.stderr}"
+        return False, f"Error creating task {task_name}: {e.stderr}"
     except Exception as e:
         return False, f"Unexpected error: {str(e)}"
     finally:
-        # Clean up temp file if it still exists
+        # Clean up temp file
         if temp_xml.exists():
             temp_xml.unlink()
 
 
+def stop_daemon(port=DAEMON_PORT, wait=DAEMON_STOP_WAIT):
+    """Ask a running daemon to sign out of the portal and exit; True once
+    nothing listens on its port any more"""
+    import socket
+    import time
+    
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=1) as sock:
+            sock.sendall(b'STOP\n')
+            sock.recv(64)
+    except OSError:
+        return True  # no daemon running
+    
+    # It answers before signing out; wait for the port to close
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+        except OSError:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def create_task_scheduler_task(exe_path, mode='standalone'):
+    """Create the Task Scheduler task(s) for the chosen install mode"""
+    if mode == 'standalone':
+        # Remove a daemon left over from an earlier daemon-mode install
+        stop_daemon()
+        subprocess.run(['schtasks', '/End', '/TN', DAEMON_TASK_NAME], capture_output=True, check=False)
+        subprocess.run(['schtasks', '/Delete', '/TN', DAEMON_TASK_NAME, '/F'],
+                       capture_output=True, check=False)
+        return register_task(TASK_NAME, build_task_xml(
+            TASK_NAME,
+            "Automatically logs into JIIT college WiFi when connected",
+            WLAN_EVENT_TRIGGER.format(delay='\n      <Delay>PT5S</Delay>'),
+            exe_path, f'--background {EVENT_ARGUMENTS}',
+        ))
+    
+    # The daemon runs for the whole session and settles the link on its own
+    success, message = register_task(DAEMON_TASK_NAME, build_task_xml(
+        DAEMON_TASK_NAME,
+        "Resident JIIT WiFi authenticator that handles connection events",
+        LOGON_TRIGGER, exe_path, '--daemon --background', time_limit='PT0S', needs_network=False,
+    ))
+    if not success:
+        return success, message
+    
+    # Triggers only hand the event over, so they need no delay, and
+    # overlapping ones are let through: the daemon coalesces them
+    success, message = register_task(TASK_NAME, build_task_xml(
+        TASK_NAME,
+        "Forwards JIIT WiFi connection events to the resident authenticator",
+        WLAN_EVENT_TRIGGER.format(delay=''),
+        exe_path, f'--trigger --background {EVENT_ARGUMENTS}', instances='Parallel',
+        time_limit='PT5M',
+    ))
+    if not success:
+        return success, message
+    
+    # Start the daemon now rather than at the next logon
+    subprocess.run(['schtasks', '/Run', '/TN', DAEMON_TASK_NAME], capture_output=True, check=False)
+    return True, "Daemon and trigger tasks created successfully!"
+
+
+# Linux: NetworkManager runs every executable script in this directory, as
+# root, with the interface and the action as arguments
+NM_DISPATCHER_DIR = '/etc/NetworkManager/dispatcher.d'
+NM_DISPATCHER_SCRIPT = '90-jiit-autoauth'
+
+NM_DISPATCHER_HOOK = """#!/bin/sh
+# Installed by the JIIT WiFi Auto-Authenticator installer
+[ "$2" = "up" ] || exit 0
+# Only WiFi connections have an SSID
+SSID=$(nmcli -g 802-11-wireless.ssid connection show uuid "$CONNECTION_UUID" 2>/dev/null)
+[ -n "$SSID" ] || exit 0
+IP=${{IP4_ADDRESS_0%%/*}}
+runuser -u {user} -- {command} --background --ssid "$SSID" --interface "$1" --ip "$IP" >/dev/null 2>&1 &
+"""
+
+
+def install_dispatcher_hook(command, user):
+    """Register a NetworkManager dispatcher script that runs `command` as
+    `user` whenever a WiFi connection comes up"""
+    if not os.path.isdir(NM_DISPATCHER_DIR):
+        return False, f"NetworkManager not found ({NM_DISPATCHER_DIR} is missing)"
+    
+    hook = Path(NM_DISPATCHER_DIR) / NM_DISPATCHER_SCRIPT
+    try:
+        hook.write_text(NM_DISPATCHER_HOOK.format(user=shlex.quote(user),
+                                                  command=shlex.join(command)))
+        # NetworkManager skips scripts that others can write to
+        hook.chmod(0o755)
+        return True, f"NetworkManager hook installed: {hook}"
+    except OSError as e:
+        return False, f"Error installing NetworkManager hook: {e}"
+
+
+def install_linux():
+    """Linux flow: credentials for the user who ran sudo, then the NetworkManager hook"""
+    user = os.environ.get('SUDO_USER') or os.environ.get('USER') or 'root'
+    command = get_linux_command()
+    
+    print("=" * 60)
+    print("STEP 1: Configure WiFi Credentials")
+    print("=" * 60)
+    print()
+    try:
+        subprocess.run(['runuser', '-u', user, '--', *command, '--setup'], check=True)
+    except (subprocess.CalledProcessError, OSError):
+        print("\n⚠ Credential setup was cancelled or incomplete.")
+        if input("Continue with NetworkManager setup? (y/n): ").lower() != 'y':
+            print("\nInstallation cancelled.")
+            sys.exit(1)
+    
+    print()
+    print("=" * 60)
+    print("STEP 2: Configure Automatic Authentication")
+    print("=" * 60)
+    print()
+    success, message = install_dispatcher_hook(command, user)
+    print(("✓ " if success else "✗ ") + message)
+    print()
+    if success:
+        print(f"WiFi connections now run the authenticator as {user}.")
+        print(f"To uninstall, delete {NM_DISPATCHER_DIR}/{NM_DISPATCHER_SCRIPT}")
+    else:
+        print("INSTALLATION FAILED")
+    print()
+
+
+def choose_install_mode():
+    """Standalone: every WiFi connection starts the full program.
+    Daemon: one resident program handles connection events forwarded to it.
+    """
+    print("Choose how authentication runs:")
+    print("  [1] Standalone - start the program on every WiFi connection (default)")
+    print("  [2] Daemon     - keep one program running in the background; WiFi")
+    print("                   connections only send it a signal (fastest login)")
+    choice = input("Mode [1/2]: ").strip()
+    return 'daemon' if choice == '2' else 'standalone'
+
+
 def main():
     print("=" * 60)
     print("   JIIT WiFi Auto-Authenticator - INSTALLER")
@@ -137,6 +313,9 @@ def main():
     # Check for admin privileges
     if not is_admin():
         print("⚠ Administrator privileges required.")
+        if sys.platform != 'win32':
+            print("  Run the installer again with sudo.")
+            sys.exit(1)
         print("  Requesting elevation...")
         print()
         if not run_as_admin():
@@ -146,6 +325,9 @@ def main():
     print("✓ Administrator access granted")
     print()
     
+    if sys.platform.startswith('linux'):
+        return install_linux()
+    
     # Find the main executable
     exe_path = get_exe_path()
     
@@ -193,9 +375,11 @@ def main():
     print("STEP 2: Configure Automatic Authentication")
     print("=" * 60)
     print()
+    mode = choose_install_mode()
+    print()
     print("Setting up Task Scheduler to run on WiFi connection...")
     
-    success, message = create_task_scheduler_task(exe_path)
+    success, message = create_task_scheduler_task(exe_path, mode)
     
     print()
     if success:
@@ -213,6 +397,9 @@ def main():
         print("  • Detects when you connect to JIIT WiFi networks")
         print("  • Automatically authenticates using saved credentials")
         print("  • No manual intervention required")
+        if mode == 'daemon':
+            print("  • Runs in the background from logon; connection events are")
+            print("    forwarded to it instead of starting a new program each time")
         print()
         print("Supported networks: AP, ABB, HOSTEL, LRC, JIIT")
         print()
@@ -0,0 +1,150 @@
+import threading
+import time
+
+import main as core
+from http_pool import get_pool
+from profiles import classify
+from retry_policy import start_jitter
+from state_cache import get_state
+from tracing import dump_flight_recorder, event, traced_sleep
+
+# States of one adapter's link, in the order a login moves through them
+DISCONNECTED = 'disconnected'
+ASSOCIATED = 'associated'          # on a network we do not (or failed to) log in to
+PROBING = 'probing'                # checking whether the link is already online
+AUTHENTICATING = 'authenticating'
+ONLINE = 'online'
+
+# Monitor mode skips a login on the same link within this many seconds,
+# including logins made by other instances
+RECENT_ATTEMPT = 60
+
+
+def link_id(link):
+    """What makes a link change: the SSID or the client IP (an AP roam is not one)"""
+    return (link['ssid'], link.get('ip')) if link else None
+
+
+class InterfaceSession:
+    """State machine for one wireless adapter.
+
+    `update()` is fed the adapter's link whenever it changes. The probe and
+    login then run on a thread of their own, with every request bound to
+    the adapter's address through the shared connection pool, so a slow
+    login on one adapter never holds up the other. A link change during a
+    login supersedes it: the old attempt's outcome is discarded.
+    """
+
+    def __init__(self, name, username, password, on_online=None, on_down=None):
+        self.name = name
+        self.username = username
+        self.password = password
+        self.on_online = on_online
+        self.on_down = on_down
+        self.state = DISCONNECTED
+        self.link = None
+        self.profile = None
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _label(self):
+        return f" on {self.name}" if self.name else ''
+
+    def _set(self, generation, state):
+        """Move to `state` unless a newer link superseded this attempt"""
+        with self._lock:
+            if generation != self.generation:
+                return False
+            self.state = state
+        event('interface_state', interface=self.name, state=state)
+        return True
+
+    def update(self, link):
+        """Feed the adapter's current link (None when disconnected)"""
+        with self._lock:
+            previous, self.link = self.link, link
+            if link_id(link) == link_id(previous):
+                return
+            self.generation += 1
+            generation = self.generation
+            self.state = ASSOCIATED if link else DISCONNECTED
+        event('interface_state', interface=self.name, state=self.state)
+        if previous and self.on_down:
+            self.on_down(self)
+        if link:
+            print(f"\n[{time.strftime('%H:%M:%S')}] WiFi changed to: {link['ssid']}{self._label()}")
+        else:
+            print(f"\n[{time.strftime('%H:%M:%S')}] WiFi disconnected{self._label()}")
+        self._spawn(self._switch, generation, previous, link)
+
+    def _switch(self, generation, previous, link):
+        """Drop what belonged to the link we left, then bring up the new one.
+        No logout is sent: the old link is already gone, so the portal is out
+        of reach from its address"""
+        if previous is not None:
+            # Sockets bound to the old address are of no use now
+            get_pool().close(previous.get('ip'))
+            core.forget_probes(previous.get('ip'))
+        if link is not None:
+            self._bring_up(generation, link)
+
+    def _logout(self, link, reason):
+        source_address = (link['ip'], 0) if link.get('ip') else None
+        if core.logout_from_portal(self.username, self.profile, source_address, reason=reason):
+            print(f"✓ Signed out of {link['ssid']}{self._label()}")
+
+    def shutdown(self):
+        """Sign out before the process goes away, if this adapter is online"""
+        if core.LOGOUT_ON_SHUTDOWN and self.state == ONLINE and self.link is not None:
+            self._logout(self.link, 'shutdown')
+
+    def _spawn(self, target, *args):
+        self._thread = threading.Thread(target=target, args=args, daemon=True)
+        self._thread.start()
+
+    def join(self, timeout=None):
+        """Wait for a running probe/login to finish"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _bring_up(self, generation, link):
+        ssid = link['ssid']
+        profile = classify(ssid, link.get('bssid'))
+        if profile is None:
+            print(f"→ Not a college WiFi, ignoring{self._label()}")
+            return
+        print(f"→ College WiFi detected{self._label()}!")
+
+        state = get_state()
+        attempt_key = f"{ssid}|{link['ip']}" if link.get('ip') else ssid
+        if time.time() - state.last_attempt(attempt_key) <= RECENT_ATTEMPT:
+            print("→ Recent login attempt, skipping...")
+            return
+        state.record_attempt(attempt_key)
+
+        source_address = (link['ip'], 0) if link.get('ip') else None
+        if not self._set(generation, PROBING):
+            return
+        online = core.check_internet_connection(url=profile.get_probe_urls()[0],
+                                                source_address=source_address, profile=profile)
+        if online:
+            print(f"✓ Internet already accessible{self._label()}")
+        else:
+            # Spread out the logins of a building full of clients reconnecting at once
+            traced_sleep(start_jitter(profile.get_login_urls()), 'start-jitter')
+            if not self._set(generation, AUTHENTICATING):
+                return
+            online = core.attempt_login(self.username, self.password, ssid, profile,
+                                        source_address, captive=True)
+
+        if not self._set(generation, ONLINE if online else ASSOCIATED):
+            return
+        if online:
+            self.profile = profile
+            core.remember_online(ssid, link.get('bssid'), link.get('ip'))
+            if self.on_online:
+                self.on_online(self, profile)
+        else:
+            dump_flight_recorder(f"login failed on {ssid}{self._label()}")
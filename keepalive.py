@@ -0,0 +1,181 @@
+import json
+import statistics
+import threading
+import time
+from pathlib import Path
+
+import main as core
+from http_pool import get_pool
+from tracing import span
+
+# Measured session lifetimes (one entry per session) live next to the config
+SESSION_HISTORY_FILE = Path.home() / '.wifi_auto_login_sessions.json'
+SESSION_HISTORY_SIZE = 20
+
+# Cyberoam's own client pings `live` every 180 s; until a lifetime has been
+# observed we stay well inside that
+DEFAULT_KEEPALIVE_INTERVAL = 90
+MIN_KEEPALIVE_INTERVAL = 15
+
+# Keepalives are sent this many times per predicted session lifetime, and
+# the session is renewed once this fraction of it has passed
+KEEPALIVES_PER_LIFETIME = 4
+RENEW_AT = 0.85
+
+
+def send_keepalive(username, timeout=5, portal_url=None, source_address=None, profile=None):
+    """Ping the portal's keepalive endpoint (Cyberoam's `live`, or the
+    profile's dialect) on the gateway of login URL `portal_url`.
+
+    Returns True if the portal acknowledged the session, False if it asks
+    for a new login and None if the portal could not be reached or has no
+    keepalive to ask.
+    """
+    from profiles import get_default_profile
+    
+    profile = profile or get_default_profile()
+    driver = profile.get_driver()
+    request = driver.keepalive_request(portal_url or profile.get_login_url(), username,
+                                       profile.get_session())
+    with span('keepalive', driver=driver.name) as s:
+        if request is None:
+            return None
+        method, url, data = request
+        try:
+            response = get_pool().request(method, url, data=data, timeout=timeout,
+                                          source_address=source_address)
+        except Exception as e:
+            s['failed'] = type(e).__name__
+            return None
+        s['alive'] = driver.parse_keepalive(response)
+        return s['alive']
+
+
+def load_session_history():
+    """Measured session lifetimes in seconds, oldest first"""
+    try:
+        with open(SESSION_HISTORY_FILE, 'r') as f:
+            return [float(x) for x in json.load(f)][-SESSION_HISTORY_SIZE:]
+    except Exception:
+        return []
+
+
+def save_session_history(lifetimes):
+    try:
+        with open(SESSION_HISTORY_FILE, 'w') as f:
+            json.dump(lifetimes[-SESSION_HISTORY_SIZE:], f)
+    except Exception as e:
+        print(f"Error saving session history: {e}")
+
+
+class SessionKeepalive:
+    """Keeps a portal session alive from a background thread.
+
+    Call `on_login()` after every successful login. Keepalives are sent on
+    a schedule derived from the measured session lifetime, and the session
+    is renewed with a fresh login shortly before it is predicted to expire.
+    A session that the portal ends on its own is recorded as a lifetime
+    sample; sessions we renewed ourselves are not, since they say nothing
+    about when the portal would have cut us off.
+    """
+
+    def __init__(self, username, password, login=None):
+        self.username = username
+        self.password = password
+        self.login = login or core.login_to_portal
+        self.lifetimes = load_session_history()
+        self.session_start = None
+        self.profile = None
+        self.stats = {'keepalives': 0, 'expired': 0, 'renewed': 0, 'relogins': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def predicted_lifetime(self):
+        """Median observed lifetime, or None before any session has expired"""
+        if not self.lifetimes:
+            return None
+        return statistics.median(self.lifetimes)
+
+    def keepalive_interval(self):
+        lifetime = self.predicted_lifetime()
+        if lifetime is None:
+            return DEFAULT_KEEPALIVE_INTERVAL
+        return max(MIN_KEEPALIVE_INTERVAL,
+                   min(DEFAULT_KEEPALIVE_INTERVAL, lifetime / KEEPALIVES_PER_LIFETIME))
+
+    def on_login(self, profile=None):
+        self.session_start = time.monotonic()
+        if profile is not None:
+            self.profile = profile
+
+    def on_disconnect(self):
+        self.session_start = None
+
+    def _record_expiry(self):
+        lifetime = time.monotonic() - self.session_start
+        self.lifetimes = (self.lifetimes + [round(lifetime, 1)])[-SESSION_HISTORY_SIZE:]
+        save_session_history(self.lifetimes)
+        self.stats['expired'] += 1
+        print(f"[{time.strftime('%H:%M:%S')}] Portal session ended after {lifetime:.0f}s")
+
+    def _relogin(self):
+        self.stats['relogins'] += 1
+        if self.login(self.username, self.password, self.profile):
+            self.on_login()
+            return True
+        self.session_start = None
+        return False
+
+    def tick(self):
+        """Run one scheduling step; returns seconds until the next one"""
+        if self.session_start is None:
+            return self.keepalive_interval()
+
+        age = time.monotonic() - self.session_start
+        lifetime = self.predicted_lifetime()
+        if lifetime is not None and age >= lifetime * RENEW_AT:
+            print(f"[{time.strftime('%H:%M:%S')}] Renewing portal session before expiry")
+            self.stats['renewed'] += 1
+            self._relogin()
+            return self.keepalive_interval()
+
+        portal_url = None
+        if self.profile is not None:
+            # The gateway we log in through: the discovered portal, else the healthiest one
+            from failover import rank_endpoints
+            portal_url = rank_endpoints(self.profile.get_login_urls(),
+                                        self.profile.get_preferred_login_url())[0]
+        alive = send_keepalive(self.username, portal_url=portal_url, profile=self.profile)
+        self.stats['keepalives'] += 1
+        if alive is False:
+            self._record_expiry()
+            self._relogin()
+
+        interval = self.keepalive_interval()
+        if lifetime is not None and self.session_start is not None:
+            # Wake up in time for the renewal rather than after it
+            until_renewal = lifetime * RENEW_AT - (time.monotonic() - self.session_start)
+            interval = max(1, min(interval, until_renewal))
+        return interval
+
+    def _run(self):
+        delay = self.keepalive_interval()
+        while not self._stop.wait(delay):
+            try:
+                delay = self.tick()
+            except Exception as e:
+                print(f"Error in keepalive: {e}")
+                delay = self.keepalive_interval()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+        self.session_start = None
@@ -0,0 +1,435 @@
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import main as core
+from tracing import metrics
+
+# Even event-driven backends re-check the link this often, in case an
+# event was lost (driver reset, service restart, sleep/resume)
+LINK_RESYNC_INTERVAL = 300
+
+# After the first event, wait this long for the burst that usually follows
+# (disconnect, connect, IP change) so one change causes one wakeup
+EVENT_SETTLE = 0.2
+
+# Polling fallback: poll every POLL_MIN_INTERVAL seconds right after the
+# link changes (or drops), then stretch the interval by POLL_BACKOFF per
+# unchanged poll up to POLL_MAX_INTERVAL, or POLL_BATTERY_MAX_INTERVAL
+# while running on battery
+POLL_MIN_INTERVAL = 1
+POLL_BACKOFF = 1.5
+POLL_MAX_INTERVAL = 20
+POLL_BATTERY_MAX_INTERVAL = 60
+
+# The power source is re-read at most this often
+POWER_CHECK_INTERVAL = 60
+
+
+class LinkBackend:
+    """Source of link-state changes for monitor mode.
+
+    `current()` returns the connected SSID (or None) and `wait()` blocks
+    until the link may have changed or `timeout` passes; it returns True
+    when woken by an event. Backends count their `wakeups` and process
+    `spawns` so idle cost can be compared.
+    """
+
+    name = 'base'
+
+    def __init__(self):
+        self.closed = False
+        self.stats = {'wakeups': 0, 'spawns': 0}
+        self.started = time.monotonic()
+
+    def _count(self, name):
+        self.stats[name] += 1
+        metrics.incr('link.' + name)
+
+    def rates(self):
+        """Wakeups and spawns per hour since the backend started"""
+        hours = max(time.monotonic() - self.started, 1) / 3600
+        return {name: round(count / hours, 1) for name, count in self.stats.items()}
+
+    def current(self):
+        raise NotImplementedError
+
+    def links(self, ssid=None):
+        """Every connected interface as of the last current() (see
+        main.get_wifi_links); backends that only learn the SSID report
+        one unnamed interface"""
+        return [{'interface': None, 'ssid': ssid, 'bssid': None, 'ip': None}] if ssid else []
+
+    def wait(self, timeout=None):
+        raise NotImplementedError
+
+    def close(self):
+        self.closed = True
+
+
+_power = {'checked': None, 'battery': False}
+
+
+def _read_battery_state():
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class SYSTEM_POWER_STATUS(ctypes.Structure):
+            _fields_ = [('ACLineStatus', ctypes.c_ubyte), ('BatteryFlag', ctypes.c_ubyte),
+                        ('BatteryLifePercent', ctypes.c_ubyte),
+                        ('SystemStatusFlag', ctypes.c_ubyte),
+                        ('BatteryLifeTime', wintypes.DWORD),
+                        ('BatteryFullLifeTime', wintypes.DWORD)]
+
+        status = SYSTEM_POWER_STATUS()
+        if not ctypes.windll.kernel32.GetSystemPowerStatus(ctypes.byref(status)):
+            return False
+        return status.ACLineStatus == 0
+
+    import glob
+
+    mains, discharging = [], False
+    for supply in glob.glob('/sys/class/power_supply/*'):
+        try:
+            with open(supply + '/type') as f:
+                kind = f.read().strip()
+            if kind == 'Mains':
+                with open(supply + '/online') as f:
+                    mains.append(f.read().strip() == '1')
+            elif kind == 'Battery':
+                with open(supply + '/status') as f:
+                    discharging = discharging or f.read().strip() == 'Discharging'
+        except OSError:
+            continue
+    return not any(mains) if mains else discharging
+
+
+def on_battery():
+    """True when the machine runs on battery (re-read every POWER_CHECK_INTERVAL)"""
+    now = time.monotonic()
+    if _power['checked'] is None or now - _power['checked'] > POWER_CHECK_INTERVAL:
+        try:
+            _power['battery'] = _read_battery_state()
+        except Exception:
+            _power['battery'] = False
+        _power['checked'] = now
+    return _power['battery']
+
+
+class AdaptiveSchedule:
+    """Poll interval that snaps back to `minimum` when the link changes and
+    grows geometrically while it stays the same"""
+
+    def __init__(self, minimum=POLL_MIN_INTERVAL, maximum=POLL_MAX_INTERVAL,
+                 battery_maximum=POLL_BATTERY_MAX_INTERVAL, backoff=POLL_BACKOFF):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.battery_maximum = battery_maximum
+        self.backoff = backoff
+        self.interval = minimum
+
+    def ceiling(self):
+        return self.battery_maximum if on_battery() else self.maximum
+
+    def observe(self, changed):
+        if changed:
+            self.interval = self.minimum
+        else:
+            self.interval = min(self.ceiling(), self.interval * self.backoff)
+        return self.interval
+
+
+class PollingBackend(LinkBackend):
+    """Runs netsh on an AdaptiveSchedule, or every `interval` seconds if given"""
+
+    name = 'polling'
+
+    def __init__(self, interval=None):
+        super().__init__()
+        self.schedule = None if interval else AdaptiveSchedule()
+        self.interval = interval or POLL_MIN_INTERVAL
+        self._last = None
+        self._links = []
+
+    def current(self):
+        self._count('spawns')
+        self._links = core.get_wifi_links()
+        state = [(link['interface'], link['ssid'], link['ip']) for link in self._links]
+        if self.schedule is not None:
+            self.interval = self.schedule.observe(state != self._last)
+        self._last = state
+        return self._links[0]['ssid'] if self._links else None
+
+    def links(self, ssid=None):
+        return self._links
+
+    def wait(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(self.interval, timeout))
+        self._count('wakeups')
+        return True
+
+
+def split_terse(line):
+    """Fields of one line of `nmcli -t` output, which escapes ':' and '\\'"""
+    fields, field, escaped = [], [], False
+    for char in line:
+        if escaped:
+            field.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == ':':
+            fields.append(''.join(field))
+            field = []
+        else:
+            field.append(char)
+    fields.append(''.join(field))
+    return fields
+
+
+# `nmcli device wifi list` fields read per access point, in this order
+NMCLI_WIFI_FIELDS = 'ACTIVE,SSID,BSSID,SIGNAL,CHAN,DEVICE'
+
+
+def parse_nmcli_wifi(text):
+    """The associated access point of each device in `nmcli -t -f
+    NMCLI_WIFI_FIELDS device wifi list` output, as get_wifi_link() dicts"""
+    links = []
+    for line in text.splitlines():
+        fields = split_terse(line)
+        if len(fields) != 6:
+            continue
+        active, ssid, bssid, signal, channel, device = fields
+        if active != 'yes' or not ssid or any(link['interface'] == device for link in links):
+            continue
+        links.append({'interface': device, 'description': None, 'ssid': ssid,
+                      'bssid': bssid.lower() or None,
+                      'signal': int(signal) if signal.isdigit() else None,
+                      'channel': int(channel) if channel.isdigit() else None,
+                      'state': 'connected', 'ip': None})
+    return links
+
+
+def parse_nmcli_addresses(text):
+    """device -> first IPv4 address from `nmcli -t -f GENERAL.DEVICE,IP4.ADDRESS
+    device show` output"""
+    addresses = {}
+    device = None
+    for line in text.splitlines():
+        key, _, value = line.partition(':')
+        if key == 'GENERAL.DEVICE':
+            device = value
+        elif key.startswith('IP4.ADDRESS') and device and device not in addresses:
+            addresses[device] = value.split('/')[0] or None
+    return addresses
+
+
+class NmcliMonitorBackend(LinkBackend):
+    """Linux: one long-lived `nmcli monitor` process; wakes only on its output"""
+
+    name = 'nmcli'
+
+    def __init__(self):
+        super().__init__()
+        self._events = queue.Queue()
+        self._proc = subprocess.Popen(
+            ['nmcli', 'monitor'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True
+        )
+        self._count('spawns')
+        self._links = []
+        threading.Thread(target=self._reader, daemon=True).start()
+
+    def _reader(self):
+        for line in self._proc.stdout:
+            self._events.put(line.strip())
+        self._events.put(None)
+
+    def current(self):
+        self._links = self._read_links()
+        return self._links[0]['ssid'] if self._links else None
+
+    def links(self, ssid=None):
+        return self._links
+
+    def _read_links(self):
+        """Every associated WiFi device with its SSID and address. The
+        connection name nmcli shows per device is a profile name, not
+        necessarily the SSID, so the access point list is read instead"""
+        from state_cache import local_ip
+
+        self._count('spawns')
+        try:
+            result = subprocess.run(
+                ['nmcli', '-t', '-f', NMCLI_WIFI_FIELDS, 'device', 'wifi', 'list', '--rescan', 'no'],
+                capture_output=True,
+                text=True,
+                check=True
+            )
+            links = parse_nmcli_wifi(result.stdout)
+            if len(links) == 1:
+                # The only link is the one the default route uses
+                links[0]['ip'] = local_ip(core.split_url(core.PORTAL_URL)[0])
+            elif links:
+                self._count('spawns')
+                result = subprocess.run(
+                    ['nmcli', '-t', '-f', 'GENERAL.DEVICE,IP4.ADDRESS', 'device', 'show'],
+                    capture_output=True,
+                    text=True,
+                    check=True
+                )
+                addresses = parse_nmcli_addresses(result.stdout)
+                for link in links:
+                    link['ip'] = addresses.get(link['interface'])
+            return links
+        except (OSError, subprocess.CalledProcessError):
+            return []
+
+    def wait(self, timeout=LINK_RESYNC_INTERVAL):
+        try:
+            event = self._events.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        if event is None:
+            self.closed = True
+            return False
+        # Swallow the rest of the burst
+        deadline = time.monotonic() + EVENT_SETTLE
+        while True:
+            try:
+                self._events.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+        self._count('wakeups')
+        return True
+
+    def close(self):
+        super().close()
+        self._proc.terminate()
+
+
+class WindowsWlanBackend(LinkBackend):
+    """Windows: WlanRegisterNotification callbacks from the WLAN AutoConfig service"""
+
+    name = 'wlanapi'
+
+    # wlan_notification_acm_* codes that mean the association changed:
+    # connection_complete, connection_attempt_fail, interface_arrival,
+    # interface_removal, disconnected
+    ACM_CODES = {10, 11, 13, 14, 21}
+    WLAN_NOTIFICATION_SOURCE_NONE = 0
+    WLAN_NOTIFICATION_SOURCE_ACM = 0x08
+
+    def __init__(self):
+        super().__init__()
+        import ctypes
+        from ctypes import wintypes
+
+        class GUID(ctypes.Structure):
+            _fields_ = [('Data1', wintypes.DWORD), ('Data2', wintypes.WORD),
+                        ('Data3', wintypes.WORD), ('Data4', ctypes.c_ubyte * 8)]
+
+        class WLAN_NOTIFICATION_DATA(ctypes.Structure):
+            _fields_ = [('NotificationSource', wintypes.DWORD),
+                        ('NotificationCode', wintypes.DWORD),
+                        ('InterfaceGuid', GUID),
+                        ('dwDataSize', wintypes.DWORD),
+                        ('pData', ctypes.c_void_p)]
+
+        callback_type = ctypes.WINFUNCTYPE(
+            None, ctypes.POINTER(WLAN_NOTIFICATION_DATA), ctypes.c_void_p)
+
+        self._event = threading.Event()
+        self._links = []
+        self._wlanapi = ctypes.windll.wlanapi
+        self._handle = wintypes.HANDLE()
+        negotiated = wintypes.DWORD()
+        if self._wlanapi.WlanOpenHandle(2, None, ctypes.byref(negotiated),
+                                        ctypes.byref(self._handle)) != 0:
+            raise OSError("WlanOpenHandle failed")
+
+        def on_notification(data, context):
+            if data and data.contents.NotificationCode in self.ACM_CODES:
+                self._event.set()
+
+        # Keep a reference: ctypes frees the thunk once the object is collected
+        self._callback = callback_type(on_notification)
+        if self._wlanapi.WlanRegisterNotification(
+                self._handle, self.WLAN_NOTIFICATION_SOURCE_ACM, True,
+                self._callback, None, None, None) != 0:
+            self._wlanapi.WlanCloseHandle(self._handle, None)
+            raise OSError("WlanRegisterNotification failed")
+
+    def current(self):
+        self._count('spawns')
+        self._links = core.get_wifi_links()
+        return self._links[0]['ssid'] if self._links else None
+
+    def links(self, ssid=None):
+        return self._links
+
+    def wait(self, timeout=LINK_RESYNC_INTERVAL):
+        # Wait in short slices so Ctrl+C is still delivered on Windows
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._event.wait(1):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+        time.sleep(EVENT_SETTLE)
+        self._event.clear()
+        self._count('wakeups')
+        return True
+
+    def close(self):
+        super().close()
+        self._wlanapi.WlanRegisterNotification(
+            self._handle, self.WLAN_NOTIFICATION_SOURCE_NONE, True, None, None, None, None)
+        self._wlanapi.WlanCloseHandle(self._handle, None)
+
+
+class FakeLinkBackend(LinkBackend):
+    """Scripted backend for tests and benchmarks.
+
+    `events` is a list of SSIDs (None for disconnected), or (delay, ssid)
+    pairs to wait `delay` seconds before the change. The backend closes
+    itself after the last event has been reported.
+    """
+
+    name = 'fake'
+
+    def __init__(self, events, initial=None):
+        super().__init__()
+        self._events = list(events)
+        self._ssid = initial
+
+    def current(self):
+        return self._ssid
+
+    def wait(self, timeout=None):
+        if not self._events:
+            self.closed = True
+            return False
+        event = self._events.pop(0)
+        if isinstance(event, tuple):
+            delay, event = event
+            time.sleep(delay)
+        self._ssid = event
+        self._count('wakeups')
+        return True
+
+
+def get_link_backend():
+    """Pick the best backend for this platform, falling back to polling"""
+    try:
+        if sys.platform == 'win32':
+            return WindowsWlanBackend()
+        if shutil.which('nmcli'):
+            return NmcliMonitorBackend()
+    except Exception as e:
+        print(f"Event backend unavailable ({e}), falling back to polling")
+    return PollingBackend()
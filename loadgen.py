@@ -0,0 +1,218 @@
+"""Mass-reconnect load generator.
+
+After a campus-wide WiFi outage hundreds of clients reconnect within
+seconds of each other. This starts `--clients` simulated clients over
+`--spread` seconds, each running main()'s real one-shot login path
+(login_with_retries: probe, login, retries, circuit breaker, herd control)
+from its own loopback address, with its own state cache, against one
+portal_emulator.PortalEmulator with limited capacity. It reports the
+portal's peak concurrency and the clients' time-to-online distribution,
+with herd control (start jitter, login token bucket, Retry-After) off,
+on, or both for comparison. Each mode runs `--runs` times with
+successive seeds and the medians are reported, since one run's numbers
+move with its reconnect times:
+
+    python loadgen.py                                     # 300 clients, off vs on
+    python loadgen.py --queue-limit 30                    # a portal that sheds logins
+    python loadgen.py --clients 500 --spread 5 --capacity 8 --queue-limit 50
+    python loadgen.py --herd-control on --runs 1 --json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import failover
+import main as core
+import retry_policy
+import state_cache
+from benchmark import patched, percentile
+from http_pool import get_pool
+from portal_emulator import PortalEmulator
+
+SSID = 'JIIT-AP-LOADGEN'
+PASSWORD = 'secret'
+
+# Herd control turned off: what every client did before it existed
+HERD_CONTROL_OFF = {'START_JITTER': 0, 'OVERLOAD_START_JITTER': 0, 'LOGIN_RATE': 0,
+                    'HONOR_RETRY_AFTER': False}
+
+# Summary figures reported as their median across runs
+MEDIAN_FIELDS = ['recovery_seconds', 'wall_seconds', 'p50', 'p95', 'max', 'logins', 'shed',
+                 'portal_peak_in_flight', 'portal_peak_waiting']
+
+
+def client_address(i):
+    """Loopback address of client `i`, so the portal sees distinct machines"""
+    return f"127.1.{i // 250}.{i % 250 + 1}"
+
+
+def run_herd(clients, spread, emulator_options, herd_control=True, seed=None):
+    """Reconnect `clients` clients within `spread` seconds; returns the summary"""
+    rng = random.Random(seed)
+    offsets = sorted(rng.uniform(0, spread) for _ in range(clients))
+    local = threading.local()
+    results = [None] * clients
+
+    def get_state():
+        return local.state
+
+    with tempfile.TemporaryDirectory() as tmp, PortalEmulator(**emulator_options) as emulator:
+        def client(i):
+            ip = client_address(i)
+            local.state = state_cache.StateCache(os.path.join(tmp, f"state-{i}"))
+            time.sleep(max(0, start + offsets[i] - time.monotonic()))
+            connected = time.monotonic()
+            wifi = {'interface': 'Wi-Fi', 'ssid': SSID, 'bssid': None, 'ip': ip}
+            try:
+                online, kind, attempts = core.login_with_retries(
+                    f"user{i:04d}", PASSWORD, state_cache.link_keys(ssid=SSID, ip=ip),
+                    wifi, (ip, 0))
+            except Exception as e:
+                online, kind, attempts = False, type(e).__name__, None
+            results[i] = {'online': online, 'kind': kind, 'attempts': attempts,
+                          'seconds': time.monotonic() - connected,
+                          'finished': time.monotonic() - start}
+
+        settings = {} if herd_control else HERD_CONTROL_OFF
+        with patched(core, PORTAL_URL=emulator.portal_url, PROBE_URL=emulator.probe_url,
+                     PORTAL_FALLBACK_URLS=[], PROBE_TARGETS=[], _probe_cache={}), \
+                patched(retry_policy, get_state=get_state, **settings), \
+                patched(failover, get_state=get_state), \
+                patched(state_cache, get_state=get_state), \
+                contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=client, args=(i,), daemon=True)
+                       for i in range(clients)]
+            start = time.monotonic()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.monotonic() - start
+            get_pool().close()
+        return summarize(results, elapsed, emulator, herd_control)
+
+
+def summarize(results, elapsed, emulator, herd_control):
+    online = [r for r in results if r['online']]
+    failures = {}
+    for r in results:
+        if not r['online']:
+            failures[r['kind']] = failures.get(r['kind'], 0) + 1
+    seconds = [r['seconds'] for r in online]
+    return {
+        'herd_control': herd_control,
+        'clients': len(results),
+        'online': len(online),
+        'failures': failures,
+        'recovery_seconds': round(max((r['finished'] for r in online), default=0), 3),
+        'wall_seconds': round(elapsed, 3),
+        'p50': percentile(seconds, 50),
+        'p95': percentile(seconds, 95),
+        'max': max(seconds, default=None),
+        'logins': emulator.counters.get('login.xml', 0),
+        'shed': emulator.counters.get('shed', 0),
+        'portal_peak_in_flight': emulator.peak_in_flight,
+        'portal_peak_waiting': emulator.peak_waiting,
+    }
+
+
+def median_summary(summaries):
+    """One summary for several runs: the median of each figure, the fewest
+    clients any run got online and every run's failures"""
+    combined = {'herd_control': summaries[0]['herd_control'], 'runs': len(summaries),
+                'clients': summaries[0]['clients'],
+                'online': min(s['online'] for s in summaries), 'failures': {}}
+    for summary in summaries:
+        for kind, count in summary['failures'].items():
+            combined['failures'][kind] = combined['failures'].get(kind, 0) + count
+    for key in MEDIAN_FIELDS:
+        values = [s[key] for s in summaries if s[key] is not None]
+        combined[key] = statistics.median(values) if values else None
+    return combined
+
+
+def format_seconds(value):
+    return '-' if value is None else f"{value:.2f}s"
+
+
+def print_summary(summary):
+    label = 'on' if summary['herd_control'] else 'off'
+    failures = ', '.join(f"{k}={v}" for k, v in summary['failures'].items()) or 'none'
+    print(f"Herd control {label} (median of {summary['runs']} runs):")
+    print(f"  {summary['online']}/{summary['clients']} clients online in the worst run, "
+          f"all recovered after {summary['recovery_seconds']:.2f}s (failures: {failures})")
+    print(f"  Time-to-online: p50 {format_seconds(summary['p50'])}, "
+          f"p95 {format_seconds(summary['p95'])}, max {format_seconds(summary['max'])}")
+    # Shed logins mean the queue limit, not the portal's capacity, held clients back
+    limit = 'queue limit' if summary['shed'] else 'capacity'
+    print(f"  Portal: {summary['logins']:.0f} login requests, {summary['shed']:.0f} shed, "
+          f"peak {summary['portal_peak_in_flight']:.0f} in flight "
+          f"({summary['portal_peak_waiting']:.0f} queued), limited by its {limit}")
+
+
+def print_comparison(off_runs, on_runs):
+    """Medians off -> on, and in how many paired runs (same seed) on was better"""
+    def better(key):
+        return sum(on[key] < off[key] for off, on in zip(off_runs, on_runs))
+
+    off, on = median_summary(off_runs), median_summary(on_runs)
+    runs = len(off_runs)
+    print("=" * 50)
+    print(f"Clients online: {off['online']} -> {on['online']} of {off['clients']} (worst run)")
+    for key, name, figure in (('recovery_seconds', 'Recovery', '{:.2f}s'),
+                              ('p95', 'Time-to-online p95', '{:.2f}s'),
+                              ('portal_peak_waiting', 'Portal queue peak', '{:.0f}'),
+                              ('shed', 'Shed logins', '{:.0f}')):
+        print(f"{name}: {figure.format(off[key])} -> {figure.format(on[key])} (median), "
+              f"lower with herd control in {better(key)}/{runs} runs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a mass reconnect against the "
+                                                 "local portal emulator")
+    parser.add_argument('--clients', type=int, default=300)
+    parser.add_argument('--spread', type=float, default=2,
+                        help="seconds over which the clients reconnect")
+    parser.add_argument('--herd-control', choices=['off', 'on', 'both'], default='both')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="portal seconds per login")
+    parser.add_argument('--capacity', type=int, default=4, help="logins the portal handles at once")
+    parser.add_argument('--queue-limit', type=int, default=200,
+                        help="queued logins beyond which the portal sheds with 503 (the "
+                             "default rarely sheds, so the portal's capacity is the limit)")
+    parser.add_argument('--retry-after', type=int,
+                        help="Retry-After seconds on a shed login (default: queue drain time)")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the first run's reconnect times")
+    parser.add_argument('--runs', type=int, default=5,
+                        help="runs per mode, with successive seeds; medians are reported")
+    parser.add_argument('--json', action='store_true', help="print the summaries as JSON")
+    args = parser.parse_args()
+
+    emulator_options = {'latency': args.latency, 'capacity': args.capacity,
+                        'queue_limit': args.queue_limit, 'retry_after': args.retry_after}
+    modes = {'off': [False], 'on': [True], 'both': [False, True]}[args.herd_control]
+    results = []
+    for herd_control in modes:
+        runs = [run_herd(args.clients, args.spread, emulator_options, herd_control, args.seed + i)
+                for i in range(args.runs)]
+        results.append(runs)
+        if not args.json:
+            print_summary(median_summary(runs))
+
+    if args.json:
+        print(json.dumps([dict(median_summary(runs), each=runs) for runs in results], indent=2))
+    elif len(results) == 2:
+        print_comparison(*results)
+    return all(s['online'] == s['clients'] for runs in results for s in runs)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
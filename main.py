@@ -1,29 +1,131 @@
-import requests
 import time
-import subprocess
 import sys
-import json
 import os
-from pathlib import Path
+
+# Only cheap modules are imported up front: every Wi-Fi association event
+# starts this program, and most runs just find the internet already up.
+# subprocess, json, re and the HTTP stack are imported where they are used.
+from tracing import (BackgroundLog, dump_flight_recorder, enable_trace_file, event,
+                     install_dump_signals, metrics, serve_metrics, span, traced_sleep)
 
 # Configuration file path
-CONFIG_FILE = Path.home() / '.wifi_auto_login_config.json'
+CONFIG_FILE = os.path.join(os.path.expanduser('~'), '.wifi_auto_login_config.json')
 
 # Portal configuration
 PORTAL_URL = "http://172.16.68.6:8090/httpclient.html"
 
+# Other gateways serving the same portal. Logins go to the healthiest one
+# (latency and failure rate, remembered across runs) and fail over to the
+# next; with PORTAL_HEDGING a slow gateway also gets a parallel request to
+# the runner-up (this can briefly create a second session)
+PORTAL_FALLBACK_URLS = []
+PORTAL_HEDGING = False
+
+# Connectivity check: answers 204 when the internet is reachable, and is
+# redirected to the portal while we are captive
+PROBE_URL = "http://www.gstatic.com/generate_204"
+
+# Probe ladder, cheapest decisive step first:
+#  1. route: no route to the address PROBE_URL last answered 204 from means
+#     offline (a local lookup, no packet is sent)
+#  2. the probe hosts at the addresses they last answered 204 from, skipping
+#     DNS (which captive networks stall or hijack), for PROBE_DIRECT_TIMEOUT
+#  3. the probe hosts by name
+# PROBE_TARGETS are probed alongside PROBE_URL (a profile's own probe URL is
+# probed alone) and the first HTTP answer decides: 204 is online, anything
+# else captive. A verdict is reused for PROBE_CACHE_TTL seconds, so one run
+# (quick probe, login attempt) probes once.
+PROBE_TARGETS = ["http://connectivitycheck.gstatic.com/generate_204",
+                 "http://cp.cloudflare.com/generate_204"]
+PROBE_DIRECT_TIMEOUT = 1
+PROBE_CACHE_TTL = 3
+
+# Portal discovery: a captive probe reply names the portal (Location header,
+# or a meta refresh / JavaScript redirect in an injected page, looked for in
+# its first PORTAL_PAGE_SCAN characters). That portal is used ahead of
+# PORTAL_URL, so a portal that moved does not stall logins on a stale address
+PORTAL_PAGE_SCAN = 8192
+PORTAL_REDIRECT_PATTERNS = [
+    r"""<meta[^>]+http-equiv=["']?refresh["']?[^>]+content=["'][^"'>]*?url\s*=\s*['"]?([^"'>\s]+)""",
+    r"""<meta[^>]+content=["'][^"'>]*?url\s*=\s*['"]?([^"'>\s]+)[^>]+http-equiv=["']?refresh""",
+    r"""location\.(?:replace|assign)\(\s*["']([^"']+)["']""",
+    r"""location(?:\.href)?\s*=\s*["']([^"']+)["']""",
+]
+
+# Login confirmation: how long to keep probing after the portal accepts the
+# POST, and the probe backoff (seconds) used while the gateway opens up
+LOGIN_CONFIRM_TIMEOUT = 8
+LOGIN_CONFIRM_INTERVALS = [0.1, 0.2, 0.4, 0.8, 1.5]
+
+# Roaming: the portal session belongs to the client IP, so after an AP change
+# on the same SSID with the same IP (same segment) it is trusted for up to
+# ROAM_TRUST_TTL seconds, capped by the measured session lifetime. A login
+# attempt on such a segment first waits ROAM_SETTLE_TIMEOUT for traffic to
+# resume instead of logging in again.
+ROAM_TRUST_TTL = 600
+ROAM_SETTLE_TIMEOUT = 3
+
+# Logout: monitoring mode and the daemon sign the portal session out when
+# stopped by SIGTERM (or the daemon's STOP command), so the account's
+# concurrent-login slot is free at once instead of after the portal's idle
+# timeout. Nothing is sent on a disconnect: by the time it is seen, the
+# portal is out of reach from the old address.
+LOGOUT_ON_SHUTDOWN = True
+LOGOUT_TIMEOUT = 2
+
+# Windows sends no SIGTERM: closing the console, logging off and shutting
+# down arrive as these console control events instead, and the process is
+# ended as soon as the handler returns. `schtasks /End` cannot be caught at
+# all, which is why the installer sends the daemon STOP before it.
+CTRL_CLOSE_EVENT = 2
+CTRL_LOGOFF_EVENT = 5
+CTRL_SHUTDOWN_EVENT = 6
+
 # Auto-detect college WiFi networks
 # Recognize SSIDs that contain any of these keywords (case-insensitive)
 WIFI_KEYWORDS = ["AP", "ABB", "HOSTEL", "LRC", "JIIT"]
 
-# Monitoring mode - set to True to run continuously (NOT RECOMMENDED for battery)
-# Set to False for event-triggered mode (RECOMMENDED)
+# Monitoring mode - set to True to run continuously. It waits on link events
+# where the OS provides them and otherwise polls on an adaptive schedule that
+# backs off while the link is stable (longer still on battery).
+# False runs once per Task Scheduler trigger (event-triggered mode).
 MONITOR_MODE = False
 
+# Monitoring mode: wait after an unexpected error, doubled per consecutive
+# error up to the maximum
+MONITOR_ERROR_DELAY = 1
+MONITOR_MAX_ERROR_DELAY = 60
+
+# Use the asyncio engine (auth_engine.py) for one-shot runs: SSID lookup,
+# connectivity probes and the portal login race instead of running in series
+ASYNC_ENGINE = False
+
+# Monitoring mode: keep the portal session alive (keepalive.py) and renew it
+# before its predicted expiry instead of waiting to be dropped
+SESSION_KEEPALIVE = True
+
+# Per-phase timings go to ~/.wifi_auto_login_trace.jsonl (see tracing.py).
+# The most recent spans and events are also kept in memory and dumped to
+# ~/.wifi_auto_login_flight.jsonl when a login fails; `--background` (used
+# by the scheduled tasks) sends console output to ~/.wifi_auto_login.log.
+# In monitoring mode, set METRICS_PORT (e.g. 9477) to serve aggregated
+# counters and latency histograms at http://127.0.0.1:<port>/metrics
+TRACE_ENABLED = True
+METRICS_PORT = None
+
+# Resident daemon (daemon.py): `--daemon` keeps one authenticator running and
+# listening on this local port; `--trigger` just forwards the link event to
+# it, and only does the work itself when no daemon answers. The port only
+# accepts loopback connections but does not authenticate them: any local
+# process can send TRIGGER, STATUS or STOP (which signs the session out)
+DAEMON_PORT = 47611
+
 
 def load_credentials():
     """Load saved credentials from config file"""
-    if CONFIG_FILE.exists():
+    import json
+    
+    if os.path.exists(CONFIG_FILE):
         try:
             with open(CONFIG_FILE, 'r') as f:
                 return json.load(f)
@@ -34,6 +136,8 @@ def load_credentials():
 
 def save_credentials(username, password):
     """Save credentials to config file"""
+    import json
+    
     try:
         with open(CONFIG_FILE, 'w') as f:
             json.dump({'username': username, 'password': password}, f)
@@ -67,128 +171,933 @@ def setup_credentials():
     return None
 
 
+# `netsh wlan show interfaces` fields kept per interface
+NETSH_FIELDS = {'description': 'description', 'ssid': 'ssid', 'bssid': 'bssid',
+                'signal': 'signal', 'channel': 'channel', 'state': 'state'}
+
+
+def parse_wifi_interfaces(text):
+    """Parse `netsh wlan show interfaces` output into one dict per interface"""
+    interfaces = []
+    for line in text.splitlines():
+        key, sep, value = line.partition(':')
+        if not sep:
+            continue
+        key, value = key.strip().lower(), value.strip()
+        if key == 'name':
+            interfaces.append({'interface': value, 'description': None, 'ssid': None,
+                               'bssid': None, 'signal': None, 'channel': None, 'state': None})
+        elif interfaces and key in NETSH_FIELDS and value:
+            if key in ('signal', 'channel'):
+                value = int(value.rstrip('%')) if value.rstrip('%').isdigit() else None
+            elif key == 'bssid':
+                value = value.lower()
+            interfaces[-1][NETSH_FIELDS[key]] = value
+    return interfaces
+
+
+def get_wifi_link():
+    """The connected WiFi interface as a dict (interface, description, ssid,
+    bssid, signal, channel, state, ip), or None. `ip` is the address used to reach the portal."""
+    import subprocess
+    from state_cache import local_ip
+    
+    with span('ssid_lookup') as s:
+        try:
+            result = subprocess.run(
+                ['netsh', 'wlan', 'show', 'interfaces'],
+                capture_output=True,
+                text=True,
+                check=True
+            )
+            
+            for wifi in parse_wifi_interfaces(result.stdout):
+                if wifi['ssid']:
+                    wifi['ip'] = local_ip(split_url(PORTAL_URL)[0])
+                    s['ssid'] = wifi['ssid']
+                    s['bssid'] = wifi['bssid']
+                    return wifi
+        except:
+            s['failed'] = True
+        return None
+
+
+def parse_interface_addresses(text):
+    """Parse `netsh interface ipv4 show addresses` into {interface name: IPv4 address}"""
+    addresses = {}
+    name = None
+    for line in text.splitlines():
+        if '"' in line and line.strip().lower().startswith('configuration for interface'):
+            name = line.split('"')[1]
+            continue
+        key, sep, value = line.partition(':')
+        if sep and name and key.strip().lower() == 'ip address' and name not in addresses:
+            addresses[name] = value.strip()
+    return addresses
+
+
+def get_wifi_links():
+    """Every connected WiFi interface as a get_wifi_link() dict, with each
+    interface's own address as `ip` (machines with a USB dongle have two)"""
+    import subprocess
+    from state_cache import local_ip
+    
+    with span('ssid_lookup', all=True) as s:
+        try:
+            result = subprocess.run(['netsh', 'wlan', 'show', 'interfaces'],
+                                    capture_output=True, text=True, check=True)
+            links = [wifi for wifi in parse_wifi_interfaces(result.stdout) if wifi['ssid']]
+            if len(links) == 1:
+                # The only link is the one the default route uses
+                links[0]['ip'] = local_ip(split_url(PORTAL_URL)[0])
+            elif links:
+                result = subprocess.run(['netsh', 'interface', 'ipv4', 'show', 'addresses'],
+                                        capture_output=True, text=True, check=True)
+                addresses = parse_interface_addresses(result.stdout)
+                for wifi in links:
+                    wifi['ip'] = addresses.get(wifi['interface'])
+        except:
+            s['failed'] = True
+            return []
+        s['interfaces'] = len(links)
+        return links
+
+
+def get_arg(name):
+    """The value following `name` on the command line, or None if missing or empty"""
+    if name in sys.argv:
+        index = sys.argv.index(name) + 1
+        # Task Scheduler leaves "$(name)" in place when a value query finds nothing
+        if index < len(sys.argv) and sys.argv[index] and not sys.argv[index].startswith('$('):
+            return sys.argv[index]
+    return None
+
+
+def get_event_link():
+    """The link named by the event that started this run, as a get_wifi_link()
+    dict, or None. The scheduled task passes the event's --ssid and the
+    adapter's description as --adapter; the NetworkManager hook passes
+    --ssid, the device as --interface and --ip. A triggered run then need
+    not spawn netsh to find out what just connected."""
+    ssid = get_arg('--ssid')
+    if ssid is None:
+        return None
+    ip = get_arg('--ip')
+    if ip is None:
+        from state_cache import local_ip
+        ip = local_ip(split_url(PORTAL_URL)[0])
+    return {'interface': get_arg('--interface'), 'description': get_arg('--adapter'),
+            'ssid': ssid, 'bssid': get_arg('--bssid'), 'signal': None, 'channel': None,
+            'state': 'connected', 'ip': ip}
+
+
 def get_connected_wifi():
     """Get the currently connected WiFi network name"""
+    wifi = get_wifi_link()
+    return wifi['ssid'] if wifi else None
+
+
+def split_url(url):
+    """Return (host, port, path) of an http URL without importing urllib"""
+    host, _, path = url.split('://', 1)[-1].partition('/')
+    host, _, port = host.partition(':')
+    return host, int(port or 80), '/' + path
+
+
+def quick_probe(timeout=3):
+    """Stdlib-only connectivity check for the common "already online" case,
+    climbing the probe ladder (see PROBE_TARGETS) for PROBE_URL.
+
+    Speaks just enough HTTP over a plain socket to read the status line,
+    so a triggered run that finds the internet up never loads http.client.
+    The verdict, and a captive reply, are cached for the login that follows.
+    """
+    from state_cache import get_state, local_ip
+    
+    host, port, path = split_url(PROBE_URL)
+    with span('quick_probe') as s:
+        known = get_state().probe_addresses().get(host)
+        if known and local_ip(known, port) is None:
+            s['tier'] = 'route'
+            remember_probe(None, False)
+            return False
+        reply = None
+        if known:
+            s['tier'] = 'direct'
+            reply = raw_probe(PROBE_URL, known, min(timeout, PROBE_DIRECT_TIMEOUT), s)
+        if reply is None:
+            s['tier'] = 'dns'
+            reply = raw_probe(PROBE_URL, None, timeout, s)
+        if reply is None:
+            return False
+        s['status'] = reply.status_code
+        online = reply.status_code == 204
+        if online and s['tier'] == 'dns' and reply.peer != host:
+            record_probe_address(host, reply.peer)
+        remember_probe(None, online, None if online else reply, PROBE_URL)
+        return online
+
+
+def raw_probe(url, address, timeout, s):
+    """GET `url` over a plain socket (from `address`, skipping DNS, if
+    given). Returns an http_pool.Response (only the status and peer for a
+    204, so the fast path stays stdlib-only) or None if nothing answered."""
+    import socket
+    
+    host, port, path = split_url(url)
+    start = time.monotonic()
     try:
-        result = subprocess.run(
-            ['netsh', 'wlan', 'show', 'interfaces'],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        for line in result.stdout.split('\n'):
-            if 'SSID' in line and 'BSSID' not in line:
-                return line.split(':')[1].strip()
-    except:
-        pass
+        # A bytes host skips the idna codec (and with it re) in getaddrinfo
+        with socket.create_connection((address or host.encode('ascii'), port),
+                                      timeout=timeout) as sock:
+            sock.sendall((f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+                          "User-Agent: JIIT-AutoAuth\r\nConnection: close\r\n\r\n").encode())
+            data = sock.recv(4096)
+            status = int(data.split(b'\r\n', 1)[0].split()[1])
+            peer = sock.getpeername()[0]
+            if status != 204:
+                # A captive reply: read on for the portal it names
+                try:
+                    while len(data) < PORTAL_PAGE_SCAN:
+                        sock.settimeout(max(0.01, start + timeout - time.monotonic()))
+                        chunk = sock.recv(4096)
+                        if not chunk:
+                            break
+                        data += chunk
+                except OSError:
+                    pass
+    except (OSError, ValueError, IndexError) as e:
+        s['failed'] = type(e).__name__
+        return None
+    
+    if status == 204:
+        return _ProbeReply(status, peer)
+    from http_pool import Response
+    
+    head, _, body = data.partition(b'\r\n\r\n')
+    headers = {}
+    for line in head.decode('latin-1').split('\r\n')[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return Response(status, headers, body, False, time.monotonic() - start, url, peer)
+
+
+class _ProbeReply:
+    """The part of an http_pool.Response a 204 probe needs"""
+    
+    def __init__(self, status_code, peer):
+        self.status_code = status_code
+        self.peer = peer
+
+
+def record_probe_address(host, peer):
+    """Remember the (IPv4) address `host` answered a 204 probe from"""
+    from state_cache import get_state
+    
+    if peer and ':' not in peer:
+        get_state().set_probe_address(host, peer)
+
+
+# source IP (None: the default route) -> (time, online, captive Response, probe URL)
+_probe_cache = {}
+# When forget_probes() last ran: a probe that started before then is stale
+_probes_forgotten = 0.0
+
+
+def remember_probe(source_ip, online, response=None, url=None, started=None):
+    """Cache a verdict, unless the probe started (at `started`, monotonic)
+    before the cache was last cleared"""
+    if started is not None and started <= _probes_forgotten:
+        return
+    _probe_cache[source_ip] = (time.monotonic(), online, response, url)
+
+
+def cached_probe(source_ip, max_age=PROBE_CACHE_TTL):
+    """(online, captive Response, probe URL) of a probe through `source_ip`
+    at most `max_age` seconds ago, or None"""
+    entry = _probe_cache.get(source_ip)
+    if entry and time.monotonic() - entry[0] <= max_age:
+        return entry[1:]
     return None
 
 
-def check_internet_connection():
-    """Check if we can access the internet"""
+def forget_probes(source_ip=None):
+    """Drop the cached probe verdicts (through `source_ip`, or all): the
+    link changed or we just logged in"""
+    global _probes_forgotten
+    
+    _probes_forgotten = time.monotonic()
+    if source_ip is None:
+        _probe_cache.clear()
+    else:
+        _probe_cache.pop(source_ip, None)
+
+
+# Registered console handlers, kept so ctypes does not free them
+_console_handlers = []
+
+
+def install_shutdown_handler(callback):
+    """On Windows, run `callback(reason)` to completion when the console is
+    closed, the user logs off or the machine shuts down; False elsewhere"""
+    if sys.platform != 'win32':
+        return False
+    import ctypes
+    from ctypes import wintypes
+    
+    reasons = {CTRL_CLOSE_EVENT: 'close', CTRL_LOGOFF_EVENT: 'logoff',
+               CTRL_SHUTDOWN_EVENT: 'shutdown'}
+    
+    @ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.DWORD)
+    def handler(ctrl_type):
+        reason = reasons.get(ctrl_type)
+        if reason is not None:
+            dump_flight_recorder(reason)
+            try:
+                callback(reason)
+            except Exception as e:
+                print(f"Error signing out on {reason}: {e}")
+        # Ctrl+C / Ctrl+Break go on to Python's own handler
+        return False
+    
+    if not ctypes.windll.kernel32.SetConsoleCtrlHandler(handler, True):
+        return False
+    _console_handlers.append(handler)
+    return True
+
+
+def send_trigger(ssid=None, timeout=1):
+    """Forward a link event to the resident daemon; False if none is listening"""
+    import socket
+    
     try:
-        response = requests.get('http://www.gstatic.com/generate_204', 
-                               timeout=5, 
-                               allow_redirects=False)
-        return response.status_code == 204
-    except:
+        with socket.create_connection((b'127.0.0.1', DAEMON_PORT), timeout=timeout) as sock:
+            sock.sendall(f"TRIGGER {ssid or ''}\n".encode())
+            return sock.recv(64).startswith(b'OK')
+    except OSError:
+        return False
+
+
+def find_portal_url(response, probe_url):
+    """The captive portal URL a probe response sends the browser to (Location
+    header, meta refresh or JavaScript redirect), or None. Only portals on
+    a private address, or on the configured portal's host, are accepted:
+    credentials are never sent to a public host a redirect names."""
+    import html
+    import ipaddress
+    import re
+    from urllib.parse import urljoin, urlsplit, urlunsplit
+    
+    target = None
+    if response.status_code in (301, 302, 303, 307, 308):
+        target = response.headers.get('location')
+    elif response.status_code == 200:
+        page = response.text[:PORTAL_PAGE_SCAN]
+        for pattern in PORTAL_REDIRECT_PATTERNS:
+            match = re.search(pattern, page, re.I)
+            if match:
+                target = html.unescape(match.group(1))
+                break
+    if not target:
+        return None
+    
+    parts = urlsplit(urljoin(probe_url, target.strip()))
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return None
+    try:
+        trusted = ipaddress.ip_address(parts.hostname).is_private
+    except ValueError:
+        trusted = False
+    if not trusted and parts.hostname != urlsplit(PORTAL_URL).hostname:
+        return None
+    return urlunsplit((parts.scheme, parts.netloc, parts.path or '/', parts.query, ''))
+
+
+def discover_portal(response, probe_url, profile):
+    """Remember on `profile` the portal a captive probe reply points to and
+    the driver its reply fingerprints as; returns the portal URL or None"""
+    from portal_drivers import fingerprint
+    
+    target = find_portal_url(response, probe_url)
+    driver = fingerprint(response, target)
+    portal_url = target and (driver or profile.get_driver()).portal_url(target)
+    if portal_url or driver:
+        profile.set_discovered_url(portal_url, driver and driver.name)
+    return portal_url
+
+
+def check_internet_connection(timeout=5, url=None, source_address=None, profile=None,
+                              max_age=PROBE_CACHE_TTL):
+    """Check if we can access the internet (through the interface owning
+    `source_address`, if given), climbing the probe ladder (see
+    PROBE_TARGETS) unless a verdict at most `max_age` seconds old is cached.
+    A captive reply naming the portal is remembered as `profile`'s portal,
+    so the login goes straight there. Returns False for a captive reply and
+    None when nothing answered."""
+    url = url or PROBE_URL
+    source_ip = source_address and source_address[0]
+    with span('probe', timeout=timeout) as s:
+        cached = cached_probe(source_ip, max_age)
+        if cached is not None:
+            s['tier'] = 'cache'
+            online, response, url = cached
+        else:
+            started = time.monotonic()
+            targets = [url] + [t for t in PROBE_TARGETS if t != url] if url == PROBE_URL else [url]
+            online, response, url = probe_ladder(targets, timeout, source_address, s)
+            if online is None:
+                return None
+            remember_probe(source_ip, online, response, url, started)
+        if not online and profile is not None and response is not None:
+            portal_url = discover_portal(response, url, profile)
+            if portal_url:
+                s['portal'] = portal_url
+        return online
+
+
+def probe_ladder(urls, timeout, source_address, s):
+    """Probe `urls` route check first, then at their known addresses, then
+    by name. Returns (online, captive Response, URL that answered), with
+    online None if nothing answered."""
+    from state_cache import get_state, local_ip
+    
+    known = get_state().probe_addresses()
+    direct = [(url, known[split_url(url)[0]]) for url in urls if split_url(url)[0] in known]
+    if direct and source_address is None and all(
+            local_ip(address, split_url(url)[1]) is None for url, address in direct):
+        s['tier'] = 'route'
+        return False, None, urls[0]
+    deadline = time.monotonic() + timeout
+    if direct:
+        s['tier'] = 'direct'
+        answer = race_probes(direct, min(timeout, PROBE_DIRECT_TIMEOUT), source_address, s)
+        if answer:
+            return answer
+    s['tier'] = 'dns'
+    answer = race_probes([(url, None) for url in urls], max(0.1, deadline - time.monotonic()),
+                         source_address, s)
+    return answer or (None, None, urls[0])
+
+
+def race_probes(targets, timeout, source_address, s):
+    """GET each (url, address) target in parallel, at `address` (skipping
+    DNS) where given; returns (online, captive Response, url) for the first
+    HTTP answer, or None if none came within `timeout`"""
+    import queue
+    import threading
+    from http_pool import get_pool
+    
+    answers = queue.Queue()
+    
+    def probe(url, address):
+        host, port, path = split_url(url)
+        try:
+            if address:
+                netloc = host if port == 80 else f"{host}:{port}"
+                response = get_pool().get(f"http://{address}:{port}{path}", headers={'Host': netloc},
+                                          timeout=timeout, source_address=source_address)
+            else:
+                response = get_pool().get(url, timeout=timeout, source_address=source_address)
+        except Exception as e:
+            answers.put((url, address, e))
+            return
+        answers.put((url, address, response))
+    
+    if len(targets) == 1:
+        probe(*targets[0])
+    else:
+        for target in targets:
+            threading.Thread(target=probe, args=target, daemon=True).start()
+    deadline = time.monotonic() + timeout
+    for _ in targets:
+        try:
+            url, address, response = answers.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        if isinstance(response, Exception):
+            s['failed'] = type(response).__name__
+            continue
+        s.pop('failed', None)
+        s['status'] = response.status_code
+        s['reused'] = response.reused
+        s['target'] = url
+        online = response.status_code == 204
+        host = split_url(url)[0]
+        if online and not address and response.peer != host:
+            record_probe_address(host, response.peer)
+        return online, None if online else response, url
+    return None
+
+
+def parse_portal_response(text):
+    """Interpret the Cyberoam login.xml reply.
+
+    Returns True for an explicit sign-in, False for an explicit rejection
+    and None when the reply says neither (so the caller has to probe).
+    """
+    import re
+    
+    if not text:
+        return None
+    status = re.search(r'<status>\s*(?:<!\[CDATA\[)?\s*(\w+)', text, re.I)
+    message = re.search(r'<message>\s*(?:<!\[CDATA\[)?(.*?)(?:\]\]>)?\s*</message>',
+                        text, re.I | re.S)
+    status = status.group(1).upper() if status else ''
+    message = message.group(1).lower() if message else ''
+    if status == 'LIVE' or 'signed in' in message or 'successfully logged in' in message:
+        return True
+    if status == 'LOGIN' or any(k in message for k in
+                                ('failed', 'invalid', 'incorrect', 'maximum login limit',
+                                 'could not log you on', 'exceeded')):
         return False
+    return None
 
 
-def login_to_portal(username, password):
+def wait_for_internet(timeout=LOGIN_CONFIRM_TIMEOUT, url=None, source_address=None):
+    """Probe with short, increasing intervals until online or the deadline passes"""
+    with span('confirm', timeout=timeout) as s:
+        deadline = time.monotonic() + timeout
+        step = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                s['online'] = False
+                return False
+            s['probes'] = step + 1
+            if check_internet_connection(timeout=min(2, remaining), url=url,
+                                         source_address=source_address, max_age=0):
+                s['online'] = True
+                return True
+            delay = LOGIN_CONFIRM_INTERVALS[min(step, len(LOGIN_CONFIRM_INTERVALS) - 1)]
+            step += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                s['online'] = False
+                return False
+            time.sleep(min(delay, remaining))
+
+
+def post_credentials(username, password, timeout=10, profile=None, pool=None,
+                     source_address=None):
+    """POST the credentials in the profile's portal dialect and return the portal's Response"""
+    from failover import send_with_failover
+    from http_pool import get_pool
+    from profiles import get_default_profile
+    
+    profile = profile or get_default_profile()
+    driver = profile.get_driver()
+    pool = pool or get_pool()
+    
+    def fetch(url):
+        return pool.get(url, timeout=timeout, source_address=source_address)
+    
+    # Prepare login data
+    login_data = driver.login_form(profile, username, password, fetch)
+    # Whatever was probed before the login no longer holds
+    forget_probes(source_address and source_address[0])
+    
+    def send(login_url, timeout):
+        return pool.post(login_url, data=login_data, timeout=timeout,
+                         source_address=source_address)
+    
+    # Submit login to the healthiest gateway, failing over to the others
+    with span('portal_post', profile=profile.name, driver=driver.name) as s:
+        response = send_with_failover(profile.get_login_urls(), send, timeout, PORTAL_HEDGING,
+                                      profile.get_preferred_login_url())
+        event('portal_reply', portal=response.url, status=response.status_code,
+              body=response.text[:200])
+        s['status'] = response.status_code
+        s['reused'] = response.reused
+        s['portal'] = response.url
+        return response
+
+
+def read_login_reply(response, profile):
+    """The portal's verdict on a login (see parse_portal_response), in the
+    profile's dialect; a sign-in's keepalive/logout details are kept"""
+    driver = profile.get_driver()
+    verdict = driver.parse_login(response)
+    if verdict:
+        session = driver.session(response)
+        if session:
+            profile.set_session(session)
+    return verdict
+
+
+def submit_login(username, password, timeout=10, profile=None, pool=None):
+    """POST the credentials to the portal and return its verdict"""
+    from profiles import get_default_profile
+    
+    profile = profile or get_default_profile()
+    return read_login_reply(post_credentials(username, password, timeout, profile, pool),
+                            profile)
+
+
+def authenticate(username, password, profile=None, source_address=None):
+    """Log in and confirm it; raises retry_policy.LoginFailure saying why not"""
+    import http.client
+    from profiles import get_default_profile
+    from retry_policy import (PORTAL_DOWN, TRANSIENT, LoginFailure, breaker_wait,
+                              classify_error, classify_reply, classify_status,
+                              login_token_wait, parse_retry_after)
+    
+    profile = profile or get_default_profile()
+    with span('login') as s:
+        try:
+            wait = min(breaker_wait(url) for url in profile.get_login_urls())
+            if wait:
+                raise LoginFailure(PORTAL_DOWN, f"portal keeps failing, next try in {wait:.0f}s")
+            # Rate limit shared by all runs, so a flapping link cannot hammer the portal
+            wait = login_token_wait(profile.name)
+            while wait:
+                traced_sleep(wait, 'login-rate')
+                wait = login_token_wait(profile.name)
+            try:
+                response = post_credentials(username, password, profile=profile,
+                                            source_address=source_address)
+            except (OSError, http.client.HTTPException) as e:
+                raise LoginFailure(classify_error(e), f"portal unreachable ({type(e).__name__})")
+            kind = classify_status(response.status_code)
+            if kind:
+                raise LoginFailure(kind, f"portal answered HTTP {response.status_code}",
+                                   parse_retry_after(response.headers.get('retry-after')))
+            
+            # Trust an explicit answer from the portal, otherwise confirm by probing
+            verdict = read_login_reply(response, profile)
+            if verdict is False:
+                kind = classify_reply(response.text)
+                raise LoginFailure(kind, f"portal rejected the login ({kind})")
+            if verdict is None and not wait_for_internet(url=profile.get_probe_urls()[0],
+                                                         source_address=source_address):
+                raise LoginFailure(TRANSIENT, "login not confirmed")
+        except LoginFailure as failure:
+            s['success'] = False
+            s['failure'] = failure.kind
+            raise
+        s['success'] = True
+
+
+def logout_from_portal(username, profile=None, source_address=None, timeout=LOGOUT_TIMEOUT,
+                       reason='shutdown'):
+    """Best-effort portal sign-out (Cyberoam mode 193, or the profile's
+    dialect); True if the portal confirmed it"""
+    import http.client
+    from failover import rank_endpoints
+    from http_pool import get_pool
+    from profiles import get_default_profile
+    
+    profile = profile or get_default_profile()
+    driver = profile.get_driver()
+    login_url = rank_endpoints(profile.get_login_urls(), profile.get_preferred_login_url())[0]
+    request = driver.logout_request(login_url, username, profile, profile.get_session())
+    with span('logout', reason=reason, driver=driver.name) as s:
+        s['confirmed'] = False
+        if request is None:
+            # Nothing from the login to sign out with (e.g. a pfSense
+            # portal without its logout page)
+            s['failed'] = 'no-session'
+        else:
+            method, url, data = request
+            try:
+                response = get_pool().request(method, url, data=data, timeout=timeout,
+                                              source_address=source_address)
+                s['status'] = response.status_code
+                s['confirmed'] = driver.parse_logout(response)
+            except (OSError, http.client.HTTPException) as e:
+                s['failed'] = type(e).__name__
+    metrics.incr('logout.confirmed' if s['confirmed'] else 'logout.failed')
+    return s['confirmed']
+
+
+def login_to_portal(username, password, profile=None):
     """Login to the captive portal"""
+    from retry_policy import LoginFailure
+    
     try:
-        session = requests.Session()
-        
-        # Prepare login data
-        login_data = {
-            'mode': '191',
-            'username': username,
-            'password': password,
-            'a': str(int(time.time() * 1000)),
-            'producttype': '0'
-        }
-        
-        # Submit login
-        login_url = PORTAL_URL.rsplit('/', 1)[0] + '/login.xml'
-        response = session.post(login_url, data=login_data, timeout=10)
-        
-        # Wait and check if login was successful
-        time.sleep(3)
-        return check_internet_connection()
-    except:
+        authenticate(username, password, profile)
+        return True
+    except LoginFailure:
         return False
 
 
-def attempt_login(username, password, current_wifi):
-    """Attempt to login to the current WiFi"""
+def ensure_logged_in(username, password, current_wifi, profile=None, source_address=None,
+                     captive=False):
+    """attempt_login() that raises retry_policy.LoginFailure instead of returning False.
+    
+    `source_address` binds every request to one interface's address;
+    `captive` skips the first connectivity check when the caller just made it.
+    """
+    from profiles import classify, get_default_profile
+    
     print(f"Connected to: {current_wifi}")
+    profile = profile or classify(current_wifi) or get_default_profile()
+    probe_url = profile.get_probe_urls()[0]
     
     # Check if already authenticated
-    if check_internet_connection():
+    if not captive and check_internet_connection(url=probe_url, source_address=source_address,
+                                                 profile=profile):
         print("✓ Internet already accessible")
-        return True
+        return
+    
+    # An AP change on an authenticated segment keeps the portal session
+    # (unless the portal's `live` check says otherwise); the link just needs
+    # a moment to pass traffic again
+    if on_trusted_segment(current_wifi, source_address and source_address[0]):
+        from keepalive import send_keepalive
+        
+        print("Roamed within an authenticated segment, checking the portal session...")
+        session = send_keepalive(username, timeout=2, portal_url=profile.get_login_url(),
+                                 source_address=source_address, profile=profile)
+        if session is not False and wait_for_internet(ROAM_SETTLE_TIMEOUT, url=probe_url,
+                                                      source_address=source_address):
+            metrics.incr('roam.kept')
+            print("✓ Portal session still valid, no login needed")
+            return
     
     # Attempt login
     print("Logging in...")
-    if login_to_portal(username, password):
-        print("✓ Login successful!")
+    authenticate(username, password, profile, source_address)
+    print("✓ Login successful!")
+
+
+def attempt_login(username, password, current_wifi, profile=None, source_address=None,
+                  captive=False):
+    """Attempt to login to the current WiFi"""
+    from retry_policy import LoginFailure
+    
+    try:
+        ensure_logged_in(username, password, current_wifi, profile, source_address, captive)
         return True
-    else:
-        print("✗ Login failed")
+    except LoginFailure as failure:
+        print(f"✗ Login failed: {failure}")
+        metrics.incr('failure.' + failure.kind)
         return False
 
 
-def monitor_wifi_changes(username, password):
+def on_trusted_segment(ssid, ip=None):
+    """True if this SSID, with our current client IP (or `ip`), was authenticated
+    recently enough to assume its portal session survives a roam"""
+    from state_cache import get_state, local_ip
+    
+    ip = ip or local_ip(split_url(PORTAL_URL)[0])
+    return bool(ssid and ip) and get_state().segment(ssid, ip) is not None
+
+
+def remember_online(ssid=None, bssid=None, ip=None):
+    """Record in the state cache that this link (client IP `ip`, by default
+    the one the portal route uses) is authenticated"""
+    from keepalive import load_session_history
+    from state_cache import ONLINE_TTL, get_state, link_keys, local_ip
+    
+    state = get_state()
+    ttl, segment_ttl = ONLINE_TTL, ROAM_TRUST_TTL
+    lifetimes = sorted(load_session_history())
+    if ssid and lifetimes:
+        # A session is not trusted beyond its typical lifetime
+        lifetime = lifetimes[len(lifetimes) // 2]
+        state.set_session_expiry(ssid, time.time() + lifetime)
+        ttl = min(ttl, lifetime)
+        segment_ttl = min(segment_ttl, lifetime)
+    ip = ip or local_ip(split_url(PORTAL_URL)[0])
+    state.set_link_status(link_keys(ssid=ssid, bssid=bssid, ip=ip), 'online', ttl)
+    if ssid and ip:
+        state.set_segment(ssid, ip, bssid, segment_ttl)
+
+
+def claim_login(link):
+    """Take the cross-process login lease, waiting while another instance holds it.
+    
+    Returns False if that other instance got this link online meanwhile.
+    """
+    from state_cache import get_state
+    
+    state = get_state()
+    waited = False
+    while not state.acquire_login_lease():
+        if not waited:
+            print(f"Another instance (PID {state.login_lease_holder()}) is logging in, waiting...")
+            waited = True
+        time.sleep(0.2)
+    if waited and state.link_status(link)[0] == 'online':
+        state.release_login_lease()
+        return False
+    return True
+
+
+def login_with_retries(username, password, link, wifi=None, source_address=None):
+    """main()'s one-shot login: attempt, and retry per failure kind until
+    online or the retry policy gives up. `wifi` is the link if the event named
+    it, otherwise netsh is asked on every attempt; a link without an `ip` gets
+    its address at each attempt, as the event may come before DHCP is done.
+    `link` is its state cache keys, or None to derive them from the link at
+    each attempt. A client that finds itself
+    captive first waits a random start jitter, so a building full of
+    clients reconnecting together does not reach the portal in one burst.
+    
+    Returns (online, last failure kind, attempts).
+    """
+    from http_pool import get_pool
+    from profiles import classify
+    from retry_policy import NO_WIFI, NOT_CAPTIVE, LoginFailure, RetryPolicy, start_jitter
+    from state_cache import get_state, link_keys, local_ip
+    
+    state = get_state()
+    policy = RetryPolicy()
+    attempt = 0
+    kind = None
+    
+    while True:
+        attempt += 1
+        print(f"\nAttempt {attempt}")
+        retry_after = None
+        
+        # Open the portal socket while netsh works out the SSID (if the event did not say)
+        get_pool().prewarm(PORTAL_URL, source_address=source_address)
+        current = wifi or get_wifi_link()
+        if current and not current.get('ip'):
+            current = dict(current, ip=local_ip(split_url(PORTAL_URL)[0]))
+        current_wifi = current['ssid'] if current else None
+        try:
+            if not current_wifi:
+                raise LoginFailure(NO_WIFI, "No WiFi connected")
+            
+            # Check if WiFi name matches a portal profile
+            profile = classify(current_wifi, current.get('bssid'))
+            if profile is None:
+                raise LoginFailure(NOT_CAPTIVE, f"Not a college network: {current_wifi}")
+            
+            if attempt == 1:
+                traced_sleep(start_jitter(profile.get_login_urls()), 'start-jitter')
+            if not claim_login(link or link_keys(ssid=current_wifi, bssid=current.get('bssid'),
+                                                 ip=current['ip'])):
+                print("✓ Another instance completed the login")
+                return True, None, attempt
+            try:
+                ensure_logged_in(username, password, current_wifi, profile, source_address)
+            finally:
+                state.release_login_lease()
+            remember_online(current_wifi, current['bssid'], current['ip'])
+            return True, None, attempt
+        
+        except LoginFailure as failure:
+            print(f"✗ {failure}")
+            kind = failure.kind
+            retry_after = failure.retry_after
+            metrics.incr('failure.' + kind)
+        
+        delay = policy.next_delay(kind, retry_after)
+        if delay is None:
+            return False, kind, attempt
+        print(f"Retrying in {delay:.1f}s...")
+        metrics.incr('retry')
+        traced_sleep(delay, kind)
+
+
+def monitor_wifi_changes(username, password, backend=None):
     """Continuously monitor for WiFi changes and auto-login"""
+    from interfaces import ONLINE, InterfaceSession, link_id
+    from link_monitor import get_link_backend
+    from keepalive import SessionKeepalive
+    
     print("\n" + "=" * 50)
     print("MONITORING MODE - Watching for WiFi changes...")
     print("Press Ctrl+C to stop")
     print("=" * 50 + "\n")
     
-    last_wifi = None
-    last_login_attempt = {}
+    # Event-driven where the OS supports it, netsh polling otherwise
+    backend = backend or get_link_backend()
+    print(f"Link-state backend: {backend.name}")
+    
+    if METRICS_PORT:
+        try:
+            serve_metrics(METRICS_PORT)
+            print(f"Metrics: http://127.0.0.1:{METRICS_PORT}/metrics")
+        except OSError as e:
+            print(f"Metrics endpoint unavailable: {e}")
+    
+    error_delay = MONITOR_ERROR_DELAY
+    
+    keepalive = SessionKeepalive(username, password)
+    if SESSION_KEEPALIVE:
+        keepalive.start()
+    install_dump_signals()
+    
+    # One state machine per wireless adapter, so a second adapter (e.g. a
+    # USB dongle) gets its own login instead of being ignored
+    sessions = {}
+    
+    def on_online(session, profile):
+        keepalive.on_login(profile)
+    
+    def on_down(session):
+        if not any(s.state == ONLINE for s in sessions.values() if s is not session):
+            keepalive.on_disconnect()
+    
+    def on_shutdown(reason):
+        for session in list(sessions.values()):
+            session.shutdown()
+    
+    install_shutdown_handler(on_shutdown)
     
     while True:
         try:
-            current_wifi = get_connected_wifi()
+            current_wifi = backend.current()
+            links = {link['interface']: link for link in backend.links(current_wifi)}
+            changed = [name for name in list(links) + [n for n in sessions if n not in links]
+                       if link_id(links.get(name)) != link_id(
+                           sessions[name].link if name in sessions else None)]
+            
+            # If WiFi changed on any adapter
+            if changed:
+                metrics.incr('link_change')
+                event('link_change', ssid=current_wifi, backend=backend.name,
+                      interfaces=len(links))
+                for name in changed:
+                    if name not in sessions:
+                        sessions[name] = InterfaceSession(name, username, password,
+                                                          on_online, on_down)
+                    sessions[name].update(links.get(name))
             
-            # If WiFi changed
-            if current_wifi != last_wifi:
-                if current_wifi:
-                    print(f"\n[{time.strftime('%H:%M:%S')}] WiFi changed to: {current_wifi}")
-                    
-                    # Check if it's a college WiFi (contains any keyword)
-                    if any(k.lower() in current_wifi.lower() for k in WIFI_KEYWORDS):
-                        print("→ College WiFi detected!")
-                        
-                        # Avoid repeated login attempts within 60 seconds
-                        last_attempt_time = last_login_attempt.get(current_wifi, 0)
-                        if time.time() - last_attempt_time > 60:
-                            attempt_login(username, password, current_wifi)
-                            last_login_attempt[current_wifi] = time.time()
-                        else:
-                            print("→ Recent login attempt, skipping...")
-                    else:
-                        print("→ Not a college WiFi, ignoring")
-                else:
-                    print(f"\n[{time.strftime('%H:%M:%S')}] WiFi disconnected")
-                
-                last_wifi = current_wifi
+            if backend.closed:
+                break
             
-            # Check every 3 seconds
-            time.sleep(3)
+            # Sleep until the link changes (or the next poll for the fallback)
+            error_delay = MONITOR_ERROR_DELAY
+            backend.wait()
             
         except KeyboardInterrupt:
             print("\n\nMonitoring stopped by user")
             break
+        except SystemExit:
+            # SIGTERM: the machine is shutting down, give the login slots back
+            for session in sessions.values():
+                session.shutdown()
+            raise
         except Exception as e:
             print(f"Error in monitoring: {e}")
-            time.sleep(5)
+            traced_sleep(error_delay, 'monitor-error')
+            error_delay = min(error_delay * 2, MONITOR_MAX_ERROR_DELAY)
+    
+    for session in sessions.values():
+        session.join()
+    keepalive.stop()
+    backend.close()
+    rates = backend.rates()
+    print(f"Link-state backend {backend.name}: {backend.stats['wakeups']} wakeups, "
+          f"{backend.stats['spawns']} process spawns "
+          f"({rates['wakeups']}/h, {rates['spawns']}/h)")
 
 
 def main():
+    # Scheduled runs have nobody watching the console
+    if '--background' in sys.argv:
+        sys.stdout = sys.stderr = BackgroundLog()
+
+    # Capture link, probe and portal traffic for replay.py
+    if '--record' in sys.argv:
+        from replay import start_recording
+        start_recording(sys.modules[__name__])
+
     print("=" * 50)
     print("College WiFi Auto-Login Script")
     print("=" * 50)
@@ -196,14 +1105,49 @@ def main():
     # Check if --setup flag is present (from installer)
     force_setup = '--setup' in sys.argv
     
+    # Trigger client: hand the event to the daemon, which has everything warm
+    if '--trigger' in sys.argv:
+        if send_trigger(get_arg('--ssid')):
+            print("✓ Event forwarded to the resident daemon")
+            return
+        print("ℹ Daemon not running, handling the event here")
+    
+    if TRACE_ENABLED and not force_setup:
+        enable_trace_file()
+    
+    if '--daemon' in sys.argv:
+        from daemon import run_daemon
+        sys.exit(0 if run_daemon() else 1)
+    
     if not force_setup:
-        # First, check if internet is already accessible
+        # A run moments ago may already have settled this link
+        from state_cache import get_state, link_keys, local_ip
+        
+        state = get_state()
+        # The triggering event, when it named the link, is taken as the truth
+        event_wifi = get_event_link()
+        if event_wifi:
+            link = link_keys(ssid=event_wifi['ssid'], ip=event_wifi['ip'])
+        else:
+            link = link_keys(ip=local_ip(split_url(PORTAL_URL)[0]))
+        status, age = state.link_status(link)
+        if status == 'online':
+            print(f"\n✓ Internet verified {age:.0f}s ago on this link. No login needed.")
+            print("=" * 50)
+            return
+        
+        # First, check if internet is already accessible (stdlib-only fast path)
         print("\nChecking internet connectivity...")
-        if check_internet_connection():
+        if quick_probe():
+            state.set_link_status(link, 'online')
             print("✓ Internet already accessible. No login needed.")
             print("=" * 50)
             return
         
+        if ASYNC_ENGINE and not MONITOR_MODE:
+            from auth_engine import run_engine
+            sys.exit(0 if run_engine() else 1)
+        
         print("✗ No internet access detected.")
         print("Proceeding with authentication...\n")
     else:
@@ -236,34 +1180,23 @@ def main():
     if MONITOR_MODE:
         monitor_wifi_changes(username, password)
     else:
-        # Single attempt mode (original behavior)
-        max_attempts = 5
+        # Single attempt mode (original behavior), retried per failure kind
+        from retry_policy import BAD_CREDENTIALS, LOGIN_LIMIT, NOT_CAPTIVE
         
-        for attempt in range(1, max_attempts + 1):
-            print(f"\nAttempt {attempt}/{max_attempts}")
-            
-            current_wifi = get_connected_wifi()
-            if not current_wifi:
-                print("No WiFi connected, waiting...")
-                time.sleep(5)
-                continue
-            
-            # Check if WiFi name contains any of the configured keywords
-            if not any(k.lower() in current_wifi.lower() for k in WIFI_KEYWORDS):
-                print(f"Not a college network: {current_wifi}")
-                print(f"(Looking for networks matching: {', '.join(WIFI_KEYWORDS)})")
-                time.sleep(5)
-                continue
-            
-            if attempt_login(username, password, current_wifi):
-                return
-            
-            print("Retrying...")
-            time.sleep(10)
+        online, kind, attempt = login_with_retries(username, password, link, event_wifi)
+        if online:
+            return
         
-        print("\n✗ Failed after maximum attempts")
-        print("Your credentials might be incorrect.")
-        print(f"To reset, delete the file: {CONFIG_FILE}")
+        event('gave_up', kind=kind, attempts=attempt)
+        print(f"\n✗ Giving up after {attempt} attempt(s)")
+        print(f"Diagnostics saved to {dump_flight_recorder(f'login failed: {kind}')}")
+        if kind == BAD_CREDENTIALS:
+            print("Your credentials are incorrect.")
+            print(f"To reset, delete the file: {CONFIG_FILE}")
+        elif kind == LOGIN_LIMIT:
+            print("Your account is logged in on too many devices. Log out of one and reconnect.")
+        elif kind == NOT_CAPTIVE:
+            print(f"(Looking for networks matching: {', '.join(WIFI_KEYWORDS)})")
 
 
 if __name__ == "__main__":
@@ -271,4 +1204,8 @@ if __name__ == "__main__":
         main()
     except KeyboardInterrupt:
         print("\n\nStopped by user")
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)
+    except Exception as e:
+        event('crash', error=f"{type(e).__name__}: {e}")
+        dump_flight_recorder('crash')
+        raise
\ No newline at end of file
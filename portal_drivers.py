@@ -0,0 +1,288 @@
+"""Captive portal dialects.
+
+A driver knows one portal product's login, keepalive and logout requests
+and how to read its replies. PortalProfile.get_driver() picks one: the
+profile's `driver` setting, else the one fingerprinted from the last
+captive probe on the profile's networks (cached in the state file), else
+Cyberoam. Drivers only build requests and read responses; main.py and
+keepalive.py send them, so failover, retries and tracing work the same
+for every portal.
+
+Another dialect is a PortalDriver subclass handed to register().
+"""
+import re
+import time
+from abc import ABC, abstractmethod
+from urllib.parse import parse_qs, quote, urljoin, urlsplit, urlunsplit
+
+import main as core
+
+DEFAULT_DRIVER = 'cyberoam'
+
+
+def _timestamp():
+    return str(int(time.time() * 1000))
+
+
+class PortalDriver(ABC):
+    """What every portal needs answered; subclasses fill in their dialect
+    and must implement login_form() and parse_login().
+
+    The `*_request()` methods return (method, url, form) for the caller to
+    send, or None when the portal has no such request. URLs passed in are
+    login URLs as returned by login_url().
+    """
+
+    name = None
+    # Extra login form fields; a profile's `form` replaces them
+    form = {}
+    # Lowercase strings that mark a captive page, or the URL it sends the
+    # browser to, as this portal's
+    markers = ()
+
+    def matches(self, target, page):
+        """True if a captive reply redirecting to `target` (or None) with the
+        lowercased body `page` comes from this kind of portal"""
+        target = (target or '').lower()
+        return any(marker in page or marker in target for marker in self.markers)
+
+    def portal_url(self, target):
+        """The portal URL to remember from a captive redirect target"""
+        # The portal page, without the "where you were going" query
+        parts = urlsplit(target)
+        return urlunsplit((parts.scheme, parts.netloc, parts.path or '/', '', ''))
+
+    def login_url(self, portal_url):
+        """Where the credentials for the portal at `portal_url` are posted"""
+        return portal_url
+
+    def base_form(self, profile):
+        return dict(self.form if profile.form is None else profile.form)
+
+    @abstractmethod
+    def login_form(self, profile, username, password, fetch):
+        """Fields to POST to login_url(); `fetch(url)` GETs a page first, for
+        portals that hand out a one-time token before the login"""
+
+    @abstractmethod
+    def parse_login(self, response):
+        """True for an explicit sign-in, False for an explicit rejection and
+        None when the reply says neither (so the caller has to probe)"""
+
+    def session(self, response):
+        """What a successful login reply hands out for keepalive and logout"""
+        return {}
+
+    def keepalive_request(self, login_url, username, session):
+        return None
+
+    def parse_keepalive(self, response):
+        """True if the portal still has our session, False if it wants a new
+        login and None if the reply does not say"""
+        return None
+
+    def logout_request(self, login_url, username, profile, session):
+        return None
+
+    def parse_logout(self, response):
+        """True if the portal confirmed the sign-out"""
+        return False
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+
+class CyberoamDriver(PortalDriver):
+    """Cyberoam: login.xml next to the portal page (mode 191 logs in, 193
+    logs out), `live` keepalives, XML replies"""
+
+    name = 'cyberoam'
+    # Extra login.xml fields the Cyberoam portal expects
+    form = {'mode': '191', 'producttype': '0'}
+    markers = ('cyberoam', 'httpclient.html', 'login.xml')
+
+    def login_url(self, portal_url):
+        return portal_url.rsplit('/', 1)[0] + '/login.xml'
+
+    def login_form(self, profile, username, password, fetch):
+        form = self.base_form(profile)
+        form.update({'username': username, 'password': password, 'a': _timestamp()})
+        return form
+
+    def parse_login(self, response):
+        return core.parse_portal_response(response.text)
+
+    def keepalive_request(self, login_url, username, session):
+        return ('GET', login_url.rsplit('/', 1)[0] + '/live?mode=192'
+                f"&username={quote(username)}&a={_timestamp()}&producttype=0", None)
+
+    def parse_keepalive(self, response):
+        ack = re.search(r'<ack>\s*(?:<!\[CDATA\[)?\s*(\w+)', response.text, re.I)
+        return ack.group(1).lower() == 'ack' if ack else None
+
+    def logout_request(self, login_url, username, profile, session):
+        form = self.base_form(profile)
+        form.update({'mode': '193', 'username': username, 'a': _timestamp()})
+        return ('POST', login_url, form)
+
+    def parse_logout(self, response):
+        return response.status_code < 400 and bool(
+            re.search(r'<status>\s*(?:<!\[CDATA\[)?\s*LOGOUT', response.text, re.I)
+            or 'signed out' in response.text.lower())
+
+
+class SophosDriver(CyberoamDriver):
+    """Sophos XG (SFOS) kept Cyberoam's login.xml protocol and only
+    rebranded its pages; a bare redirect to httpclient.html is served by
+    the Cyberoam driver just as well"""
+
+    name = 'sophos'
+    markers = ('sophos',)
+
+
+class FortiGateDriver(PortalDriver):
+    """FortiGate: the captive redirect to /fgtauth carries a one-time
+    `magic` that has to go back with the credentials, posted to the auth
+    port's root. A successful login answers with a page pointing at
+    /keepalive?<id>, which is refreshed to keep the session and turned
+    into /logout?<id> to end it"""
+
+    name = 'fortigate'
+    markers = ('/fgtauth', 'fortigate', 'fortinet')
+
+    def login_url(self, portal_url):
+        parts = urlsplit(portal_url)
+        return urlunsplit((parts.scheme, parts.netloc, '/', '', ''))
+
+    def login_form(self, profile, username, password, fetch):
+        # A fresh captive redirect hands out the magic for this login
+        probe_url = profile.get_probe_urls()[0]
+        target = core.find_portal_url(fetch(probe_url), probe_url)
+        magic = urlsplit(target).query if target and '/fgtauth' in target else ''
+        form = self.base_form(profile)
+        form.update({'4Tredir': probe_url, 'magic': magic, 'username': username,
+                     'password': password})
+        return form
+
+    def parse_login(self, response):
+        text = response.text.lower()
+        if '/keepalive?' in text:
+            return True
+        if 'failed' in text or 'exceeded' in text:
+            return False
+        return None
+
+    def session(self, response):
+        match = re.search(r"""["']([^"']*/keepalive\?[^"']*)["']""", response.text)
+        return {'keepalive': urljoin(response.url, match.group(1))} if match else {}
+
+    def keepalive_request(self, login_url, username, session):
+        url = session.get('keepalive')
+        return ('GET', url, None) if url else None
+
+    def parse_keepalive(self, response):
+        # An expired session is sent back to /fgtauth for a new login
+        if response.status_code in (301, 302, 303, 307) or 'fgtauth' in response.text:
+            return False
+        return True if response.status_code == 200 else None
+
+    def logout_request(self, login_url, username, profile, session):
+        url = session.get('keepalive')
+        return ('GET', url.replace('/keepalive?', '/logout?'), None) if url else None
+
+    def parse_logout(self, response):
+        return response.status_code < 400 and 'logged out' in response.text.lower()
+
+
+class PfSenseDriver(PortalDriver):
+    """pfSense: the form goes to index.php of the captive portal zone; a
+    successful login redirects onwards or shows the logout page with a
+    `logout_id`. There is no keepalive request, traffic keeps the session"""
+
+    name = 'pfsense'
+    form = {'accept': 'Login'}
+    markers = ('pfsense', 'auth_user')
+
+    def matches(self, target, page):
+        if target:
+            parts = urlsplit(target)
+            if parts.path.endswith('index.php') and 'zone' in parse_qs(parts.query):
+                return True
+        return super().matches(target, page)
+
+    def portal_url(self, target):
+        # The zone is part of the portal's address
+        parts = urlsplit(target)
+        zone = parse_qs(parts.query).get('zone')
+        query = f"zone={quote(zone[0])}" if zone else ''
+        return urlunsplit((parts.scheme, parts.netloc, parts.path or '/', query, ''))
+
+    def zone(self, login_url):
+        return parse_qs(urlsplit(login_url).query).get('zone', [''])[0]
+
+    def login_form(self, profile, username, password, fetch):
+        form = self.base_form(profile)
+        form.update({'auth_user': username, 'auth_pass': password,
+                     'zone': self.zone(profile.get_login_url()),
+                     'redirurl': profile.get_probe_urls()[0]})
+        return form
+
+    def parse_login(self, response):
+        if response.status_code in (301, 302, 303, 307):
+            # Back to the login page means no, anywhere else means yes
+            return 'index.php' not in response.headers.get('location', '')
+        text = response.text.lower()
+        if 'logout_id' in text:
+            return True
+        if 'invalid credentials' in text or 'auth_user' in text:
+            return False
+        return None
+
+    def session(self, response):
+        match = re.search(r"""name=["']logout_id["'][^>]*value=["']([^"']+)""", response.text)
+        return {'logout_id': match.group(1)} if match else {}
+
+    def logout_request(self, login_url, username, profile, session):
+        if not session.get('logout_id'):
+            return None
+        return ('POST', login_url, {'logout_id': session['logout_id'],
+                                    'zone': self.zone(login_url), 'logout': 'Disconnect'})
+
+    def parse_logout(self, response):
+        return response.status_code < 400 and 'disconnected' in response.text.lower()
+
+
+# name -> driver. Fingerprinting tries the most recently registered first,
+# so a specific dialect (Sophos) is recognised before the generic one it
+# builds on (Cyberoam)
+DRIVERS = {}
+
+
+def register(driver):
+    """Make `driver` (a PortalDriver instance) available under its name"""
+    DRIVERS[driver.name] = driver
+    return driver
+
+
+for _driver in (CyberoamDriver(), SophosDriver(), FortiGateDriver(), PfSenseDriver()):
+    register(_driver)
+
+
+def get_driver(name=None):
+    """The driver called `name`, or the default one"""
+    try:
+        return DRIVERS[name or DEFAULT_DRIVER]
+    except KeyError:
+        raise ValueError(f"unknown portal driver {name!r} "
+                         f"(known: {', '.join(DRIVERS)})") from None
+
+
+def fingerprint(response, target=None):
+    """The driver for the portal behind a captive probe reply, or None if
+    the reply does not say. `target` is where it redirects, from
+    main.find_portal_url(); no further request is made."""
+    page = response.text[:core.PORTAL_PAGE_SCAN].lower()
+    for driver in reversed(list(DRIVERS.values())):
+        if driver.matches(target, page):
+            return driver
+    return None
@@ -0,0 +1,546 @@
+"""Local stand-in for the Cyberoam captive portal (or a Sophos XG,
+FortiGate or pfSense one, see VENDORS).
+
+Speaks enough of the real protocol for main.py to run against it:
+POST /login.xml (login, and logout with mode=193), GET /live, GET /httpclient.html and a /generate_204
+connectivity check that turns into a captive redirect until the client
+has logged in. Used by benchmark.py; can also be run on its own:
+
+    python portal_emulator.py --port 8090 --latency 0.05 --firewall-delay 2
+    python portal_emulator.py --port 1000 --vendor fortigate
+"""
+import argparse
+import math
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+LOGIN_REPLY = ("<?xml version='1.0' ?><requestresponse>"
+               "<status><![CDATA[{status}]]></status>"
+               "<message><![CDATA[{message}]]></message>"
+               "</requestresponse>")
+LIVE_REPLY = ("<?xml version='1.0' ?><requestresponse>"
+              "<ack><![CDATA[{ack}]]></ack></requestresponse>")
+LOGIN_PAGE = ("<html><head><title>Captive Portal</title></head>"
+              "<body><form action='login.xml' method='post'></form></body></html>")
+# What the probe gets in '200' mode: a page injected by the gateway that
+# sends the browser on to the portal
+INJECTED_PAGE = ("<html><head><title>{title}</title>"
+                 "<meta http-equiv='refresh' content='0; url={portal_url}'>"
+                 "<script>window.location.href = '{portal_url}';</script></head>"
+                 "<body>Redirecting to the login page...</body></html>")
+
+MSG_SIGNED_IN = "You are signed in as {username}"
+MSG_SOPHOS_SIGNED_IN = "You have successfully logged in"
+MSG_BAD_CREDENTIALS = "Login failed. Invalid user name/password. Please contact the administrator."
+MSG_LOGIN_LIMIT = "You have reached Maximum Login Limit."
+MSG_SIGNED_OUT = "You've signed out"
+
+# FortiGate: the probe gets a script sending the browser to /fgtauth?<magic>,
+# whose form posts the magic and credentials to /. A login is answered with
+# a script to /keepalive?<id>; /logout?<id> ends the session.
+FGT_REDIRECT_PAGE = ("<html><body><script language=\"JavaScript\">"
+                     "window.location=\"{url}\";</script></body></html>")
+FGT_AUTH_PAGE = ("<html><head><title>Firewall Authentication</title></head><body>"
+                 "<form action='/' method='post'>"
+                 "<input type='hidden' name='4Tredir' value='{redirect}'>"
+                 "<input type='hidden' name='magic' value='{magic}'>"
+                 "<input name='username'><input name='password' type='password'>"
+                 "</form><p>{message}</p></body></html>")
+FGT_KEEPALIVE_PAGE = ("<html><head><title>Firewall Authentication Keepalive Window</title>"
+                      "</head><body>This browser window keeps your session alive. "
+                      "<a href='{logout_url}'>Logout</a></body></html>")
+FGT_LOGOUT_PAGE = "<html><body>You have successfully logged out.</body></html>"
+MSG_FGT_FAILED = "Firewall authentication failed. Please try again."
+MSG_FGT_LIMIT = "Firewall authentication failed: concurrent login limit exceeded."
+
+# pfSense: the probe is redirected to index.php of the zone, which posts
+# auth_user/auth_pass back to itself; a login with the logout page enabled
+# is answered with a form holding its logout_id
+PF_ZONE = 'campus'
+PF_LOGIN_PAGE = ("<html><head><title>pfSense captive portal</title></head><body>"
+                 "<form method='post' action='{action}'>"
+                 "<input name='auth_user' type='text'><input name='auth_pass' type='password'>"
+                 "<input name='zone' type='hidden' value='{zone}'>"
+                 "<input name='redirurl' type='hidden' value='{redirurl}'>"
+                 "<input name='accept' type='submit' value='Login'></form>"
+                 "<p>{message}</p></body></html>")
+PF_CONNECTED_PAGE = ("<html><body><p>You are connected.</p><form method='post' action='{action}'>"
+                     "<input name='logout_id' type='hidden' value='{logout_id}'>"
+                     "<input name='zone' type='hidden' value='{zone}'>"
+                     "<input name='logout' type='submit' value='Disconnect'></form></body></html>")
+PF_DISCONNECTED_PAGE = "<html><body>You have been disconnected.</body></html>"
+MSG_PF_INVALID = "Invalid credentials specified."
+
+# Portal products the emulator can play (portal_drivers.py has the clients),
+# and the title of the page each injects in '200' probe mode
+VENDORS = ('cyberoam', 'sophos', 'fortigate', 'pfsense')
+INJECTED_TITLES = {'cyberoam': 'Cyberoam', 'sophos': 'Sophos', 'pfsense': 'pfSense captive portal'}
+
+HTML = {'Content-Type': 'text/html'}
+XML = {'Content-Type': 'text/xml'}
+
+# What the emulator does with a login POST
+REPLY_MODES = ('ok', 'wrong-password', 'login-limit', 'silent', 'overloaded')
+
+# How an unauthenticated client's connectivity probe is answered:
+# '302' redirects to the login page, '200' injects a page that redirects to it
+# (FortiGate's is a bare script)
+PROBE_MODES = ('302', '200')
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for a whole fleet connecting at once (fleet.py)
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (quick probes, cancelled races) are normal
+        pass
+
+
+class PortalEmulator:
+    """Threaded fake portal on 127.0.0.1.
+
+    `latency` delays every portal reply, `firewall_delay` is how long after
+    a successful login the probe keeps reporting captive, and `reply_mode`
+    picks the login.xml answer ('silent' returns an empty 200 so the client
+    has to confirm by probing, 'overloaded' answers 503). `password` or an `accounts` dict
+    (username -> password) restricts which credentials are accepted.
+    Sessions belong to a username and client address: `max_sessions` caps
+    each account's concurrent sessions (a login beyond it gets the
+    login-limit reply, as on Cyberoam) and `session_timeout` ends sessions
+    idle for that many seconds (a `live` call counts as activity).
+    `capacity` is how many logins the portal works on at once; the rest
+    wait their turn, and when more than `queue_limit` are waiting it sheds
+    new ones with a 503 and `Retry-After: retry_after` (by default, the
+    seconds it needs to work through the queue).
+    `vendor` picks the portal product; pfSense has no login limit reply,
+    a login beyond `max_sessions` ends the account's oldest session instead.
+    `counters` tracks requests per endpoint.
+    """
+
+    def __init__(self, port=0, latency=0.0, firewall_delay=0.0, reply_mode='ok',
+                 probe_mode='302', password=None, accounts=None, max_sessions=None,
+                 session_timeout=None, capacity=None, queue_limit=None, retry_after=None,
+                 vendor='cyberoam'):
+        if reply_mode not in REPLY_MODES:
+            raise ValueError(f"reply_mode must be one of {REPLY_MODES}")
+        if probe_mode not in PROBE_MODES:
+            raise ValueError(f"probe_mode must be one of {PROBE_MODES}")
+        if vendor not in VENDORS:
+            raise ValueError(f"vendor must be one of {VENDORS}")
+        if vendor == 'pfsense' and reply_mode == 'login-limit':
+            raise ValueError("pfSense has no login limit reply")
+        self.vendor = vendor
+        self.latency = latency
+        self.firewall_delay = firewall_delay
+        self.reply_mode = reply_mode
+        self.probe_mode = probe_mode
+        self.password = password
+        self.accounts = accounts
+        self.max_sessions = max_sessions
+        self.session_timeout = session_timeout
+        self.queue_limit = queue_limit
+        self.retry_after = retry_after
+        self.capacity = capacity
+        self._slots = threading.Semaphore(capacity) if capacity else None
+        self._lock = threading.Lock()
+        self._server = _QuietServer(('127.0.0.1', port), self._handler())
+        self._thread = None
+        self.reset()
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def portal_url(self):
+        if self.vendor == 'fortigate':
+            return self.base_url + '/fgtauth'
+        if self.vendor == 'pfsense':
+            return self.base_url + f"/index.php?zone={PF_ZONE}"
+        return self.base_url + '/httpclient.html'
+
+    @property
+    def probe_url(self):
+        return self.base_url + '/generate_204'
+
+    @property
+    def login_path(self):
+        return {'fortigate': '/', 'pfsense': '/index.php'}.get(self.vendor, '/login.xml')
+
+    def captive_url(self):
+        """Where an unauthenticated probe is sent (FortiGate: with a new magic)"""
+        if self.vendor == 'fortigate':
+            magic = secrets.token_hex(8)
+            with self._lock:
+                self.magics.add(magic)
+            return f"{self.portal_url}?{magic}"
+        if self.vendor == 'pfsense':
+            return f"{self.portal_url}&redirurl={quote(self.probe_url, safe='')}"
+        return self.portal_url
+
+    def reset(self):
+        """Forget all sessions and counters"""
+        with self._lock:
+            self.online_at = None
+            self.sessions = {}
+            self.tokens = {}        # FortiGate keepalive / pfSense logout id -> session
+            self.magics = set()
+            self.counters = {}
+            self.in_flight = 0
+            self.peak_in_flight = 0
+            self.waiting = 0
+            self.peak_waiting = 0
+
+    def is_online(self, client=None):
+        """True once the firewall is open (for `client`, if it has a session of its own)"""
+        with self._lock:
+            if self.online_at is None or time.monotonic() < self.online_at:
+                return False
+            return client is None or not self.sessions or any(
+                key[1] == client for key in self.sessions)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def _admit(self):
+        """Wait for a free login slot; False if the queue is full (shed the login)"""
+        if self._slots is None:
+            return True
+        with self._lock:
+            if self.queue_limit is not None and self.waiting >= self.queue_limit:
+                return False
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+        return True
+
+    def _retry_after(self):
+        if self.retry_after is not None:
+            return self.retry_after
+        with self._lock:
+            return max(1, math.ceil(self.waiting * self.latency / self.capacity))
+
+    def _expire(self):
+        """Drop idle sessions; call with the lock held"""
+        if self.session_timeout is None:
+            return
+        now = time.monotonic()
+        for key, last_seen in list(self.sessions.items()):
+            if now - last_seen > self.session_timeout:
+                del self.sessions[key]
+        if not self.sessions:
+            self.online_at = None
+
+    def _authorize(self, username, password, client):
+        """Decide a login and open its session: 'ok', 'silent', 'wrong-password'
+        or 'login-limit'"""
+        mode = self.reply_mode
+        if self.password is not None and password != self.password:
+            mode = 'wrong-password'
+        if self.accounts is not None and self.accounts.get(username) != password:
+            mode = 'wrong-password'
+        if mode == 'wrong-password':
+            return mode
+        with self._lock:
+            self._expire()
+            others = sorted((last_seen, key) for key, last_seen in self.sessions.items()
+                            if key[0] == username and key[1] != client)
+            if self.max_sessions is not None and len(others) >= self.max_sessions:
+                if self.vendor == 'pfsense':
+                    # The newest login wins
+                    for _, key in others[:len(others) - self.max_sessions + 1]:
+                        del self.sessions[key]
+                else:
+                    mode = 'login-limit'
+        if mode == 'login-limit':
+            self._count('login_limit')
+            return mode
+        with self._lock:
+            self.sessions[(username, client)] = time.monotonic()
+            if self.online_at is None:
+                self.online_at = time.monotonic() + self.firewall_delay
+        return mode
+
+    def _login(self, form, client='127.0.0.1'):
+        username = form.get('username', [''])[0]
+        if form.get('mode', [''])[0] == '193':
+            return self._logout(username, client)
+        mode = self._authorize(username, form.get('password', [''])[0], client)
+        if mode == 'wrong-password':
+            return LOGIN_REPLY.format(status='LOGIN', message=MSG_BAD_CREDENTIALS)
+        if mode == 'login-limit':
+            return LOGIN_REPLY.format(status='LOGIN', message=MSG_LOGIN_LIMIT)
+        if mode == 'silent':
+            return ''
+        message = MSG_SOPHOS_SIGNED_IN if self.vendor == 'sophos' else MSG_SIGNED_IN
+        return LOGIN_REPLY.format(status='LIVE', message=message.format(username=username))
+
+    def _end_session(self, key):
+        with self._lock:
+            self.sessions.pop(key, None)
+            if not self.sessions:
+                self.online_at = None
+
+    def _logout(self, username, client):
+        self._count('logout')
+        self._end_session((username, client))
+        return LOGIN_REPLY.format(status='LOGOUT', message=MSG_SIGNED_OUT)
+
+    def _new_token(self, key):
+        token = secrets.token_hex(8)
+        with self._lock:
+            self.tokens[token] = key
+        return token
+
+    def _session_for(self, token):
+        """The live session a keepalive/logout token belongs to (refreshed), or None"""
+        with self._lock:
+            self._expire()
+            key = self.tokens.get(token)
+            if key not in self.sessions:
+                return None
+            self.sessions[key] = time.monotonic()
+            return key
+
+    def _fgt_auth_page(self, message=''):
+        return FGT_AUTH_PAGE.format(redirect=self.probe_url,
+                                    magic=self.captive_url().split('?', 1)[1], message=message)
+
+    def _fgt_login(self, form, client='127.0.0.1'):
+        with self._lock:
+            magic = form.get('magic', [''])[0]
+            known = magic in self.magics
+            self.magics.discard(magic)
+        if not known:
+            # A stale magic gets the login page again
+            return self._fgt_auth_page(MSG_FGT_FAILED)
+        username = form.get('username', [''])[0]
+        mode = self._authorize(username, form.get('password', [''])[0], client)
+        if mode == 'wrong-password':
+            return self._fgt_auth_page(MSG_FGT_FAILED)
+        if mode == 'login-limit':
+            return self._fgt_auth_page(MSG_FGT_LIMIT)
+        if mode == 'silent':
+            return ''
+        token = self._new_token((username, client))
+        return FGT_REDIRECT_PAGE.format(url=f"{self.base_url}/keepalive?{token}")
+
+    def _pf_login_page(self, message=''):
+        return PF_LOGIN_PAGE.format(action=self.portal_url, zone=PF_ZONE,
+                                    redirurl=self.probe_url, message=message)
+
+    def _pf_post(self, form, client='127.0.0.1'):
+        logout_id = form.get('logout_id', [''])[0]
+        if logout_id:
+            self._count('logout')
+            key = self._session_for(logout_id)
+            if key is not None:
+                self._end_session(key)
+            return PF_DISCONNECTED_PAGE
+        username = form.get('auth_user', [''])[0]
+        mode = self._authorize(username, form.get('auth_pass', [''])[0], client)
+        if mode == 'wrong-password':
+            return self._pf_login_page(MSG_PF_INVALID)
+        if mode == 'silent':
+            return ''
+        return PF_CONNECTED_PAGE.format(action=self.portal_url, zone=PF_ZONE,
+                                        logout_id=self._new_token((username, client)))
+
+    def _captive_reply(self):
+        """(status, body, headers) for the probe of a client without a session"""
+        url = self.captive_url()
+        if self.probe_mode == '302':
+            return 302, '', {'Location': url}
+        if self.vendor == 'fortigate':
+            return 200, FGT_REDIRECT_PAGE.format(url=url), HTML
+        return 200, INJECTED_PAGE.format(title=INJECTED_TITLES[self.vendor], portal_url=url), HTML
+
+    def _get(self, path, query, client='127.0.0.1'):
+        """(status, body, headers) for a GET of a portal page"""
+        if self.vendor == 'fortigate':
+            if path == '/fgtauth':
+                return 200, self._fgt_auth_page(), HTML
+            if path in ('/keepalive', '/logout'):
+                key = self._session_for(query)
+                if key is None:
+                    # No such session: back to the login
+                    return 303, '', {'Location': self.captive_url()}
+                if path == '/logout':
+                    self._end_session(key)
+                    return 200, FGT_LOGOUT_PAGE, HTML
+                return 200, FGT_KEEPALIVE_PAGE.format(
+                    logout_url=f"{self.base_url}/logout?{query}"), HTML
+        elif self.vendor == 'pfsense':
+            if path == '/index.php':
+                return 200, self._pf_login_page(), HTML
+        elif path == '/live':
+            return 200, self._live(parse_qs(query), client), XML
+        elif path == '/httpclient.html':
+            return 200, LOGIN_PAGE, HTML
+        return 404, '', None
+
+    def _post_login(self, form, client='127.0.0.1'):
+        """(status, body, headers) for a POST to the login path"""
+        if self.vendor == 'fortigate':
+            return 200, self._fgt_login(form, client), HTML
+        if self.vendor == 'pfsense':
+            return 200, self._pf_post(form, client), HTML
+        return 200, self._login(form, client), XML
+
+    def _live(self, query, client='127.0.0.1'):
+        username = query.get('username', [''])[0]
+        with self._lock:
+            self._expire()
+            alive = (username, client) in self.sessions
+            if alive:
+                self.sessions[(username, client)] = time.monotonic()
+        return LIVE_REPLY.format(ack='ack' if alive else 'login_again')
+
+    def _handler(self):
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def _reply(self, status, body='', headers=None):
+                data = body.encode()
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if data:
+                    self.wfile.write(data)
+
+            def _enter(self, name):
+                emulator._count(name)
+                with emulator._lock:
+                    emulator.in_flight += 1
+                    emulator.peak_in_flight = max(emulator.peak_in_flight, emulator.in_flight)
+
+            def _leave(self):
+                with emulator._lock:
+                    emulator.in_flight -= 1
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if parts.path == '/generate_204':
+                    emulator._count('probe')
+                    if emulator.is_online(self.client_address[0]):
+                        self._reply(204)
+                    else:
+                        self._reply(*emulator._captive_reply())
+                    return
+                self._enter(parts.path.strip('/') or 'index')
+                try:
+                    time.sleep(emulator.latency)
+                    self._reply(*emulator._get(parts.path, parts.query, self.client_address[0]))
+                finally:
+                    self._leave()
+
+            def do_POST(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                form = parse_qs(self.rfile.read(length).decode())
+                login = parts.path == emulator.login_path
+                self._enter(parts.path.strip('/') or 'index')
+                if login and not emulator._admit():
+                    emulator._count('shed')
+                    self._reply(503, 'Service Unavailable',
+                                {'Retry-After': str(emulator._retry_after())})
+                    self._leave()
+                    return
+                try:
+                    time.sleep(emulator.latency)
+                    if login and emulator.reply_mode == 'overloaded':
+                        self._reply(503, 'Service Unavailable')
+                    elif login:
+                        self._reply(*emulator._post_login(form, self.client_address[0]))
+                    else:
+                        self._reply(404)
+                finally:
+                    if login and emulator._slots is not None:
+                        emulator._slots.release()
+                    self._leave()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Cyberoam captive portal emulator")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--vendor', choices=VENDORS, default='cyberoam',
+                        help="portal product to play")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every portal reply")
+    parser.add_argument('--firewall-delay', type=float, default=0.0,
+                        help="seconds after login before the probe returns 204")
+    parser.add_argument('--reply-mode', choices=REPLY_MODES, default='ok')
+    parser.add_argument('--probe-mode', choices=PROBE_MODES, default='302')
+    parser.add_argument('--password', help="only accept this password")
+    parser.add_argument('--accounts', help="JSON file of {username: password} to accept")
+    parser.add_argument('--max-sessions', type=int,
+                        help="concurrent sessions allowed per account (default unlimited)")
+    parser.add_argument('--session-timeout', type=float,
+                        help="seconds of inactivity after which a session ends")
+    parser.add_argument('--capacity', type=int,
+                        help="logins handled at once; the rest queue (default unlimited)")
+    parser.add_argument('--queue-limit', type=int,
+                        help="queued logins beyond which new ones get 503 + Retry-After")
+    parser.add_argument('--retry-after', type=int,
+                        help="Retry-After seconds sent with a shed login "
+                             "(default: the time to drain the queue)")
+    args = parser.parse_args()
+
+    accounts = None
+    if args.accounts:
+        import json
+        with open(args.accounts) as f:
+            accounts = json.load(f)
+    emulator = PortalEmulator(args.port, args.latency, args.firewall_delay,
+                              args.reply_mode, args.probe_mode, args.password, accounts,
+                              args.max_sessions, args.session_timeout, args.capacity,
+                              args.queue_limit, args.retry_after, args.vendor)
+    print(f"Portal emulator on {emulator.portal_url}")
+    print(f"Connectivity probe at {emulator.probe_url}")
+    emulator.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import json
+import os
+import re
+
+import main as core
+
+# Optional network/portal map; without it the built-in JIIT profile is used
+# for SSIDs that contain one of main.WIFI_KEYWORDS as a separate word.
+#
+# {
+#   "profiles": {
+#     "jiit": {"portal_url": "http://172.16.68.6:8090/httpclient.html",
+#              "fallback_urls": ["http://172.16.68.7:8090/httpclient.html"],
+#              "form": {"mode": "191", "producttype": "0"},
+#              "probe_urls": ["http://www.gstatic.com/generate_204"],
+#              "discover": true, "driver": "cyberoam"}
+#   },
+#   "networks": [
+#     {"ssid": "JIIT-LRC", "profile": "jiit"},
+#     {"bssid_prefix": "00:1a:2b", "profile": "jiit"},
+#     {"pattern": "^AP[-_ ]?\\d+$", "profile": "jiit"}
+#   ]
+# }
+PROFILES_FILE = os.path.join(os.path.expanduser('~'), '.wifi_auto_login_profiles.json')
+
+DEFAULT_PROFILE = 'jiit'
+
+
+class PortalProfile:
+    """How to authenticate on one kind of network.
+
+    `portal_url` and `probe_urls` of None mean "use main.PORTAL_URL /
+    main.PROBE_URL", which keeps the built-in profile in step with the
+    settings at the top of main.py. `fallback_urls` are other gateways
+    serving the same portal (main.PORTAL_FALLBACK_URLS for the built-in
+    profile); failover.py picks between them by measured health.
+    With `discover`, the portal that the network's captive probe last
+    redirected to (cached per profile in the state file) comes before all
+    of them.
+    `driver` names the portal's dialect in portal_drivers.py; without it
+    the one fingerprinted from the captive probe is used, else Cyberoam.
+    `form` replaces the driver's extra login fields.
+    """
+
+    def __init__(self, name, portal_url=None, form=None, probe_urls=None, fallback_urls=None,
+                 discover=True, driver=None):
+        self.name = name
+        self.portal_url = portal_url
+        self.form = None if form is None else dict(form)
+        self.probe_urls = probe_urls
+        self.fallback_urls = fallback_urls
+        self.discover = discover
+        if driver is not None:
+            from portal_drivers import get_driver
+            get_driver(driver)
+        self.driver = driver
+
+    def get_discovered_url(self):
+        """Portal URL found by the last captive probe on this profile's networks, or None"""
+        if not self.discover:
+            return None
+        from state_cache import get_state
+        return get_state().discovered_portal(self.name)
+
+    def set_discovered_url(self, url, driver=None):
+        """Remember what a captive probe found: the portal URL and/or the
+        name of the driver its reply was fingerprinted as"""
+        if self.discover:
+            from state_cache import get_state
+            get_state().set_discovered_portal(self.name, url, driver)
+
+    def get_driver(self):
+        from portal_drivers import get_driver
+        if self.driver is None and self.discover:
+            from state_cache import get_state
+            return get_driver(get_state().discovered_driver(self.name))
+        return get_driver(self.driver)
+
+    def get_session(self):
+        """What the portal handed out at our last login on this profile
+        (e.g. FortiGate's keepalive URL), for keepalive and logout"""
+        from state_cache import get_state
+        return get_state().portal_session(self.name) or {}
+
+    def set_session(self, session):
+        from state_cache import get_state
+        get_state().set_portal_session(self.name, session)
+
+    def get_portal_url(self):
+        return self.get_discovered_url() or self.portal_url or core.PORTAL_URL
+
+    def get_portal_urls(self):
+        """Discovered portal first, then the configured one and its fallback gateways"""
+        fallbacks = self.fallback_urls
+        if fallbacks is None:
+            fallbacks = [] if self.portal_url else core.PORTAL_FALLBACK_URLS
+        urls = []
+        for url in [self.get_portal_url(), self.portal_url or core.PORTAL_URL] + fallbacks:
+            if url not in urls:
+                urls.append(url)
+        return urls
+
+    def get_login_url(self):
+        return self.get_driver().login_url(self.get_portal_url())
+
+    def get_login_urls(self):
+        driver = self.get_driver()
+        urls = []
+        for url in self.get_portal_urls():
+            url = driver.login_url(url)
+            if url not in urls:
+                urls.append(url)
+        return urls
+
+    def get_preferred_login_url(self):
+        """The discovered portal's login URL, which is tried before any gateway
+        with a better health record, or None"""
+        return self.get_login_url() if self.get_discovered_url() else None
+
+    def get_probe_urls(self):
+        return self.probe_urls or [core.PROBE_URL]
+
+    def __repr__(self):
+        return f"PortalProfile({self.name!r})"
+
+
+def _keyword_pattern(keyword):
+    # A keyword must stand on its own ("JIIT-AP-3", "AP_12"), so "AP" no
+    # longer matches "LAPTOP" or "Apartment"
+    return rf"(?<![a-z]){re.escape(keyword)}(?![a-z])"
+
+
+def normalize_bssid(bssid):
+    return bssid.strip().lower().replace('-', ':')
+
+
+class ProfileIndex:
+    """SSID/BSSID -> PortalProfile lookup.
+
+    Exact SSIDs are a dict lookup, BSSID prefixes are checked per distinct
+    prefix length, and all patterns are folded into one compiled regex
+    (case-insensitive). Results are memoized per (ssid, bssid).
+    """
+
+    def __init__(self, profiles, networks):
+        self.profiles = profiles
+        self.exact = {}
+        self.bssid_prefixes = {}
+        self.rules = 0
+        patterns = []
+        for rule in networks:
+            try:
+                profile = profiles[rule.get('profile', DEFAULT_PROFILE)]
+                if 'ssid' in rule:
+                    self.exact[rule['ssid']] = profile
+                elif 'bssid_prefix' in rule:
+                    prefix = normalize_bssid(rule['bssid_prefix'])
+                    self.bssid_prefixes.setdefault(len(prefix), {})[prefix] = profile
+                elif 'pattern' in rule:
+                    re.compile(rule['pattern'])
+                    patterns.append((rule['pattern'], profile))
+                else:
+                    raise ValueError("no ssid, bssid_prefix or pattern")
+            except KeyError as e:
+                print(f"✗ Skipping network rule {rule!r}: unknown profile {e}")
+                continue
+            except (re.error, ValueError, TypeError, AttributeError) as e:
+                print(f"✗ Skipping network rule {rule!r}: {e}")
+                continue
+            self.rules += 1
+        self._matcher = self._compile(patterns)
+        self._cache = {}
+
+    def _compile(self, patterns):
+        """One regex over all patterns, each in its own named group"""
+        def build(patterns):
+            self._pattern_profiles = {f"p{i}": profile for i, (_, profile) in enumerate(patterns)}
+            if not patterns:
+                return None
+            return re.compile(
+                '|'.join(f"(?P<p{i}>{pattern})" for i, (pattern, _) in enumerate(patterns)),
+                re.IGNORECASE)
+
+        try:
+            return build(patterns)
+        except re.error:
+            pass
+        # Patterns that compile alone can still clash when combined (e.g. the
+        # same group name twice): keep each one that fits with the rest
+        kept = []
+        for pattern, profile in patterns:
+            try:
+                build(kept + [(pattern, profile)])
+            except re.error as e:
+                print(f"✗ Skipping network pattern {pattern!r}: {e}")
+                self.rules -= 1
+                continue
+            kept.append((pattern, profile))
+        return build(kept)
+
+    def classify(self, ssid, bssid=None):
+        """Return the PortalProfile for a network, or None if it is not ours"""
+        key = (ssid, bssid)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        profile = self._classify(ssid, bssid)
+        self._cache[key] = profile
+        return profile
+
+    def _classify(self, ssid, bssid):
+        if not ssid:
+            return None
+        profile = self.exact.get(ssid)
+        if profile is not None:
+            return profile
+        if bssid:
+            bssid = normalize_bssid(bssid)
+            for length, prefixes in self.bssid_prefixes.items():
+                profile = prefixes.get(bssid[:length])
+                if profile is not None:
+                    return profile
+        if self._matcher is not None:
+            match = self._matcher.search(ssid)
+            if match:
+                return self._pattern_profiles[match.lastgroup]
+        return None
+
+
+def load_profile_index(path=PROFILES_FILE):
+    """Build the index from PROFILES_FILE, falling back to WIFI_KEYWORDS"""
+    config = {}
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                config = json.load(f)
+        except Exception as e:
+            print(f"Error reading {path}: {e}")
+        if not isinstance(config, dict):
+            print(f"Error reading {path}: not a JSON object")
+            config = {}
+
+    # A bad entry is reported and skipped; the rest of the file still applies
+    profiles = {DEFAULT_PROFILE: PortalProfile(DEFAULT_PROFILE)}
+    entries = config.get('profiles') or {}
+    if not isinstance(entries, dict):
+        print(f"✗ \"profiles\" in {path} is not an object, ignoring it")
+        entries = {}
+    for name, options in entries.items():
+        try:
+            profiles[name] = PortalProfile(name, options.get('portal_url'), options.get('form'),
+                                           options.get('probe_urls'), options.get('fallback_urls'),
+                                           options.get('discover', True), options.get('driver'))
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"✗ Skipping profile {name!r}: {e}")
+
+    keywords = [{'pattern': _keyword_pattern(k), 'profile': DEFAULT_PROFILE}
+                for k in core.WIFI_KEYWORDS]
+    networks = config.get('networks')
+    if networks is None:
+        return ProfileIndex(profiles, keywords)
+    if not isinstance(networks, list):
+        print(f"✗ \"networks\" in {path} is not a list, using WIFI_KEYWORDS")
+        return ProfileIndex(profiles, keywords)
+    index = ProfileIndex(profiles, networks)
+    if networks and not index.rules:
+        # Nothing usable in the file: recognise the college SSIDs as before
+        print(f"✗ No usable network rules in {path}, using WIFI_KEYWORDS")
+        index = ProfileIndex(profiles, keywords)
+    return index
+
+
+_index = None
+
+
+def get_profile_index():
+    global _index
+    if _index is None:
+        _index = load_profile_index()
+    return _index
+
+
+def reload_profiles():
+    global _index
+    _index = None
+    return get_profile_index()
+
+
+def classify(ssid, bssid=None):
+    return get_profile_index().classify(ssid, bssid)
+
+
+def get_default_profile():
+    return get_profile_index().profiles[DEFAULT_PROFILE]
@@ -0,0 +1,740 @@
+"""Record real link, probe and portal traffic and replay it under a virtual clock.
+
+Recording: `main.py --record` (add it to the scheduled task's arguments, or
+run monitor mode with it) appends every WiFi link lookup, quick probe and
+HTTP exchange with a wall-clock timestamp to RECORDING_FILE. Runs append
+to the same file, so a week of triggered runs makes one recording.
+
+Replay: the recording becomes a model of the campus network (which link
+was up when, when the portal dropped sessions, what it answered to logins
+and how slow it was). The real login code then runs against that model
+under a VirtualClock, so sleeps, retries, backoff and poll schedules cost
+no real time, and a week replays in seconds:
+
+    python replay.py ~/.wifi_auto_login_recording.jsonl
+    python replay.py --synthesize 7 --drivers main monitor events
+    python replay.py --synthesize 7 --save week.jsonl
+
+The report counts the decisions the client made (logins, probes, netsh
+runs, retries by failure kind) and the simulated time-to-online of every
+episode where a college link needed a session, so scheduling and retry
+changes can be compared on the same traffic.
+"""
+import argparse
+import bisect
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import failover
+import http_pool
+import interfaces
+import keepalive
+import link_monitor
+import main as core
+import retry_policy
+import state_cache
+import tracing
+from http_pool import ConnectionPool, Response
+from link_monitor import LINK_RESYNC_INTERVAL, LinkBackend, PollingBackend
+from profiles import classify
+
+RECORDING_FILE = os.path.join(os.path.expanduser('~'), '.wifi_auto_login_recording.jsonl')
+
+# Portal reply bodies are kept up to this many characters
+MAX_BODY = 4096
+
+# Latencies assumed when the recording has no sample for that kind of request
+DEFAULT_LATENCY = {'wifi': 0.05, 'probe': 0.02, 'login': 0.05, 'logout': 0.05, 'live': 0.02}
+
+# One-shot replay: the scheduled task starts main() this long after an
+# association event (see installer.py), and ignores events while it runs
+TRIGGER_DELAY = 5
+
+# The replay runs on this long past the last recorded entry, so the client
+# can finish reacting to it
+REPLAY_TAIL = 120
+
+# Modules whose `time` is swapped for the virtual clock during a replay
+CLOCKED_MODULES = [core, failover, interfaces, keepalive, link_monitor, retry_policy, state_cache,
+                   tracing]
+
+
+# Recording
+
+def _write(path, record):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def start_recording(module=core, path=None):
+    """Wrap link lookups (netsh and the triggering event's), quick probes and
+    HTTP requests to append to `path`.
+
+    `module` is the running main module: main.py passes itself, since as a
+    script it is `__main__` rather than `main`. The importable `main`, which
+    the daemon and the other modules call into, is wrapped as well.
+    """
+    path = path or RECORDING_FILE
+    request = ConnectionPool.request
+
+    def wrap(target):
+        get_wifi_link, get_wifi_links = target.get_wifi_link, target.get_wifi_links
+        get_event_link, quick_probe = target.get_event_link, target.quick_probe
+
+        def recorded_get_wifi_link():
+            start = time.time()
+            wifi = get_wifi_link()
+            _write(path, {'t': start, 'kind': 'wifi', 'wifi': wifi,
+                          'elapsed': round(time.time() - start, 4)})
+            return wifi
+
+        def recorded_get_wifi_links():
+            start = time.time()
+            links = get_wifi_links()
+            # The replay models one link, the first adapter's
+            _write(path, {'t': start, 'kind': 'wifi', 'wifi': links[0] if links else None,
+                          'links': links, 'elapsed': round(time.time() - start, 4)})
+            return links
+
+        def recorded_get_event_link():
+            wifi = get_event_link()
+            # None: not started by an event, so netsh gets asked (and recorded)
+            if wifi is not None:
+                _write(path, {'t': time.time(), 'kind': 'wifi', 'wifi': wifi, 'source': 'event'})
+            return wifi
+
+        def recorded_quick_probe(timeout=3):
+            start = time.time()
+            online = quick_probe(timeout)
+            _write(path, {'t': start, 'kind': 'quick_probe', 'online': online,
+                          'elapsed': round(time.time() - start, 4)})
+            return online
+
+        target.get_wifi_link = recorded_get_wifi_link
+        target.get_wifi_links = recorded_get_wifi_links
+        target.get_event_link = recorded_get_event_link
+        target.quick_probe = recorded_quick_probe
+
+    def recorded_request(self, method, url, data=None, headers=None, timeout=5,
+                         source_address=None):
+        # Query strings carry the username and a timestamp; neither is replayed
+        entry = {'t': time.time(), 'kind': 'http', 'method': method, 'url': url.split('?')[0]}
+        if isinstance(data, dict) and 'mode' in data:
+            entry['mode'] = data['mode']
+        try:
+            response = request(self, method, url, data, headers, timeout, source_address)
+        except Exception as e:
+            entry.update(error=type(e).__name__, elapsed=round(time.time() - entry['t'], 4))
+            _write(path, entry)
+            raise
+        entry.update(status=response.status_code, location=response.headers.get('location'),
+                     body=response.text[:MAX_BODY], elapsed=round(response.elapsed, 4))
+        _write(path, entry)
+        return response
+
+    wrap(module)
+    if module is not core:
+        wrap(core)
+    ConnectionPool.request = recorded_request
+    return path
+
+
+def load_recording(path):
+    """Recorded entries in time order"""
+    with open(path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda r: r['t'])
+    return records
+
+
+def request_kind(method, url, mode=None):
+    """'login', 'logout', 'live' or 'probe' for a portal/probe request"""
+    if method == 'POST':
+        return 'logout' if mode == '193' else 'login'
+    if '/live' in url:
+        return 'live'
+    return 'probe'
+
+
+def is_online_reply(record):
+    """What a recorded observation said about connectivity (True/False)"""
+    if record['kind'] == 'quick_probe':
+        return record['online']
+    if 'error' in record:
+        return False
+    if request_kind(record['method'], record['url']) == 'live':
+        return 'ack]]' in record.get('body', '') or '<ack>ack' in record.get('body', '')
+    return record['status'] == 204
+
+
+def login_accepted(record):
+    """True if a recorded (or replayed) login reply created a portal session"""
+    if 'error' in record or record['status'] >= 500 or record['status'] == 429:
+        return False
+    return core.parse_portal_response(record.get('body')) is not False
+
+
+# Replay
+
+class ReplayFinished(BaseException):
+    """Raised by the clock at the end of the recording; a BaseException so the
+    monitor loop's `except Exception` does not swallow it"""
+
+
+class VirtualClock:
+    """Stand-in for the `time` module whose clock only moves when slept on.
+
+    `call_later()` timers (the keepalive thread, in a replay) fire while
+    the main flow sleeps; sleeps inside a timer just move the clock on.
+    """
+
+    def __init__(self, start, end=None):
+        self.now = start
+        self.end = end
+        self._timers = []
+        self._in_timer = False
+
+    def time(self):
+        return self.now
+
+    monotonic = perf_counter = time
+
+    def strftime(self, fmt, t=None):
+        return time.strftime(fmt, time.localtime(self.now if t is None else t))
+
+    def localtime(self, t=None):
+        return time.localtime(self.now if t is None else t)
+
+    def call_later(self, delay, callback):
+        bisect.insort(self._timers, (self.now + delay, id(callback), callback))
+
+    def sleep(self, seconds):
+        target = self.now + max(0, seconds)
+        if not self._in_timer:
+            while self._timers and self._timers[0][0] <= target:
+                due, _, callback = self._timers.pop(0)
+                if self.end is not None and due > self.end:
+                    break
+                self.now = max(self.now, due)
+                self._in_timer = True
+                try:
+                    callback()
+                finally:
+                    self._in_timer = False
+        self.now = max(self.now, target)
+        if self.end is not None and self.now > self.end:
+            raise ReplayFinished()
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class ReplayWorld:
+    """The network as the recording saw it, answering the client's requests.
+
+    Links come straight from the recorded lookups. Portal sessions are
+    modelled: a replayed login the portal accepted opens one for the
+    client IP after the recorded firewall delay, and it ends where the
+    recording shows the portal dropping the recorded client's session.
+    Login replies and latencies are the recorded ones nearest in time.
+    """
+
+    def __init__(self, records, clock):
+        self.clock = clock
+        self.links = []          # (t, wifi or None), link changes only
+        self.logins = []         # (t, recorded login reply)
+        self.kills = []          # times the portal dropped the session
+        self.episodes = []       # {'start', 'end', 'ssid', 'online'}
+        self.session = None
+        self.counts = {'wifi': 0, 'probe': 0, 'login': 0, 'logout': 0, 'live': 0}
+        latencies = {kind: [] for kind in DEFAULT_LATENCY}
+        firewall_delays = []
+
+        online, pending_login, link, seen = None, None, None, False
+        for record in records:
+            t = record['t']
+            if record['kind'] == 'wifi':
+                if 'elapsed' in record:
+                    # Links fed in by the triggering event cost no lookup
+                    latencies['wifi'].append(record['elapsed'])
+                wifi = record['wifi']
+                if self._link_id(wifi) != self._link_id(link):
+                    online, pending_login = None, None
+                if wifi != link:
+                    self.links.append((t, wifi))
+                    link = wifi
+                continue
+            if record['kind'] == 'http':
+                kind = request_kind(record['method'], record['url'], record.get('mode'))
+                latencies[kind].append(record.get('elapsed', 0))
+                if kind == 'logout':
+                    continue
+                if kind == 'login':
+                    self.logins.append((t, record))
+                    if login_accepted(record):
+                        pending_login = t
+                    continue
+            else:
+                latencies['probe'].append(record.get('elapsed', 0))
+            if is_online_reply(record):
+                if pending_login is not None:
+                    firewall_delays.append(t - pending_login)
+                    pending_login = None
+                elif not seen and not self.logins:
+                    # Online before any login: a session from before the recording
+                    self.session = {'ip': link and link.get('ip'), 'start': float('-inf'),
+                                    'open_at': float('-inf')}
+                online = True
+            elif pending_login is None:
+                if online:
+                    self.kills.append(t)
+                elif online is None and self.links:
+                    # Captive straight after (re)connecting: the session ended while away
+                    self.kills.append(self.links[-1][0])
+                online = False
+            seen = True
+
+        self.kills.sort()
+        self.latency = {kind: statistics.median(values) if values else DEFAULT_LATENCY[kind]
+                        for kind, values in latencies.items()}
+        self.firewall_delay = statistics.median(firewall_delays) if firewall_delays else 0
+        self._link_times = [t for t, _ in self.links]
+        self._build_episodes()
+
+    @staticmethod
+    def _link_id(wifi):
+        return (wifi['ssid'], wifi.get('ip')) if wifi else None
+
+    def _build_episodes(self):
+        """A college link needs a session from each connect or IP change, and
+        again after each session drop, until it goes away"""
+        starts = []
+        previous = None
+        for t, wifi in self.links:
+            if self._link_id(wifi) != self._link_id(previous):
+                starts.append((t, wifi))
+            previous = wifi
+        ends = [t for t, _ in starts[1:]] + [float('inf')]
+        for (start, wifi), end in zip(starts, ends):
+            if not wifi or classify(wifi['ssid'], wifi.get('bssid')) is None:
+                continue
+            for t in [start] + [k for k in self.kills if start < k < end]:
+                if self.episodes and self.episodes[-1]['end'] > t:
+                    self.episodes[-1]['end'] = t
+                self.episodes.append({'start': t, 'end': end, 'ssid': wifi['ssid'],
+                                      'online': None})
+
+    def wifi_link(self):
+        index = bisect.bisect_right(self._link_times, self.clock.now) - 1
+        wifi = self.links[index][1] if index >= 0 else None
+        return dict(wifi) if wifi else None
+
+    def next_link_change(self):
+        index = bisect.bisect_right(self._link_times, self.clock.now)
+        return self._link_times[index] if index < len(self._link_times) else None
+
+    def online(self, firewall=True):
+        """True if the client's traffic gets through (with `firewall=False`: if
+        the portal has a session for it, which `live` reports before the
+        firewall opens)"""
+        wifi, session, now = self.wifi_link(), self.session, self.clock.now
+        if not wifi or not session or (firewall and now < session['open_at']):
+            return False
+        if session['ip'] is not None and session['ip'] != wifi.get('ip'):
+            return False
+        # Dropped by the portal since it was opened?
+        index = bisect.bisect_right(self.kills, session['start'])
+        return not (index < len(self.kills) and self.kills[index] <= now)
+
+    def _observe(self, online):
+        if not online:
+            return
+        now = self.clock.now
+        for episode in self.episodes:
+            if episode['start'] <= now < episode['end'] and episode['online'] is None:
+                episode['online'] = now
+
+    def _login_reply(self):
+        if not self.logins:
+            return {'status': 200, 'body': ("<requestresponse><status>LIVE</status>"
+                                            "<message>You are signed in</message>"
+                                            "</requestresponse>")}
+        index = bisect.bisect_right([t for t, _ in self.logins], self.clock.now) - 1
+        return self.logins[max(0, index)][1]
+
+    def get_wifi_link(self):
+        self.counts['wifi'] += 1
+        self.clock.sleep(self.latency['wifi'])
+        return self.wifi_link()
+
+    def get_wifi_links(self):
+        wifi = self.get_wifi_link()
+        return [wifi] if wifi else []
+
+    def quick_probe(self, timeout=3):
+        self.counts['probe'] += 1
+        self.clock.sleep(min(timeout, self.latency['probe']))
+        online = self.online()
+        self._observe(online)
+        return online
+
+    def local_ip(self, host, port=80):
+        wifi = self.wifi_link()
+        return wifi.get('ip') if wifi else None
+
+    def request(self, method, url, timeout, data=None, source_address=None):
+        kind = request_kind(method, url, isinstance(data, dict) and data.get('mode'))
+        self.counts[kind] += 1
+        wifi = self.wifi_link()
+        if wifi is None:
+            raise ConnectionError("network is unreachable")
+        if source_address and source_address[0] != wifi.get('ip'):
+            raise OSError("cannot assign requested address")
+        reply = self._login_reply() if kind == 'login' else {}
+        latency = reply.get('elapsed', self.latency[kind])
+        if latency > timeout:
+            self.clock.sleep(timeout)
+            raise TimeoutError("timed out")
+        self.clock.sleep(latency)
+        if kind == 'login':
+            if 'error' in reply:
+                raise TimeoutError("timed out") if 'Timeout' in reply['error'] \
+                    else ConnectionError(reply['error'])
+            if login_accepted(reply):
+                now = self.clock.now
+                self.session = {'ip': self.wifi_link().get('ip'), 'start': now,
+                                'open_at': now + self.firewall_delay}
+            self._observe(core.parse_portal_response(reply.get('body')) is True)
+            status, body, headers = reply['status'], reply.get('body', ''), {}
+        elif kind == 'logout':
+            if self.session and self.session['ip'] in (None, wifi.get('ip')):
+                self.session = None
+            status, headers = 200, {}
+            body = "<requestresponse><status>LOGOUT</status></requestresponse>"
+        elif kind == 'live':
+            self._observe(self.online())
+            status, headers = 200, {}
+            body = ("<requestresponse><ack><![CDATA[%s]]></ack></requestresponse>"
+                    % ('ack' if self.online(firewall=False) else 'login_again'))
+        else:
+            online = self.online()
+            self._observe(online)
+            if online:
+                status, body, headers = 204, '', {}
+            else:
+                status, body = 302, ''
+                headers = {'location': core.PORTAL_URL}
+        return Response(status, headers, body.encode(), True, latency, url)
+
+
+class ReplayPool:
+    """ConnectionPool look-alike that asks the ReplayWorld instead of the network"""
+
+    def __init__(self, world):
+        self.world = world
+        self.stats = {'requests': 0, 'reused': 0, 'new': 0, 'retried': 0}
+
+    def request(self, method, url, data=None, headers=None, timeout=5, source_address=None):
+        self.stats['requests'] += 1
+        return self.world.request(method, url, timeout, data, source_address)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def prewarm(self, url, timeout=3, source_address=None):
+        pass
+
+    def close(self, source_ip=None):
+        pass
+
+
+class ReplayLinkBackend(LinkBackend):
+    """Event backend that wakes exactly at the recorded link changes"""
+
+    name = 'replay-events'
+
+    def __init__(self, world):
+        super().__init__()
+        self.world = world
+
+    def current(self):
+        wifi = self.world.wifi_link()
+        return wifi['ssid'] if wifi else None
+
+    def wait(self, timeout=LINK_RESYNC_INTERVAL):
+        now = self.world.clock.now
+        change = self.world.next_link_change()
+        delay = timeout if change is None else min(timeout, change - now)
+        self.world.clock.sleep(delay)
+        self._count('wakeups')
+        return change is not None and change - now <= timeout
+
+
+def drive_main(world, credentials):
+    """One main() run per association event, as the scheduled task does"""
+    clock = world.clock
+    for t, wifi in world.links:
+        if not wifi or t + TRIGGER_DELAY < clock.now:
+            continue  # no event, or the task was still running (IgnoreNew)
+        clock.sleep(t + TRIGGER_DELAY - clock.now)
+        # The task passes the event's SSID and adapter description on the command line
+        argv = ['main.py', '--ssid', wifi['ssid'], '--adapter', wifi.get('description') or '']
+        with patched(sys, argv=argv):
+            try:
+                core.main()
+            except SystemExit:
+                pass
+    clock.sleep(clock.end - clock.now)
+
+
+def drive_monitor(world, credentials):
+    """Monitor mode polling netsh on its adaptive schedule"""
+    core.monitor_wifi_changes(credentials['username'], credentials['password'],
+                              PollingBackend())
+
+
+def drive_events(world, credentials):
+    """Monitor mode with an event backend (WLAN notifications / nmcli)"""
+    core.monitor_wifi_changes(credentials['username'], credentials['password'],
+                              ReplayLinkBackend(world))
+
+
+DRIVERS = {
+    'main': drive_main,
+    'monitor': drive_monitor,
+    'events': drive_events,
+}
+
+
+@contextlib.contextmanager
+def patched(obj, **attrs):
+    """Temporarily replace attributes on a module or object"""
+    saved = {name: getattr(obj, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(obj, name, value)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def replay(records, driver, seed=0):
+    """Run `driver` over the recording; returns the report dict"""
+    start, end = records[0]['t'], records[-1]['t'] + REPLAY_TAIL
+    clock = VirtualClock(start, end)
+    world = ReplayWorld(records, clock)
+    credentials = {'username': 'replay', 'password': 'replay'}
+    scratch = tempfile.mkdtemp(prefix='jiit-replay-')
+    state_file = os.path.join(scratch, 'state')
+
+    def start_keepalive(self):
+        # The keepalive thread becomes a timer on the virtual clock
+        self._stop.clear()
+
+        def tick():
+            if self._stop.is_set():
+                return
+            try:
+                delay = self.tick()
+            except Exception as e:
+                print(f"Error in keepalive: {e}")
+                delay = self.keepalive_interval()
+            clock.call_later(delay, tick)
+
+        clock.call_later(self.keepalive_interval(), tick)
+
+    random.seed(seed)
+    before = tracing.metrics.snapshot()['counters']
+    wall = time.monotonic()
+    with contextlib.ExitStack() as stack:
+        for module in CLOCKED_MODULES:
+            stack.enter_context(patched(module, time=clock))
+        stack.enter_context(patched(core, get_wifi_link=world.get_wifi_link,
+                                    get_wifi_links=world.get_wifi_links,
+                                    quick_probe=world.quick_probe,
+                                    PROBE_TARGETS=[], _probe_cache={},
+                                    load_credentials=lambda: credentials,
+                                    MONITOR_MODE=False, ASYNC_ENGINE=False,
+                                    TRACE_ENABLED=False, METRICS_PORT=None))
+        stack.enter_context(patched(http_pool, _pool=ReplayPool(world)))
+        stack.enter_context(patched(state_cache, local_ip=world.local_ip,
+                                    _state=state_cache.StateCache(state_file)))
+        stack.enter_context(patched(keepalive, SESSION_HISTORY_FILE=os.path.join(
+            scratch, 'sessions.json')))
+        stack.enter_context(patched(keepalive.SessionKeepalive, start=start_keepalive))
+        # Adapters are brought up one after the other: the clock is not thread-safe
+        stack.enter_context(patched(interfaces.InterfaceSession,
+                                    _spawn=lambda self, target, *args: target(*args)))
+        stack.enter_context(patched(link_monitor, _power={'checked': None, 'battery': False}))
+        stack.enter_context(patched(tracing, FLIGHT_DUMP_FILE=os.path.join(scratch, 'flight')))
+        stack.enter_context(contextlib.redirect_stdout(open(os.devnull, 'w')))
+        try:
+            DRIVERS[driver](world, credentials)
+        except ReplayFinished:
+            pass
+    wall = time.monotonic() - wall
+
+    after = tracing.metrics.snapshot()['counters']
+    decisions = {name: after[name] - before.get(name, 0) for name in sorted(after)
+                 if after[name] != before.get(name, 0) and
+                 name.split('.')[0] in ('failure', 'retry', 'link_change', 'roam', 'logout',
+                                        'portal_failover', 'link')}
+    times = [e['online'] - e['start'] for e in world.episodes if e['online'] is not None]
+    return {
+        'driver': driver,
+        'records': len(records),
+        'virtual_hours': round((end - start) / 3600, 1),
+        'wall_seconds': round(wall, 2),
+        'speedup': round((end - start) / wall) if wall else None,
+        'episodes': len(world.episodes),
+        'online': len(times),
+        'never_online': len(world.episodes) - len(times),
+        'p50': percentile(times, 50),
+        'p95': percentile(times, 95),
+        'max': max(times) if times else None,
+        'logins': world.counts['login'],
+        'probes': world.counts['probe'],
+        'keepalives': world.counts['live'],
+        'logouts': world.counts['logout'],
+        'netsh': world.counts['wifi'],
+        'decisions': decisions,
+    }
+
+
+# Synthetic campus traffic, shaped like a recording of the one-shot client
+
+LOGIN_OK = ("<?xml version='1.0' ?><requestresponse><status><![CDATA[LIVE]]></status>"
+            "<message><![CDATA[You are signed in as replay]]></message></requestresponse>")
+LOGIN_BUSY = "<html><body>Service Unavailable</body></html>"
+
+
+def synthesize(days=7, seed=1, start=None):
+    """A recording of `days` of campus use: daytime sessions on a few APs
+    with roams, sleeps and reconnects, portal sessions that expire after
+    a few hours and an overloaded portal in the morning rush"""
+    rng = random.Random(seed)
+    start = start or time.mktime((2026, 1, 5, 0, 0, 0, 0, 0, -1))
+    records = []
+    probe_url, login_url = core.PROBE_URL, core.PORTAL_URL.rsplit('/', 1)[0] + '/login.xml'
+
+    def wifi(t, ssid, bssid, ip):
+        records.append({'t': t, 'kind': 'wifi', 'elapsed': 0.04, 'wifi': ssid and {
+            'interface': 'Wi-Fi', 'description': 'Wireless Adapter', 'ssid': ssid,
+            'bssid': bssid, 'signal': 80, 'channel': 36, 'state': 'connected', 'ip': ip}})
+
+    def probe(t, online):
+        records.append({'t': t, 'kind': 'http', 'method': 'GET', 'url': probe_url,
+                        'status': 204 if online else 302, 'body': '', 'elapsed': 0.02,
+                        'location': None if online else core.PORTAL_URL})
+
+    def login(t):
+        """The recorded client logs in; returns when it is online"""
+        while 9 <= time.localtime(t).tm_hour < 10 and rng.random() < 0.3:
+            records.append({'t': t, 'kind': 'http', 'method': 'POST', 'url': login_url,
+                            'status': 503, 'body': LOGIN_BUSY, 'elapsed': 0.8})
+            t += 0.8 + rng.uniform(2, 8)
+        records.append({'t': t, 'kind': 'http', 'method': 'POST', 'url': login_url,
+                        'status': 200, 'body': LOGIN_OK, 'elapsed': rng.uniform(0.05, 0.3)})
+        t += rng.uniform(0.5, 2)
+        probe(t, True)
+        return t
+
+    for day in range(days):
+        t = start + day * 86400 + 8 * 3600 + rng.uniform(0, 3600)
+        day_end = start + day * 86400 + 22 * 3600 + rng.uniform(0, 2 * 3600)
+        ip = None
+        while t < day_end:
+            ssid = rng.choice(['JIIT-AP-1', 'JIIT-AP-2', 'LRC', 'ABB-3', 'HOSTEL-H4'])
+            if ip is None or rng.random() < 0.3:
+                ip = f"10.{rng.randint(0, 3)}.{rng.randint(0, 255)}.{rng.randint(2, 254)}"
+            connected_until = min(day_end, t + rng.expovariate(1 / 7200))
+            wifi(t, ssid, f"00:1a:2b:00:00:{rng.randint(0, 255):02x}", ip)
+            probe(t + 0.1, False)
+            online_at = login(t + 0.2)
+            expires = online_at + rng.uniform(3, 5) * 3600
+            roam = t + rng.expovariate(1 / 1200)
+            while roam < connected_until:
+                if roam > expires:
+                    # The portal ended the session; the next check finds it
+                    probe(expires, False)
+                    online_at = login(expires + 1)
+                    expires = online_at + rng.uniform(3, 5) * 3600
+                wifi(roam, ssid, f"00:1a:2b:00:00:{rng.randint(0, 255):02x}", ip)
+                probe(roam + 0.1, True)
+                roam += rng.expovariate(1 / 1200)
+            wifi(connected_until, None, None, None)
+            t = connected_until + rng.expovariate(1 / 900)
+    return records
+
+
+def print_report(report):
+    def seconds(value):
+        return '-' if value is None else f"{value:.1f}s"
+
+    print("=" * 50)
+    print(f"{report['driver']}: {report['virtual_hours']}h of traffic replayed in "
+          f"{report['wall_seconds']}s ({report['speedup']}x)")
+    mark = '✓' if not report['never_online'] else '✗'
+    print(f"{mark} {report['online']}/{report['episodes']} episodes online, "
+          f"time-to-online p50 {seconds(report['p50'])}, p95 {seconds(report['p95'])}, "
+          f"max {seconds(report['max'])}")
+    print(f"Logins: {report['logins']}, logouts: {report['logouts']}, "
+          f"probes: {report['probes']}, keepalives: {report['keepalives']}, "
+          f"netsh runs: {report['netsh']}")
+    if report['decisions']:
+        print("Decisions: " + ', '.join(f"{k}={v}" for k, v in report['decisions'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded link and portal traffic")
+    parser.add_argument('recording', nargs='?', help=f"recording file (default {RECORDING_FILE})")
+    parser.add_argument('--drivers', nargs='+', choices=sorted(DRIVERS), default=['main'])
+    parser.add_argument('--synthesize', type=int, metavar='DAYS',
+                        help="replay generated campus traffic instead of a recording")
+    parser.add_argument('--save', help="write the (generated) recording here and exit")
+    parser.add_argument('--seed', type=int, default=0, help="seed for jitter and generation")
+    parser.add_argument('--json', action='store_true', help="print reports as JSON")
+    args = parser.parse_args()
+
+    if args.synthesize:
+        records = synthesize(args.synthesize, seed=args.seed + 1)
+    else:
+        records = load_recording(args.recording or RECORDING_FILE)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(r) + '\n' for r in records)
+        print(f"✓ {len(records)} records written to {args.save}")
+        return
+    if not records:
+        print("✗ The recording is empty")
+        sys.exit(1)
+
+    reports = [replay(records, driver, args.seed) for driver in args.drivers]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print_report(report)
+
+
+if __name__ == "__main__":
+    main()
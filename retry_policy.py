@@ -0,0 +1,179 @@
+import random
+import re
+import time
+
+from state_cache import get_state
+
+# Why a login attempt did not get us online
+NO_WIFI = 'no-wifi'                  # no association (yet)
+TRANSIENT = 'transient'              # network error, or the login was not confirmed
+OVERLOADED = 'overloaded'            # portal timed out or answered 5xx/429
+LOGIN_LIMIT = 'login-limit'          # account already has its maximum sessions
+BAD_CREDENTIALS = 'bad-credentials'  # portal rejected the username/password
+NOT_CAPTIVE = 'not-captive'          # not a network we log in to
+PORTAL_DOWN = 'portal-down'          # circuit breaker open, see below
+
+# kind -> (base delay, max delay, retries). Delays are exponential with full
+# jitter: retry n waits uniform(0, min(max, base * 2**n)) seconds. Zero
+# retries means give up at once; retrying cannot fix these.
+RETRY_POLICIES = {
+    NO_WIFI: (0.5, 4, 5),
+    TRANSIENT: (0.5, 8, 6),
+    OVERLOADED: (2, 20, 4),
+    LOGIN_LIMIT: (10, 30, 1),        # an old session may just be expiring
+    BAD_CREDENTIALS: (0, 0, 0),
+    NOT_CAPTIVE: (0, 0, 0),
+    PORTAL_DOWN: (0, 0, 0),
+}
+
+# A one-shot run stops retrying after this many seconds in total
+RETRY_BUDGET = 60
+
+# Circuit breaker: after this many consecutive portal failures (in any run,
+# via the state cache) logins are refused for BREAKER_COOLDOWN seconds,
+# then one attempt is let through to test the portal again
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 60
+
+
+# Herd control. After a campus-wide outage every client reconnects within
+# seconds of the others; these keep them from hitting the portal in step.
+# A client that finds itself captive waits uniform(0, START_JITTER) seconds
+# before its first login (kept small: a lone client on a quiet portal should
+# not pay for it), or up to OVERLOAD_START_JITTER if the portal failed or
+# sent Retry-After in the last OVERLOAD_MEMORY seconds
+START_JITTER = 0.1
+OVERLOAD_START_JITTER = 8
+OVERLOAD_MEMORY = 120
+
+# Token bucket for login POSTs per portal, shared by all runs: LOGIN_BURST
+# logins at once, then one per 1/LOGIN_RATE seconds (0 turns it off)
+LOGIN_RATE = 0.2
+LOGIN_BURST = 3
+
+# A 429/503 with Retry-After is waited out (plus up to this fraction more,
+# so the clients it turned away do not all return together) instead of
+# using the backoff schedule; other runs hold off until then as well
+HONOR_RETRY_AFTER = True
+RETRY_AFTER_SPREAD = 0.5
+
+
+class LoginFailure(Exception):
+    """A login attempt that did not get us online, and why.
+
+    `retry_after` is the wait in seconds the portal asked for, if any.
+    """
+
+    def __init__(self, kind, detail='', retry_after=None):
+        super().__init__(detail or kind)
+        self.kind = kind
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def classify_error(error):
+    """Failure kind for an exception raised while talking to the portal"""
+    if isinstance(error, TimeoutError):
+        return OVERLOADED
+    return TRANSIENT
+
+
+def classify_status(status):
+    """Failure kind for the portal's HTTP status, or None if it is fine"""
+    if status == 429 or status >= 500:
+        return OVERLOADED
+    return None
+
+
+def classify_reply(text):
+    """Failure kind for a login.xml reply that rejected the login"""
+    message = (text or '').lower()
+    if re.search(r'maximum login limit|login limit|exceeded', message):
+        return LOGIN_LIMIT
+    if re.search(r'busy|try again later|too many requests', message):
+        return OVERLOADED
+    return BAD_CREDENTIALS
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def hold_until(response):
+    """Wall-clock time until which a 429/503 reply asked us to stay away, or None"""
+    if not HONOR_RETRY_AFTER or response.status_code not in (429, 503):
+        return None
+    retry_after = parse_retry_after(response.headers.get('retry-after'))
+    return time.time() + retry_after if retry_after else None
+
+
+def breaker_wait(login_url):
+    """Seconds until the breaker (or the portal's Retry-After) lets a login to
+    `login_url` through (0 if closed)"""
+    health = get_state().portal_health(login_url)
+    if not health:
+        return 0
+    now = time.time()
+    wait = max(0, health.get('hold_until', 0) - now) if HONOR_RETRY_AFTER else 0
+    if health.get('streak', 0) >= BREAKER_THRESHOLD:
+        wait = max(wait, health['last_fail'] + BREAKER_COOLDOWN - now)
+    return wait
+
+
+def start_jitter(login_urls):
+    """Random pause for a freshly captive client before its first login"""
+    limit = START_JITTER
+    now = time.time()
+    for url in login_urls:
+        health = get_state().portal_health(url) or {}
+        failing = health.get('streak') and now - health.get('last_fail', 0) < OVERLOAD_MEMORY
+        if failing or now - health.get('hold_until', 0) < OVERLOAD_MEMORY:
+            limit = max(limit, OVERLOAD_START_JITTER)
+    return random.uniform(0, limit) if limit > 0 else 0
+
+
+def login_token_wait(portal):
+    """Take a login token for `portal`; 0 if one was free, else the seconds
+    until the next one (nothing is taken then)"""
+    if not LOGIN_RATE:
+        return 0
+    return get_state().take_token('login:' + portal, LOGIN_RATE, LOGIN_BURST)
+
+
+class RetryPolicy:
+    """Decides, per failure kind, whether to retry and how long to wait"""
+
+    def __init__(self, policies=None, budget=RETRY_BUDGET):
+        self.policies = policies or RETRY_POLICIES
+        self.budget = budget
+        self.started = time.monotonic()
+        self.retries = {}
+
+    def next_delay(self, kind, retry_after=None):
+        """Seconds to wait before the next attempt, or None to give up.
+
+        `retry_after` is the portal's own answer to that question.
+        """
+        base, cap, retries = self.policies[kind]
+        n = self.retries.get(kind, 0)
+        if n >= retries:
+            return None
+        if retry_after is not None and HONOR_RETRY_AFTER:
+            delay = retry_after * (1 + random.uniform(0, RETRY_AFTER_SPREAD))
+        else:
+            delay = random.uniform(0, min(cap, base * 2 ** n))
+        if time.monotonic() - self.started + delay > self.budget:
+            return None
+        self.retries[kind] = n + 1
+        return delay
@@ -0,0 +1,355 @@
+import marshal
+import os
+import time
+
+# Small on-disk state shared by every run (triggered, monitor, engine).
+# marshal is used instead of json because it is built in: reading the
+# state on the startup fast path costs microseconds and imports nothing,
+# where importing json (and the re it pulls in) takes ~15 ms, more than
+# the whole import budget. The file starts with a header line naming the
+# format, STATE_VERSION and the marshal version; a file without the exact
+# header (an older release, another Python) is discarded unread.
+STATE_FILE = os.path.join(os.path.expanduser('~'), '.wifi_auto_login_state')
+STATE_VERSION = 2
+STATE_HEADER = b'wifi-auto-login-state %d %d\n' % (STATE_VERSION, marshal.version)
+
+# How long an observation stays trustworthy
+ONLINE_TTL = 60          # "this link was online" lets a trigger skip the probe
+ATTEMPT_TTL = 60         # monitor mode's "recent login attempt" guard
+LOGIN_LEASE_TTL = 30     # another instance is logging in
+PORTAL_HEALTH_TTL = 24 * 3600
+DISCOVERY_TTL = 7 * 24 * 3600   # portal a captive probe redirected to, and its kind
+PORTAL_SESSION_TTL = 24 * 3600  # keepalive/logout details from the last login
+PROBE_ADDRESS_TTL = 7 * 24 * 3600   # address a probe host answered 204 from
+
+# Weight of the newest sample in the portal latency and failure-rate
+# averages, and how many recent latencies are kept for percentiles
+PORTAL_EWMA_ALPHA = 0.3
+PORTAL_SAMPLES = 20
+
+
+def local_ip(host, port=80):
+    """Source address the OS would use to reach `host`, without sending a packet"""
+    import socket
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect((host.encode('ascii'), port))
+            return sock.getsockname()[0]
+    except (OSError, ValueError):
+        return None
+
+
+def link_keys(ssid=None, bssid=None, ip=None):
+    """Keys under which a link's auth state is stored, most specific first"""
+    keys = []
+    if bssid and ip:
+        keys.append(f"bssid:{bssid.lower()}|{ip}")
+    if ssid and ip:
+        keys.append(f"ssid:{ssid}|{ip}")
+    if ip:
+        keys.append(f"ip:{ip}")
+    return keys
+
+
+class _FileLock:
+    """Exclusive lock on a side file, held for one read-modify-write"""
+
+    def __init__(self, path):
+        self.path = path + '.lock'
+
+    def __enter__(self):
+        self.f = open(self.path, 'a+b')
+        if os.name == 'nt':
+            import msvcrt
+            self.f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after ~10 s; keep waiting
+        else:
+            import fcntl
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                self.f.seek(0)
+                msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.f.close()
+
+
+class StateCache:
+    """Cross-run cache of link auth state, login leases and portal health.
+
+    Every entry carries an absolute expiry (wall clock) and is ignored once
+    it has passed. Reads need no lock: writers replace the file atomically.
+    Writers serialize on a lock file so concurrent instances do not lose
+    each other's updates.
+    """
+
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                state = marshal.load(f) if f.readline() == STATE_HEADER else None
+        except (OSError, EOFError, ValueError, TypeError):
+            state = None
+        if not isinstance(state, dict) or state.get('v') != STATE_VERSION:
+            state = {'v': STATE_VERSION}
+        return state
+
+    def _save(self, state):
+        now = time.time()
+        for section in ('links', 'segments', 'attempts', 'sessions', 'portals', 'buckets',
+                        'discovered', 'portal_sessions', 'probe_hosts'):
+            entries = state.get(section)
+            if entries:
+                state[section] = {k: v for k, v in entries.items() if v.get('until', 0) > now}
+        lease = state.get('lease')
+        if lease and lease.get('until', 0) <= now:
+            del state['lease']
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(STATE_HEADER)
+            marshal.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def update(self, change):
+        """Apply `change(state)` under the lock and save; returns its result"""
+        try:
+            with _FileLock(self.path):
+                state = self.load()
+                result = change(state)
+                self._save(state)
+                return result
+        except OSError as e:
+            print(f"Error updating state cache: {e}")
+            return None
+
+    def _fresh(self, section, key):
+        entry = self.load().get(section, {}).get(key)
+        if entry and entry.get('until', 0) > time.time():
+            return entry
+        return None
+
+    # Link auth state
+
+    def link_status(self, keys):
+        """Return (status, age in seconds) for the first fresh key, or (None, None)"""
+        links = self.load().get('links', {})
+        now = time.time()
+        for key in keys:
+            entry = links.get(key)
+            if entry and entry.get('until', 0) > now:
+                return entry['status'], now - entry['ts']
+        return None, None
+
+    def set_link_status(self, keys, status, ttl=ONLINE_TTL):
+        now = time.time()
+
+        def change(state):
+            links = state.setdefault('links', {})
+            for key in keys:
+                links[key] = {'status': status, 'ts': now, 'until': now + ttl}
+
+        if keys:
+            self.update(change)
+
+    def set_segment(self, ssid, ip, bssid=None, ttl=ONLINE_TTL):
+        """Remember an authenticated segment (SSID + client IP) and the AP seen on it"""
+        now = time.time()
+
+        def change(state):
+            segments = state.setdefault('segments', {})
+            entry = segments.get(f"{ssid}|{ip}") or {'bssids': []}
+            if bssid and bssid.lower() not in entry['bssids']:
+                entry['bssids'] = (entry['bssids'] + [bssid.lower()])[-8:]
+            entry.update(ts=now, until=now + ttl)
+            segments[f"{ssid}|{ip}"] = entry
+
+        self.update(change)
+
+    def segment(self, ssid, ip):
+        return self._fresh('segments', f"{ssid}|{ip}")
+
+    # Login attempts and the single-login lease
+
+    def last_attempt(self, ssid):
+        entry = self._fresh('attempts', ssid)
+        return entry['ts'] if entry else 0
+
+    def record_attempt(self, ssid, ttl=ATTEMPT_TTL):
+        now = time.time()
+
+        def change(state):
+            state.setdefault('attempts', {})[ssid] = {'ts': now, 'until': now + ttl}
+
+        self.update(change)
+
+    def acquire_login_lease(self, ttl=LOGIN_LEASE_TTL):
+        """Claim the right to log in; False if another live instance holds it"""
+        pid = os.getpid()
+
+        def change(state):
+            lease = state.get('lease')
+            now = time.time()
+            if lease and lease['until'] > now and lease['pid'] != pid:
+                return False
+            state['lease'] = {'pid': pid, 'until': now + ttl}
+            return True
+
+        return self.update(change) is not False
+
+    def release_login_lease(self):
+        pid = os.getpid()
+
+        def change(state):
+            if state.get('lease', {}).get('pid') == pid:
+                del state['lease']
+
+        self.update(change)
+
+    def login_lease_holder(self):
+        lease = self.load().get('lease')
+        if lease and lease['until'] > time.time() and lease['pid'] != os.getpid():
+            return lease['pid']
+        return None
+
+    # Portal session and health
+
+    def set_session_expiry(self, ssid, expires_at):
+        def change(state):
+            state.setdefault('sessions', {})[ssid] = {'expires': expires_at, 'until': expires_at}
+
+        self.update(change)
+
+    def session_expiry(self, ssid):
+        entry = self._fresh('sessions', ssid)
+        return entry['expires'] if entry else None
+
+    def record_portal(self, portal_url, latency, ok, hold_until=None):
+        """Fold one request outcome into the portal's health entry.
+        `hold_until` keeps logins away until then (the portal sent Retry-After)."""
+        now = time.time()
+
+        def change(state):
+            portals = state.setdefault('portals', {})
+            entry = portals.get(portal_url) or {'latency': latency, 'ok': 0, 'fail': 0}
+            entry['fail_rate'] = ((1 - PORTAL_EWMA_ALPHA) * entry.get('fail_rate', 0)
+                                  + PORTAL_EWMA_ALPHA * (not ok))
+            if ok:
+                entry['latency'] = (PORTAL_EWMA_ALPHA * latency
+                                    + (1 - PORTAL_EWMA_ALPHA) * entry['latency'])
+                entry['samples'] = (entry.get('samples', []) + [round(latency, 4)])[-PORTAL_SAMPLES:]
+                entry['ok'] += 1
+                entry['last_ok'] = now
+                entry['streak'] = 0
+            else:
+                entry['fail'] += 1
+                entry['last_fail'] = now
+            if hold_until:
+                # The portal is alive and said when to come back: that wait
+                # replaces the circuit breaker
+                entry['hold_until'] = max(hold_until, entry.get('hold_until', 0))
+            elif not ok:
+                # Consecutive failures, for retry_policy's circuit breaker
+                entry['streak'] = entry.get('streak', 0) + 1
+            entry['until'] = now + PORTAL_HEALTH_TTL
+            portals[portal_url] = entry
+
+        self.update(change)
+
+    def portal_health(self, portal_url):
+        return self._fresh('portals', portal_url)
+
+    def set_discovered_portal(self, profile_name, portal_url, driver=None, ttl=DISCOVERY_TTL):
+        """Remember the portal URL and/or driver name a captive probe found;
+        None keeps what was known"""
+        now = time.time()
+        old = self._fresh('discovered', profile_name) or {}
+        entry = {'url': portal_url or old.get('url'), 'driver': driver or old.get('driver')}
+
+        def change(state):
+            state.setdefault('discovered', {})[profile_name] = dict(entry, until=now + ttl)
+
+        if (old.get('url'), old.get('driver')) != (entry['url'], entry['driver']):
+            self.update(change)
+
+    def discovered_portal(self, profile_name):
+        entry = self._fresh('discovered', profile_name)
+        return entry.get('url') if entry else None
+
+    def discovered_driver(self, profile_name):
+        entry = self._fresh('discovered', profile_name)
+        return entry.get('driver') if entry else None
+
+    def set_portal_session(self, profile_name, session, ttl=PORTAL_SESSION_TTL):
+        now = time.time()
+
+        def change(state):
+            state.setdefault('portal_sessions', {})[profile_name] = {'session': session,
+                                                                     'until': now + ttl}
+
+        self.update(change)
+
+    def portal_session(self, profile_name):
+        entry = self._fresh('portal_sessions', profile_name)
+        return entry['session'] if entry else None
+
+    # Probe addresses, for DNS-free probes while captive
+
+    def set_probe_address(self, host, address, ttl=PROBE_ADDRESS_TTL):
+        now = time.time()
+
+        def change(state):
+            state.setdefault('probe_hosts', {})[host] = {'address': address, 'until': now + ttl}
+
+        if self.probe_addresses().get(host) != address:
+            self.update(change)
+
+    def probe_addresses(self):
+        """host -> address it last answered a probe from"""
+        now = time.time()
+        return {host: entry['address'] for host, entry in self.load().get('probe_hosts', {}).items()
+                if entry.get('until', 0) > now}
+
+    # Login rate limit
+
+    def take_token(self, key, rate, burst):
+        """Token bucket `key` (`rate` tokens per second, at most `burst`): take
+        a token and return 0, or return the seconds until one is available"""
+        now = time.time()
+
+        def change(state):
+            buckets = state.setdefault('buckets', {})
+            entry = buckets.get(key) or {'tokens': burst, 'ts': now}
+            tokens = min(burst, entry['tokens'] + (now - entry['ts']) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            # A bucket that has refilled is the same as no entry
+            buckets[key] = {'tokens': tokens, 'ts': now, 'until': now + (burst - tokens) / rate}
+            return wait
+
+        return self.update(change) or 0
+
+
+_state = None
+
+
+def get_state():
+    global _state
+    if _state is None:
+        _state = StateCache()
+    return _state
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as core  # noqa: E402
+import state_cache  # noqa: E402
+import tracing  # noqa: E402
+from benchmark import patched  # noqa: E402
+from http_pool import get_pool  # noqa: E402
+from portal_emulator import PortalEmulator  # noqa: E402
+
+CREDENTIALS = {'username': 'user', 'password': 'secret'}
+
+
+@pytest.fixture
+def isolated(tmp_path):
+    """State, flight dumps and probe verdicts of this test only"""
+    with patched(state_cache, _state=state_cache.StateCache(str(tmp_path / 'state'))), \
+            patched(tracing, FLIGHT_DUMP_FILE=str(tmp_path / 'flight')), \
+            patched(core, TRACE_ENABLED=False, PROBE_TARGETS=[], _probe_cache={},
+                    load_credentials=lambda: dict(CREDENTIALS)):
+        yield tmp_path
+    get_pool().close()
+
+
+@pytest.fixture
+def emulator(isolated):
+    """A portal emulator that main's portal and probe URLs point at"""
+    with PortalEmulator() as emulator, \
+            patched(core, PORTAL_URL=emulator.portal_url, PROBE_URL=emulator.probe_url,
+                    PORTAL_FALLBACK_URLS=[]):
+        yield emulator
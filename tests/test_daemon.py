@@ -0,0 +1,45 @@
+"""STOP, as the installer and uninstaller send it before `schtasks /End`"""
+import socket
+import threading
+import time
+
+import daemon
+import installer
+import main as core
+from benchmark import patched
+from conftest import CREDENTIALS
+
+WIFI = {'interface': 'Wi-Fi', 'ssid': 'JIIT-AP-1', 'bssid': '00:1a:2b:00:00:01',
+        'signal': 80, 'channel': 36, 'state': 'connected', 'ip': '127.0.0.1'}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_stop_signs_out_and_exits(emulator):
+    port = free_port()
+    auth = daemon.AuthDaemon(CREDENTIALS['username'], CREDENTIALS['password'], port)
+    with patched(core, get_wifi_link=lambda: dict(WIFI), SESSION_KEEPALIVE=False):
+        server = threading.Thread(target=auth.serve, daemon=True)
+        server.start()
+        assert wait_for(lambda: auth.stats['online'] == 1)
+        assert emulator.is_online()
+
+        assert installer.stop_daemon(port)
+        server.join(5)
+    assert not server.is_alive()
+    assert not emulator.is_online()
+
+
+def test_stop_without_daemon():
+    assert installer.stop_daemon(free_port(), wait=0)
@@ -0,0 +1,48 @@
+"""Reading the links nmcli reports"""
+import subprocess
+
+import link_monitor
+from benchmark import patched
+from link_monitor import LinkBackend, NmcliMonitorBackend
+
+WIFI_LIST = (
+    "no:Guest:AA\\:BB\\:CC\\:00\\:00\\:01:40:6:wlan0\n"
+    "yes:JIIT-AP-1:00\\:1A\\:2B\\:00\\:00\\:01:80:36:wlan0\n"
+    "yes:Cafe\\: Wi-Fi:00\\:1A\\:2B\\:00\\:00\\:02:55:11:wlx001122\n"
+)
+DEVICE_SHOW = (
+    "GENERAL.DEVICE:wlan0\n"
+    "IP4.ADDRESS[1]:10.1.2.3/22\n"
+    "IP4.ADDRESS[2]:10.1.9.9/22\n"
+    "\n"
+    "GENERAL.DEVICE:wlx001122\n"
+    "IP4.ADDRESS[1]:192.168.4.20/24\n"
+    "\n"
+    "GENERAL.DEVICE:lo\n"
+    "IP4.ADDRESS[1]:127.0.0.1/8\n"
+)
+
+
+def test_split_terse():
+    assert link_monitor.split_terse("yes:a\\:b:c\\\\d:") == ['yes', 'a:b', 'c\\d', '']
+
+
+def test_parse_wifi_list():
+    links = link_monitor.parse_nmcli_wifi(WIFI_LIST)
+    assert [(link['interface'], link['ssid'], link['bssid']) for link in links] == [
+        ('wlan0', 'JIIT-AP-1', '00:1a:2b:00:00:01'),
+        ('wlx001122', 'Cafe: Wi-Fi', '00:1a:2b:00:00:02')]
+    assert links[0]['signal'] == 80 and links[0]['channel'] == 36
+
+
+def test_links_carry_each_device_address():
+    def run(args, **kwargs):
+        return subprocess.CompletedProcess(args, 0, DEVICE_SHOW if 'show' in args else WIFI_LIST, '')
+
+    backend = NmcliMonitorBackend.__new__(NmcliMonitorBackend)
+    LinkBackend.__init__(backend)
+    with patched(subprocess, run=run):
+        assert backend.current() == 'JIIT-AP-1'
+    assert {link['interface']: link['ip'] for link in backend.links()} == {
+        'wlan0': '10.1.2.3', 'wlx001122': '192.168.4.20'}
+    assert backend.stats['spawns'] == 2
@@ -0,0 +1,58 @@
+"""What the triggering event and netsh say about the adapter"""
+import os
+import pwd
+import sys
+
+import main as core
+import uninstaller
+from benchmark import patched
+
+NETSH = """
+There is 1 interface on the system:
+
+    Name                   : Wi-Fi
+    Description            : Intel(R) Wi-Fi 6 AX201 160MHz
+    GUID                   : 0a1b2c3d-0000-0000-0000-000000000000
+    State                  : connected
+    SSID                   : JIIT-AP-1
+    BSSID                  : 00:1A:2B:00:00:01
+    Channel                : 36
+    Signal                 : 80%
+"""
+
+
+def test_netsh_reports_name_and_description():
+    [wifi] = core.parse_wifi_interfaces(NETSH)
+    assert wifi['interface'] == 'Wi-Fi'
+    assert wifi['description'] == 'Intel(R) Wi-Fi 6 AX201 160MHz'
+    assert (wifi['ssid'], wifi['bssid'], wifi['signal']) == ('JIIT-AP-1', '00:1a:2b:00:00:01', 80)
+
+
+def test_event_adapter_is_a_description():
+    argv = ['main.py', '--ssid', 'JIIT-AP-1', '--adapter', 'Intel(R) Wi-Fi 6 AX201 160MHz',
+            '--ip', '10.0.0.5']
+    with patched(sys, argv=argv):
+        wifi = core.get_event_link()
+    assert wifi['interface'] is None
+    assert wifi['description'] == 'Intel(R) Wi-Fi 6 AX201 160MHz'
+    assert wifi['ip'] == '10.0.0.5'
+
+
+def test_uninstaller_uses_the_sudo_users_home():
+    user = pwd.getpwuid(os.getuid())
+    with patched(os, environ=dict(os.environ, SUDO_USER=user.pw_name, HOME='/nonexistent')), \
+            patched(sys, platform='linux'):
+        assert str(uninstaller.user_home()) == user.pw_dir
+
+
+def test_uninstaller_removes_data_files_and_keeps_profiles(tmp_path):
+    names = ['.wifi_auto_login_state', '.wifi_auto_login_state.lock',
+             '.wifi_auto_login_trace.jsonl', '.wifi_auto_login_trace.jsonl.1',
+             '.wifi_auto_login_flight.jsonl', '.wifi_auto_login.log',
+             '.wifi_auto_login_sessions.json', '.wifi_auto_login_recording.jsonl']
+    for name in names + ['.wifi_auto_login_profiles.json']:
+        (tmp_path / name).write_text('x')
+    with patched(uninstaller, user_home=lambda: tmp_path):
+        ok, message = uninstaller.remove_data_files()
+    assert ok, message
+    assert [path.name for path in tmp_path.iterdir()] == ['.wifi_auto_login_profiles.json']
@@ -0,0 +1,20 @@
+"""Mass reconnects against the emulator"""
+import loadgen
+
+
+def test_small_herd_gets_online(isolated):
+    options = {'latency': 0.01, 'capacity': 2, 'queue_limit': 5, 'retry_after': None}
+    for herd_control in (False, True):
+        summary = loadgen.run_herd(20, 0.5, options, herd_control, seed=1)
+        assert summary['online'] == 20
+        assert summary['portal_peak_waiting'] <= 5
+
+
+def test_median_summary():
+    runs = [{'herd_control': True, 'clients': 10, 'online': online, 'failures': failures,
+             **{key: value for key in loadgen.MEDIAN_FIELDS}}
+            for online, failures, value in ((10, {}, 1), (9, {'overloaded': 1}, 5), (10, {}, 2))]
+    summary = loadgen.median_summary(runs)
+    assert summary['online'] == 9
+    assert summary['failures'] == {'overloaded': 1}
+    assert summary['recovery_seconds'] == summary['shed'] == 2
@@ -0,0 +1,47 @@
+"""A bad entry in the profiles file is skipped, not fatal"""
+import json
+
+import profiles
+
+
+def load(tmp_path, config):
+    path = tmp_path / 'profiles.json'
+    path.write_text(json.dumps(config))
+    return profiles.load_profile_index(str(path))
+
+
+def test_bad_entries_are_skipped(tmp_path, capsys):
+    index = load(tmp_path, {
+        'profiles': {'campus': {'portal_url': 'http://10.0.0.1/login'},
+                     'broken': {'driver': 'no-such-portal'}},
+        'networks': [{'ssid': 'Library', 'profile': 'campus'},
+                     {'ssid': 'Annex', 'profile': 'broken'},
+                     {'pattern': '([', 'profile': 'campus'},
+                     {'pattern': '^AP-\\d+$'},
+                     {'profile': 'campus'}],
+    })
+    out = capsys.readouterr().out
+    assert "'broken'" in out and "'(['" in out and "no ssid" in out
+    assert index.rules == 2
+    assert index.classify('Library').name == 'campus'
+    assert index.classify('AP-7').name == profiles.DEFAULT_PROFILE
+    assert index.classify('Annex') is None
+
+
+def test_clashing_patterns_keep_the_first(tmp_path, capsys):
+    index = load(tmp_path, {'networks': [{'pattern': '(?P<x>^AP)'}, {'pattern': '(?P<x>^LRC)'}]})
+    assert "(?P<x>^LRC)" in capsys.readouterr().out
+    assert index.classify('AP-1') is not None
+    assert index.classify('LRC-1') is None
+
+
+def test_unusable_file_falls_back_to_keywords(tmp_path):
+    index = load(tmp_path, {'networks': [{'pattern': '(', 'profile': 'jiit'}]})
+    assert index.classify('JIIT-AP-3') is not None
+    assert index.classify('LAPTOP') is None
+    assert load(tmp_path, {'networks': 'JIIT'}).classify('JIIT-LRC') is not None
+    assert load(tmp_path, ['not', 'an', 'object']).classify('JIIT-LRC') is not None
+
+
+def test_empty_networks_match_nothing(tmp_path):
+    assert load(tmp_path, {'networks': []}).classify('JIIT-AP-3') is None
@@ -0,0 +1,63 @@
+"""Round trips: what `main.py --record` writes must replay"""
+import sys
+
+import link_monitor
+import main as core
+import replay
+from benchmark import patched
+from conftest import CREDENTIALS
+from http_pool import ConnectionPool
+
+WIFI = {'interface': 'Wi-Fi', 'ssid': 'JIIT-AP-1', 'bssid': '00:1a:2b:00:00:01',
+        'signal': 80, 'channel': 36, 'state': 'connected', 'ip': '127.0.0.1'}
+
+
+def recording(path):
+    """Undo start_recording()'s wrapping when the block ends"""
+    return patched(core, get_wifi_link=core.get_wifi_link, get_wifi_links=core.get_wifi_links,
+                   get_event_link=core.get_event_link, quick_probe=core.quick_probe), \
+        patched(ConnectionPool, request=ConnectionPool.request), \
+        patched(replay, RECORDING_FILE=str(path))
+
+
+def replayed(path, driver):
+    records = replay.load_recording(str(path))
+    world = replay.ReplayWorld(records, replay.VirtualClock(records[0]['t']))
+    return world, replay.replay(records, driver)
+
+
+def test_triggered_run_replays(emulator, isolated):
+    path = isolated / 'recording.jsonl'
+    undo_links, undo_requests, file = recording(path)
+    with undo_links, undo_requests, file, \
+            patched(sys, argv=['main.py', '--record', '--ssid', 'JIIT-AP-1',
+                               '--adapter', 'Wireless Adapter']):
+        core.main()
+    assert emulator.is_online()
+
+    world, report = replayed(path, 'main')
+    assert [wifi['ssid'] for _, wifi in world.links] == ['JIIT-AP-1']
+    assert len(world.episodes) == 1
+    assert report['online'] == report['episodes'] == 1
+
+
+def test_monitor_run_replays(emulator, isolated):
+    path = isolated / 'recording.jsonl'
+
+    class TwoPolls(link_monitor.PollingBackend):
+        def wait(self, timeout=None):
+            self.closed = self.stats['wakeups'] >= 1
+            self._count('wakeups')
+
+    with patched(core, get_wifi_links=lambda: [dict(WIFI)],
+                 get_wifi_link=lambda: dict(WIFI), SESSION_KEEPALIVE=False):
+        undo_links, undo_requests, file = recording(path)
+        with undo_links, undo_requests, file:
+            replay.start_recording(core)
+            core.monitor_wifi_changes(CREDENTIALS['username'], CREDENTIALS['password'],
+                                      TwoPolls(interval=0.01))
+    assert emulator.is_online()
+
+    world, report = replayed(path, 'events')
+    assert [wifi['ssid'] for _, wifi in world.links] == ['JIIT-AP-1']
+    assert report['online'] == report['episodes'] == 1
@@ -0,0 +1,62 @@
+"""The benchmark's emulator scenarios, as pass/fail checks"""
+import time
+
+import pytest
+
+import auth_engine
+import benchmark
+import main as core
+import retry_policy
+from benchmark import patched
+
+
+def run(name, driver):
+    result = benchmark.run_scenario(name, driver, iterations=1, max_seconds=60)
+    assert benchmark.problems(result) == []
+    return result
+
+
+@pytest.mark.parametrize('driver', ['attempt_login', 'main', 'engine'])
+def test_firewall_delay_is_not_a_failure(isolated, driver):
+    # The portal accepts at once but opens the firewall 4 s later
+    result = run('firewall-4s', driver)
+    assert result['p50'] >= 4
+
+
+@pytest.mark.parametrize('driver', ['attempt_login', 'main', 'engine'])
+def test_wrong_password_fails_fast(isolated, driver):
+    t0 = time.monotonic()
+    result = run('wrong-password', driver)
+    assert result['failures'] == 1
+    # Bad credentials are never retried
+    assert result['requests_per_run']['login.xml'] == 1
+    assert time.monotonic() - t0 < 2
+
+
+@pytest.mark.parametrize('name', ['sophos-xg', 'fortigate', 'pfsense', 'portal-moved'])
+@pytest.mark.parametrize('driver', ['attempt_login', 'main', 'engine'])
+def test_vendor_is_recognised(isolated, name, driver):
+    result = run(name, driver)
+    assert result['failures'] == 0
+
+
+def test_startup_budget(capsys):
+    # Also fails when the fast path loads one of benchmark.HEAVY_MODULES
+    assert benchmark.check_startup(3), capsys.readouterr().out
+
+
+
+def test_engine_stops_at_the_breaker(emulator):
+    # Like a one-shot run, the engine sends no login while the circuit
+    # breaker is open
+    emulator.reply_mode = 'overloaded'
+    failures = []
+    with patched(core, get_wifi_link=lambda: dict(benchmark.WIFI)), \
+            patched(retry_policy, OVERLOAD_START_JITTER=0):
+        for _ in range(retry_policy.BREAKER_THRESHOLD + 1):
+            core.forget_probes()
+            auth = auth_engine.Authenticator('user', 'secret', timeout=1)
+            assert not auth.run()
+            failures.append(auth.failure)
+    assert failures[-1] == retry_policy.PORTAL_DOWN
+    assert emulator.counters['login.xml'] == retry_policy.BREAKER_THRESHOLD
@@ -0,0 +1,18 @@
+"""The state file's format header"""
+import marshal
+
+import state_cache
+
+
+def test_state_round_trips(tmp_path):
+    path = str(tmp_path / 'state')
+    state_cache.StateCache(path).set_session_expiry('JIIT-AP-1', 1e12)
+    assert state_cache.StateCache(path).session_expiry('JIIT-AP-1') == 1e12
+
+
+def test_untagged_state_is_discarded(tmp_path):
+    path = tmp_path / 'state'
+    with open(path, 'wb') as f:
+        marshal.dump({'v': state_cache.STATE_VERSION,
+                      'sessions': {'JIIT-AP-1': {'expires': 1e12, 'until': 1e12}}}, f)
+    assert state_cache.StateCache(str(path)).session_expiry('JIIT-AP-1') is None
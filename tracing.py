@@ -0,0 +1,316 @@
+import _thread
+import atexit
+import os
+import time
+from _collections import deque
+
+# Kept to cheap imports (no threading, json or logging at import time):
+# main.py loads this module on every triggered run. The C modules behind
+# the public ones are used where `benchmark.py --startup` shows the
+# difference: threading and json are on its list of heavy modules, and
+# collections adds ~2.5 ms to `import main` against ~0.1 ms for
+# _collections. Both _thread and _collections are built into CPython.
+
+# JSON-lines trace of every timed phase, rotated so it never grows unbounded
+TRACE_FILE = os.path.join(os.path.expanduser('~'), '.wifi_auto_login_trace.jsonl')
+TRACE_MAX_BYTES = 1024 * 1024
+TRACE_BACKUPS = 3
+
+# Latency histogram bucket upper bounds, in seconds
+BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# One id per process so all spans of a triggered run can be grouped
+RUN_ID = f"{int(time.time()):x}-{os.getpid()}"
+
+# Flight recorder: the last FLIGHT_RECORDER_SIZE spans and events stay in
+# memory (even with tracing off) and are dumped to FLIGHT_DUMP_FILE when a
+# run fails or on a signal
+FLIGHT_RECORDER_SIZE = 512
+FLIGHT_DUMP_FILE = os.path.join(os.path.expanduser('~'), '.wifi_auto_login_flight.jsonl')
+
+# Console output of background runs (`--background`) goes here instead
+LOG_FILE = os.path.join(os.path.expanduser('~'), '.wifi_auto_login.log')
+
+_trace_path = None
+_trace_lock = _thread.allocate_lock()
+
+flight_recorder = deque(maxlen=FLIGHT_RECORDER_SIZE)
+
+# Lines waiting for the writer thread, as (path, text)
+_queue = []
+_queue_lock = _thread.allocate_lock()
+_wakeup = _thread.allocate_lock()
+_wakeup.acquire()
+_writer_started = False
+
+
+def enable_trace_file(path=TRACE_FILE):
+    """Start appending spans to `path`"""
+    global _trace_path
+    _trace_path = path
+
+
+def _rotate(path):
+    for i in range(TRACE_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def _to_json(entry):
+    """Encode a flat dict of scalars as JSON.
+
+    Uses the C string encoder directly so writing a trace line does not
+    pull in the json package (and re) on the fast startup path.
+    """
+    try:
+        from _json import encode_basestring_ascii as quote
+    except ImportError:
+        import json
+        return json.dumps(entry, default=str)
+    fields = []
+    for key, value in entry.items():
+        if value is None or isinstance(value, bool):
+            value = {None: 'null', True: 'true', False: 'false'}[value]
+        elif isinstance(value, (int, float)):
+            value = repr(value)
+        else:
+            value = quote(str(value))
+        fields.append(f"{quote(str(key))}: {value}")
+    return '{' + ', '.join(fields) + '}'
+
+
+def _enqueue(path, text):
+    """Hand a line to the background writer; never blocks on the disk"""
+    global _writer_started
+    with _queue_lock:
+        _queue.append((path, text))
+        if not _writer_started:
+            _writer_started = True
+            _thread.start_new_thread(_writer, ())
+            atexit.register(flush)
+    try:
+        _wakeup.release()
+    except RuntimeError:
+        pass  # already signalled
+
+
+def _writer():
+    while True:
+        _wakeup.acquire()
+        flush()
+
+
+def flush():
+    """Write out everything queued so far (writer thread, exit and dumps)"""
+    with _trace_lock:
+        with _queue_lock:
+            batch = _queue[:]
+            del _queue[:]
+        by_path = {}
+        for path, text in batch:
+            by_path.setdefault(path, []).append(text)
+        for path, texts in by_path.items():
+            try:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(texts))
+                    size = f.tell()
+                if size > TRACE_MAX_BYTES:
+                    _rotate(path)
+            except OSError:
+                pass
+
+
+def _write_trace(entry):
+    _enqueue(_trace_path, _to_json(entry) + '\n')
+
+
+def event(name, **attrs):
+    """Record a point-in-time event (link change, portal reply, ...)"""
+    entry = {'run': RUN_ID, 'ts': round(time.time(), 3), 'event': name}
+    entry.update(attrs)
+    flight_recorder.append(entry)
+    if _trace_path:
+        _write_trace(entry)
+
+
+def dump_flight_recorder(reason):
+    """Append the recorder's contents to FLIGHT_DUMP_FILE; returns the path"""
+    header = {'run': RUN_ID, 'ts': round(time.time(), 3), 'dump': reason,
+              'events': len(flight_recorder)}
+    lines = [_to_json(header)] + [_to_json(entry) for entry in list(flight_recorder)]
+    _enqueue(FLIGHT_DUMP_FILE, '\n'.join(lines) + '\n')
+    flush()
+    return FLIGHT_DUMP_FILE
+
+
+def install_dump_signals():
+    """Dump the flight recorder on SIGUSR1 / Ctrl+Break, and before exiting on SIGTERM"""
+    import signal
+    
+    def dump(signum, frame):
+        dump_flight_recorder(f"signal {signum}")
+    
+    def dump_and_exit(signum, frame):
+        dump_flight_recorder(f"signal {signum}")
+        raise SystemExit(128 + signum)
+    
+    for name, handler in (('SIGUSR1', dump), ('SIGBREAK', dump), ('SIGTERM', dump_and_exit)):
+        if hasattr(signal, name):
+            try:
+                signal.signal(getattr(signal, name), handler)
+            except (OSError, ValueError):
+                pass  # not the main thread, or not supported here
+
+
+class BackgroundLog:
+    """stdout replacement for runs nobody watches: timestamped lines go to
+    LOG_FILE through the writer thread instead of a console"""
+
+    def __init__(self, path=LOG_FILE):
+        self.path = path
+        self._buffer = ''
+
+    def write(self, text):
+        self._buffer += text
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            _enqueue(self.path, f"{time.strftime('%Y-%m-%d %H:%M:%S')} [{RUN_ID}] {line}\n")
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class Metrics:
+    """Counters and latency histograms aggregated from spans"""
+
+    def __init__(self):
+        self._lock = _thread.allocate_lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = {
+                    'buckets': [0] * (len(BUCKETS) + 1), 'count': 0, 'sum': 0.0}
+            index = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound),
+                         len(BUCKETS))
+            hist['buckets'][index] += 1
+            hist['count'] += 1
+            hist['sum'] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {k: {'buckets': list(v['buckets']), 'count': v['count'],
+                                   'sum': v['sum']} for k, v in self.histograms.items()},
+            }
+
+    def prometheus(self):
+        """Render the snapshot in the Prometheus text format"""
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap['counters'].items()):
+            metric = 'jiit_' + name.replace('.', '_').replace('-', '_') + '_total'
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, hist in sorted(snap['histograms'].items()):
+            metric = 'jiit_' + name.replace('.', '_').replace('-', '_') + '_seconds'
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ['+Inf'], hist['buckets']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{metric}_sum {hist['sum']:.6f}")
+            lines.append(f"{metric}_count {hist['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def record(name, duration, ok=True, **attrs):
+    """Record one finished phase: histogram, counters and a trace line"""
+    metrics.observe(name, duration)
+    metrics.incr(name if ok else name + '.error')
+    entry = {'run': RUN_ID, 'ts': round(time.time(), 3), 'span': name,
+             'ms': round(duration * 1000, 2), 'ok': ok}
+    entry.update(attrs)
+    flight_recorder.append(entry)
+    if _trace_path:
+        _write_trace(entry)
+
+
+class _Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self.attrs
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        record(self.name, time.monotonic() - self.start, exc_type is None, **self.attrs)
+        return False
+
+
+def span(name, **attrs):
+    """Time a phase with the monotonic clock.
+
+    Use as `with span('probe') as s:`; the dict `s` can be filled with
+    attributes (result, reused, ...) while the phase runs, and an exception
+    marks the span as failed.
+    """
+    return _Span(name, attrs)
+
+
+def traced_sleep(seconds, reason):
+    """time.sleep() that shows up in the trace"""
+    with span('sleep', reason=reason, planned=seconds):
+        time.sleep(seconds)
+
+
+def serve_metrics(port, host='127.0.0.1'):
+    """Serve /metrics (Prometheus text) and /metrics.json on a local port"""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/metrics.json'):
+                import json
+                body = json.dumps(metrics.snapshot()).encode()
+                content_type = 'application/json'
+            elif self.path.startswith('/metrics'):
+                body = metrics.prometheus().encode()
+                content_type = 'text/plain; version=0.0.4'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -7,6 +7,13 @@ import ctypes
 # Installation directory
 INSTALL_DIR = os.path.join(os.environ.get('LOCALAPPDATA', ''), 'JIIT-WifiAutoAuthenticator')
 
+# The daemon's control port (main.DAEMON_PORT). Its STOP command signs the
+# portal session out before exiting; `schtasks /End` kills it outright, so
+# STOP goes first. Nothing authenticates STOP: any local process can send it.
+DAEMON_PORT = 47611
+# Seconds to wait for it to exit (the logout takes up to LOGOUT_TIMEOUT)
+DAEMON_STOP_WAIT = 4
+
 def is_admin():
     """Check if script is running with admin privileges"""
     try:
@@ -26,10 +33,32 @@ def run_as_admin():
     return True
 
 
-def remove_task_scheduler_task():
-    """Remove the Task Scheduler task"""
-    task_name = "JIIT-AutoAuth"
+def stop_daemon(port=DAEMON_PORT, wait=DAEMON_STOP_WAIT):
+    """Ask a running daemon to sign out of the portal and exit; True once
+    nothing listens on its port any more"""
+    import socket
+    import time
+    
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=1) as sock:
+            sock.sendall(b'STOP\n')
+            sock.recv(64)
+    except OSError:
+        return True  # no daemon running
     
+    # It answers before signing out; wait for the port to close
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+        except OSError:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def remove_task_scheduler_task(task_name="JIIT-AutoAuth"):
+    """Remove a Task Scheduler task"""
     try:
         # Check if task exists
         result = subprocess.run(
@@ -40,7 +69,11 @@ def remove_task_scheduler_task():
         )
         
         if result.returncode != 0:
-            return True, "Task was not found (already removed or never installed)"
+            return True, f"Task {task_name} was not found (already removed or never installed)"
+        
+        # Stop it in case it is the running daemon (after STOP in main(),
+        # this only catches one that did not exit in time)
+        subprocess.run(['schtasks', '/End', '/TN', task_name], capture_output=True, check=False)
         
         # Delete the task
         result = subprocess.run(
@@ -50,7 +83,7 @@ def remove_task_scheduler_task():
             check=True
         )
         
-        return True, "Task Scheduler entry removed successfully!"
+        return True, f"Task Scheduler entry {task_name} removed successfully!"
     
     except subprocess.CalledProcessError as e:
         return False, f"Error removing task: {e.stderr}"
@@ -58,9 +91,33 @@ def remove_task_scheduler_task():
         return False, f"Unexpected error: {str(e)}"
 
 
+def remove_dispatcher_hook(path='/etc/NetworkManager/dispatcher.d/90-jiit-autoauth'):
+    """Remove the NetworkManager dispatcher script the Linux installer registers"""
+    try:
+        if not os.path.exists(path):
+            return True, f"NetworkManager hook was not found: {path}"
+        os.remove(path)
+        return True, f"NetworkManager hook removed: {path}"
+    except OSError as e:
+        return False, f"Error removing NetworkManager hook: {e}"
+
+
+def user_home():
+    """Home directory of the user the program was set up for: under sudo on
+    Linux that is the invoking user's (SUDO_USER), not root's"""
+    user = os.environ.get('SUDO_USER')
+    if user and sys.platform.startswith('linux'):
+        import pwd
+        try:
+            return Path(pwd.getpwnam(user).pw_dir)
+        except KeyError:
+            pass
+    return Path.home()
+
+
 def remove_config_file():
     """Remove the saved credentials configuration file"""
-    config_file = Path.home() / '.wifi_auto_login_config.json'
+    config_file = user_home() / '.wifi_auto_login_config.json'
     
     try:
         if config_file.exists():
@@ -80,6 +137,33 @@ def remove_config_file():
         return False, f"Error removing credentials file: {str(e)}"
 
 
+# What the program keeps in the user's home besides the credentials: the
+# state cache (with its lock), the trace and its rotated backups, the flight
+# dump, the background log, the keepalive session history and the replay
+# recording. The network profiles file is written by the user and is kept.
+DATA_FILE_PATTERNS = ['.wifi_auto_login_state*', '.wifi_auto_login_trace.jsonl*',
+                      '.wifi_auto_login_flight.jsonl', '.wifi_auto_login.log*',
+                      '.wifi_auto_login_sessions.json', '.wifi_auto_login_recording.jsonl']
+
+
+def remove_data_files():
+    """Remove the program's state, logs and traces from the user's home"""
+    home = user_home()
+    removed, failed = [], []
+    for pattern in DATA_FILE_PATTERNS:
+        for path in sorted(home.glob(pattern)):
+            try:
+                path.unlink()
+                removed.append(path.name)
+            except OSError as e:
+                failed.append(f"{path.name} ({e})")
+    if failed:
+        return False, f"Could not delete: {', '.join(failed)}"
+    if not removed:
+        return True, f"No state, log or trace files found in {home}"
+    return True, f"Removed {len(removed)} state, log and trace files from {home}"
+
+
 def get_program_files():
     """Get list of program files using keyword-based detection"""
     if getattr(sys, 'frozen', False):
@@ -168,8 +252,9 @@ def main():
     
     # Confirm uninstallation
     print("The following will be removed:")
-    print("  • Task Scheduler auto-authentication task")
+    print("  • Task Scheduler auto-authentication task(s)")
     print("  • Saved WiFi login credentials")
+    print("  • State, log and trace files in your home folder")
     print("  • Program files (you will be asked)")
     print()
     
@@ -188,20 +273,30 @@ def main():
     
     # Step 1: Remove Task Scheduler task
     print("[1/3] Removing automatic authentication task...")
-    success, message = remove_task_scheduler_task()
-    if success:
-        print(f"  ✓ {message}")
+    # Let a running daemon sign out of the portal before its task is ended
+    if stop_daemon():
+        print("  ✓ Daemon stopped (if one was running)")
+    else:
+        print("  ✗ Daemon did not exit in time, ending it")
+    if sys.platform.startswith('linux'):
+        removals = [remove_dispatcher_hook()]
     else:
-        print(f"  ✗ {message}")
+        removals = [remove_task_scheduler_task(task_name)
+                    for task_name in ("JIIT-AutoAuth", "JIIT-AutoAuth-Daemon")]
+    for success, message in removals:
+        if success:
+            print(f"  ✓ {message}")
+        else:
+            print(f"  ✗ {message}")
     print()
     
-    # Step 2: Remove config file
-    print("[2/3] Deleting saved credentials...")
-    success, message = remove_config_file()
-    if success:
-        print(f"  ✓ {message}")
-    else:
-        print(f"  ✗ {message}")
+    # Step 2: Remove config file and the program's data
+    print("[2/3] Deleting saved credentials and program data...")
+    for success, message in (remove_config_file(), remove_data_files()):
+        if success:
+            print(f"  ✓ {message}")
+        else:
+            print(f"  ✗ {message}")
     print()
     
     # Step 3: Ask about program files
@@ -260,6 +355,7 @@ def main():
     print("Successfully removed:")
     print("  ✓ Automatic authentication task")
     print("  ✓ Saved login credentials")
+    print("  ✓ State, log and trace files")
     
     if delete_files in ['yes', 'y']:
         print("  ✓ Program executables")